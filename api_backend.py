@@ -3,14 +3,17 @@ FastAPI Backend for Predicare VoiceBot
 Provides REST API endpoints for AI Doctor functionality
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
+from contextlib import asynccontextmanager
 import os
-import tempfile
+import json
+import asyncio
 import base64
+import time
 from datetime import datetime
 
 # Load environment variables
@@ -18,18 +21,101 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import your AI Doctor modules
-from brain_of_the_doctor import analyze_image_with_query, encode_image
-from voice_of_the_patient import transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_elevenlabs
+from brain_of_the_doctor import analyze_image_with_query, stream_image_analysis_with_query, prepare_image
+from voice_of_the_patient import request_transcription_with_groq, stt_model as STT_MODEL
+from voice_of_the_doctor import (
+    text_to_speech_bytes_with_elevenlabs,
+    stream_text_to_speech_with_elevenlabs,
+    ELEVENLABS_VOICE,
+    ELEVENLABS_MODEL,
+    ELEVENLABS_OUTPUT_FORMAT
+)
+from tts_cache import (
+    get_tts_cache,
+    tts_cache_key,
+    TTS_CACHE_SWEEP_INTERVAL,
+    TTS_STREAM_TEE,
+    AUDIO_CACHE_CONTROL,
+    AUDIO_ACCEL_REDIRECT
+)
+from stt_cache import get_stt_cache, stt_cache_key
+from audio_preprocessing import preprocess_audio
+from image_preprocessing import cache_stats as image_cache_stats
+from uploads import (
+    save_upload,
+    read_upload,
+    write_temp_file,
+    UploadTooLarge,
+    RequestSizeLimitMiddleware,
+    MAX_AUDIO_UPLOAD_BYTES,
+    MAX_IMAGE_UPLOAD_BYTES
+)
+from batch import run_batch, estimate_tokens, BATCH_MAX_ITEMS, BATCH_CONCURRENCY
+from speech_pipeline import TTS_PIPELINED, synthesize_pipelined_async
+from upstream_pool import run_blocking, pool_stats, shutdown_pool
+from rate_limit import call_with_retries, iterate_with_retries, limiter_stats, UpstreamRateLimited
+from circuit_breaker import get_breaker, breaker_stats, CircuitOpen
+from hedging import hedging_stats
+from upstream_clients import warm_up, close_clients
+from providers import get_llm_provider, provider_stats
+from tracing import TracingMiddleware, span
+from voice_session import (
+    UtteranceSegmenter,
+    pcm_to_wav,
+    AUDIO_TARGET_SAMPLE_RATE,
+    VOICE_MAX_SESSION_SECONDS,
+    VOICE_MIN_SAMPLE_RATE,
+    VOICE_MAX_SAMPLE_RATE
+)
+from jobs import get_job_queue, job_stats, check_webhook_url, JOB_MAX_WAIT
+from metrics import (
+    MetricsMiddleware, observe_stage, count_fallback, count_upstream_bytes, register_stats, mark_worker_stopped,
+    render as render_metrics,
+)
+
+async def sweep_audio_periodically():
+    """Remove expired clips from the TTS cache until cancelled"""
+    while True:
+        await asyncio.sleep(TTS_CACHE_SWEEP_INTERVAL)
+        try:
+            removed = await run_blocking(None, get_tts_cache().sweep)
+            if removed:
+                print(f"Audio sweep removed {removed} files")
+        except Exception as sweep_error:
+            print(f"Audio sweep failed: {sweep_error}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open upstream connections before the first request arrives
+    if os.environ.get("UPSTREAM_WARMUP", "true").lower() in ("1", "true", "yes"):
+        await run_blocking(None, warm_up)
+    # Scanning the clip directory and opening the SQLite files can take a while,
+    # so do it here off the event loop rather than in the first request
+    await run_blocking(None, get_tts_cache)
+    job_queue = await run_blocking(None, get_job_queue)
+    sweeper = asyncio.create_task(sweep_audio_periodically())
+    job_queue.start({"consultation": run_consultation_job})
+    yield
+    sweeper.cancel()
+    # Before the pool goes away, so interrupted jobs can be put back in the queue
+    await get_job_queue().stop()
+    shutdown_pool()
+    close_clients()
+    mark_worker_stopped()
 
 app = FastAPI(
     title="Predicare VoiceBot API",
     description="AI Doctor with Voice & Vision - REST API Backend",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
+# Refuse oversized bodies before they are buffered; added before CORS so its
+# early 413s still get the CORS headers a browser needs to read them
+app.add_middleware(RequestSizeLimitMiddleware)
+
 # CORS middleware for TypeScript frontend
 app.add_middleware(
     CORSMiddleware,
@@ -37,8 +123,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read per-request timings, the trace ID and job queue hints
+    expose_headers=["Server-Timing", "X-Trace-Id", "X-Audio-Url", "Location", "Retry-After"],
+)
+
+# Outermost, so rejected and failed requests are counted and traced too
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+register_stats(
+    caches=lambda: {
+        "tts": get_tts_cache().stats(),
+        "stt_memory": get_stt_cache().stats()["memory"],
+        "stt_persistent": get_stt_cache().stats()["persistent"],
+        "image_memory": image_cache_stats()["memory"],
+        "image_persistent": image_cache_stats()["persistent"],
+    },
+    pool=pool_stats,
+    limiters=limiter_stats,
+    breakers=breaker_stats,
+    jobs=job_stats,
 )
 
+# Models used by the analysis endpoints
+VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+TEXT_MODEL = "llama-3.1-8b-instant"
+
+# System prompt for medical analysis
+ANALYSIS_SYSTEM_PROMPT = """You are a medical AI assistant for educational purposes only. 
+        Based on the patient's description, provide general medical information and suggest when to seek professional care. 
+        Always remind patients that this is not a substitute for professional medical advice."""
+
 # Pydantic models for request/response
 class TranscriptionResponse(BaseModel):
     transcription: str
@@ -73,6 +188,39 @@ class ConsultationResponse(BaseModel):
     success: bool
     message: str
 
+class BatchAnalysisRequest(BaseModel):
+    items: List[AnalysisRequest]
+    concurrency: Optional[int] = None
+
+class BatchConsultationRequest(BaseModel):
+    items: List[ConsultationRequest]
+    concurrency: Optional[int] = None
+
+class BatchItemResult(BaseModel):
+    index: int
+    success: bool
+    analysis: Optional[str] = None
+    audio_url: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+    success: bool
+    message: str
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    queue_position: Optional[int] = None
+    result: Optional[ConsultationResponse] = None
+    error: Optional[str] = None
+
 # Health check endpoint
 @app.get("/")
 async def root():
@@ -83,7 +231,15 @@ async def root():
             "/transcribe",
             "/analyze", 
             "/synthesize",
+            "/synthesize/stream",
             "/consultation",
+            "/consultation/stream",
+            "/batch/analyze",
+            "/batch/consultation",
+            "/jobs/consultation",
+            "/jobs/{job_id}",
+            "/voice/session",
+            "/metrics",
             "/docs"
         ]
     }
@@ -91,15 +247,35 @@ async def root():
 # Health check
 @app.get("/health")
 async def health_check():
+    # The cache and job stats query SQLite files, so they are gathered off the event loop
+    return await run_blocking(None, _health_stats)
+
+def _health_stats():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "services": {
             "groq": bool(os.environ.get("GROQ_API_KEY")),
             "elevenlabs": bool(os.environ.get("ELEVENLABS_API_KEY"))
-        }
+        },
+        "providers": provider_stats(),
+        "upstream_pool": pool_stats(),
+        "rate_limits": limiter_stats(),
+        "circuit_breakers": breaker_stats(),
+        "hedging": hedging_stats(),
+        "tts_cache": get_tts_cache().stats(),
+        "stt_cache": get_stt_cache().stats(),
+        "image_cache": image_cache_stats(),
+        "jobs": job_stats()
     }
 
+# Prometheus scrape endpoint
+@app.get("/metrics")
+async def metrics():
+    # Collecting calls the same blocking stats() as /health
+    body, content_type = await run_blocking(None, render_metrics)
+    return Response(content=body, media_type=content_type)
+
 # Speech-to-Text endpoint
 @app.post("/transcribe", response_model=TranscriptionResponse)
 async def transcribe_audio(audio: UploadFile = File(...)):
@@ -108,26 +284,11 @@ async def transcribe_audio(audio: UploadFile = File(...)):
     if not audio.content_type.startswith('audio/'):
         raise HTTPException(status_code=400, detail="File must be audio format")
     
+    # Stream uploaded audio to a temporary file without holding it in memory
+    temp_audio_path = await save_audio_upload(audio)
+    
     try:
-        # Save uploaded audio to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            content = await audio.read()
-            temp_file.write(content)
-            temp_audio_path = temp_file.name
-        
-        # Transcribe using Groq
-        groq_api_key = os.environ.get("GROQ_API_KEY")
-        if not groq_api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
-        
-        transcription = transcribe_with_groq(
-            audio_filepath=temp_audio_path,
-            GROQ_API_KEY=groq_api_key,
-            stt_model="whisper-large-v3"
-        )
-        
-        # Clean up temp file
-        os.unlink(temp_audio_path)
+        transcription = await transcribe_file(temp_audio_path)
         
         return TranscriptionResponse(
             transcription=transcription,
@@ -135,15 +296,68 @@ async def transcribe_audio(audio: UploadFile = File(...)):
             message="Audio transcribed successfully"
         )
         
+    except UpstreamRateLimited:
+        raise
     except Exception as e:
-        # Clean up temp file if it exists
-        if 'temp_audio_path' in locals():
-            try:
-                os.unlink(temp_audio_path)
-            except:
-                pass
-        
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+    finally:
+        # Clean up temp file
+        _remove_file(temp_audio_path)
+
+async def save_audio_upload(audio: UploadFile) -> str:
+    """Copy an audio upload to a temporary file, keeping its extension for the decoder"""
+    suffix = os.path.splitext(audio.filename or "")[1] or ".wav"
+    return await save_upload(audio, MAX_AUDIO_UPLOAD_BYTES, "Audio", suffix=suffix)
+
+async def transcribe_file(temp_audio_path: str) -> str:
+    """Transcribe an audio file using Groq Whisper"""
+    def read_audio():
+        with open(temp_audio_path, "rb") as audio_file:
+            return audio_file.read()
+    
+    with observe_stage("transcription"):
+        audio_bytes = await run_blocking(None, read_audio)
+        return await transcribe_bytes(audio_bytes, os.path.basename(temp_audio_path))
+
+async def transcribe_bytes(audio_bytes: bytes, filename: str, language: str = "en") -> str:
+    """Transcribe audio in memory, answering repeated recordings from the STT cache
+    
+    The cache lookup and the audio preprocessing happen before the rate
+    limiter: only the Whisper request itself takes a request token and a
+    Groq slot, and cache hits never wait out a Retry-After pause.
+    """
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    if not groq_api_key:
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+    
+    cache = get_stt_cache()
+    cache_key = stt_cache_key(audio_bytes, STT_MODEL, language)
+    cached = await run_blocking(None, cache.get, cache_key)
+    if cached is not None:
+        return cached
+    
+    # 16 kHz mono, silence trimmed, compact codec
+    upload_bytes, upload_name = await run_blocking(None, preprocess_audio, audio_bytes, filename)
+    
+    transcription = await call_with_retries(
+        "groq",
+        request_transcription_with_groq,
+        groq_api_key,
+        upload_bytes,
+        upload_name,
+        STT_MODEL,
+        language,
+        limiter_model=STT_MODEL
+    )
+    await run_blocking(None, cache.put, cache_key, transcription)
+    return transcription
+
+def _remove_file(path: str):
+    with span("tempfile_remove"):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
 # Medical Analysis endpoint
 @app.post("/analyze", response_model=AnalysisResponse)
@@ -155,40 +369,15 @@ async def analyze_medical_query(request: AnalysisRequest):
         if not groq_api_key:
             raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
         
-        # System prompt for medical analysis
-        system_prompt = """You are a medical AI assistant for educational purposes only. 
-        Based on the patient's description, provide general medical information and suggest when to seek professional care. 
-        Always remind patients that this is not a substitute for professional medical advice."""
-        
-        full_query = f"{system_prompt}\n\nPatient describes: {request.query}"
-        
-        # If image is provided, try vision analysis first
+        image_content = None
         if request.image_base64:
             try:
-                # Save base64 image to temp file
-                image_data = base64.b64decode(request.image_base64)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-                    temp_file.write(image_data)
-                    temp_image_path = temp_file.name
-                
-                # Try vision analysis
-                encoded_image = encode_image(temp_image_path)
-                analysis = analyze_image_with_query(
-                    query=full_query,
-                    model="meta-llama/llama-4-scout-17b-16e-instruct",
-                    encoded_image=encoded_image
-                )
-                
-                # Clean up temp file
-                os.unlink(temp_image_path)
-                
-            except Exception as vision_error:
-                print(f"Vision analysis failed: {vision_error}")
-                # Fallback to text-only analysis
-                analysis = await text_only_analysis(request.query, groq_api_key)
-        else:
-            # Text-only analysis
-            analysis = await text_only_analysis(request.query, groq_api_key)
+                with span("base64_decode"):
+                    image_content = base64.b64decode(request.image_base64)
+            except ValueError as decode_error:
+                print(f"Ignoring undecodable image: {decode_error}")
+        
+        analysis = await run_analysis(request.query, groq_api_key, image_content)
         
         return AnalysisResponse(
             analysis=analysis,
@@ -196,16 +385,64 @@ async def analyze_medical_query(request: AnalysisRequest):
             message="Analysis completed successfully"
         )
         
+    except UpstreamRateLimited:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
-async def text_only_analysis(query: str, groq_api_key: str) -> str:
-    """Fallback text-only medical analysis"""
-    from groq import Groq
+async def run_analysis(query: str, groq_api_key: str, image_content=None) -> str:
+    """Analyze a query, trying vision first when raw image bytes are given
     
-    client = Groq(api_key=groq_api_key)
+    The image stays in memory (bytes or memoryview), is downscaled and
+    recompressed by prepare_image, and is base64-encoded exactly once, for
+    the data URL sent upstream.
     
-    medical_prompt = f"""You are a medical AI assistant for educational purposes only.
+    While the vision model's circuit is open the text fallback is used
+    straight away instead of waiting for another vision failure.
+    """
+    if image_content:
+        try:
+            # Timed on its own and kept out of the breaker: a bad upload says nothing about the model
+            with observe_stage("image_prep"):
+                encoded_image, mime_type = await run_blocking(None, prepare_image, image_content)
+            with get_breaker(VISION_MODEL).guard(), observe_stage("vision"):
+                full_query = f"{ANALYSIS_SYSTEM_PROMPT}\n\nPatient describes: {query}"
+                return await call_with_retries(
+                    "groq",
+                    analyze_image_with_query,
+                    tokens=estimate_tokens(full_query, has_image=True),
+                    query=full_query,
+                    limiter_model=VISION_MODEL,
+                    hedge=True,
+                    model=VISION_MODEL,
+                    encoded_image=encoded_image,
+                    mime_type=mime_type
+                )
+        except CircuitOpen as circuit_error:
+            count_fallback("circuit_open")
+            print(f"Skipping vision analysis: {circuit_error}")
+        except Exception as vision_error:
+            count_fallback("vision_error")
+            print(f"Vision analysis failed: {vision_error}")
+    
+    # Text-only analysis (also the fallback when vision fails)
+    return await text_only_analysis(query, groq_api_key)
+
+async def text_only_analysis(query: str, groq_api_key: str) -> str:
+    """Fallback text-only medical analysis"""
+    with observe_stage("text"):
+        return await call_with_retries(
+            "groq",
+            _text_only_completion,
+            query,
+            groq_api_key,
+            limiter_model=TEXT_MODEL,
+            hedge=True,
+            tokens=estimate_tokens(_text_only_prompt(query))
+        )
+
+def _text_only_prompt(query: str) -> str:
+    return f"""You are a medical AI assistant for educational purposes only.
 
 Patient describes: "{query}"
 
@@ -216,15 +453,73 @@ Please provide:
 4. When to seek immediate medical attention
 
 Keep your response concise (2-3 sentences) and always recommend consulting a healthcare professional for proper diagnosis."""
-    
-    completion = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[{"role": "user", "content": medical_prompt}],
+
+def _text_only_completion(query: str, groq_api_key: str) -> str:
+    """Blocking Groq call behind text_only_analysis"""
+    return get_llm_provider().complete(
+        groq_api_key,
+        TEXT_MODEL,
+        [{"role": "user", "content": _text_only_prompt(query)}],
         max_tokens=200,
         temperature=0.7
     )
+
+def _text_only_stream(query: str, groq_api_key: str):
+    """Blocking Groq streaming call, yields the answer token by token"""
+    yield from get_llm_provider().stream(
+        groq_api_key,
+        TEXT_MODEL,
+        [{"role": "user", "content": _text_only_prompt(query)}],
+        max_tokens=200,
+        temperature=0.7
+    )
+
+async def stream_analysis(query: str, groq_api_key: str, image_content: Optional[bytes] = None):
+    """Yield analysis tokens, trying vision first and falling back to text-only.
+
+    The fallback only happens if the vision model fails before producing
+    any output; a failure mid-answer is raised to the caller.
+    """
+    if image_content:
+        produced = False
+        try:
+            # Timed on its own and kept out of the breaker: a bad upload says nothing about the model
+            with observe_stage("image_prep"):
+                encoded_image, mime_type = await run_blocking(None, prepare_image, image_content)
+            with get_breaker(VISION_MODEL).guard(), observe_stage("vision_stream"):
+                full_query = f"{ANALYSIS_SYSTEM_PROMPT}\n\nPatient describes: {query}"
+                async for token in iterate_with_retries(
+                    "groq",
+                    stream_image_analysis_with_query,
+                    tokens=estimate_tokens(full_query, has_image=True),
+                    query=full_query,
+                    limiter_model=VISION_MODEL,
+                    model=VISION_MODEL,
+                    encoded_image=encoded_image,
+                    mime_type=mime_type
+                ):
+                    produced = True
+                    yield token
+            return
+        except CircuitOpen as circuit_error:
+            count_fallback("circuit_open")
+            print(f"Skipping vision analysis: {circuit_error}")
+        except Exception as vision_error:
+            if produced:
+                raise
+            count_fallback("vision_error")
+            print(f"Vision analysis failed: {vision_error}")
     
-    return completion.choices[0].message.content
+    with observe_stage("text_stream"):
+        async for token in iterate_with_retries(
+            "groq",
+            _text_only_stream,
+            query,
+            groq_api_key,
+            limiter_model=TEXT_MODEL,
+            tokens=estimate_tokens(_text_only_prompt(query))
+        ):
+            yield token
 
 # Text-to-Speech endpoint
 @app.post("/synthesize", response_model=SynthesisResponse)
@@ -236,100 +531,673 @@ async def synthesize_speech(request: SynthesisRequest):
         if not elevenlabs_api_key:
             raise HTTPException(status_code=500, detail="ELEVENLABS_API_KEY not configured")
         
-        # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"response_{timestamp}.mp3"
-        output_path = f"static/audio/{output_filename}"
-        
-        # Create static directory if it doesn't exist
-        os.makedirs("static/audio", exist_ok=True)
-        
-        # Generate speech
+        # Generate speech, or reuse the clip if this exact text was synthesized before
         try:
-            audio_file = text_to_speech_with_elevenlabs(request.text, output_path)
+            key = await cached_speech(request.text)
             
             # Return URL to audio file
-            audio_url = f"/audio/{output_filename}"
+            audio_url = f"/audio/{get_tts_cache().filename(key)}"
             
             return SynthesisResponse(
                 audio_url=audio_url,
                 success=True,
                 message="Speech synthesized successfully"
             )
+        except UpstreamRateLimited:
+            raise
         except Exception as tts_error:
             # Fallback response when TTS fails
+            count_fallback("tts_unavailable")
             return SynthesisResponse(
                 audio_url="",
                 success=False,
                 message=f"Speech synthesis temporarily unavailable: {str(tts_error)}"
             )
         
+    except UpstreamRateLimited:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Speech synthesis failed: {str(e)}")
 
+# Streaming Text-to-Speech endpoint
+@app.post("/synthesize/stream")
+async def synthesize_speech_stream(request: SynthesisRequest):
+    """Stream MP3 audio as ElevenLabs produces it, playback can start on the first chunk"""
+    return await stream_speech(request.text)
+
+@app.get("/synthesize/stream")
+async def synthesize_speech_stream_get(text: str):
+    """GET variant of /synthesize/stream, usable directly as an <audio> src"""
+    return await stream_speech(text)
+
+async def stream_speech(text: str):
+    """Serve `text` as MP3, from the cache if possible, otherwise streamed from upstream
+    
+    With TTS_STREAM_TEE the streamed bytes are also collected and stored in
+    the TTS cache once the clip is complete; the X-Audio-Url header names
+    the cached clip for later replays. Nothing is written to disk before
+    or while streaming.
+    """
+    if not os.environ.get("ELEVENLABS_API_KEY"):
+        raise HTTPException(status_code=500, detail="ELEVENLABS_API_KEY not configured")
+    
+    cache = get_tts_cache()
+    key = _speech_key(text)
+    headers = {"X-Audio-Url": f"/audio/{cache.filename(key)}", "Cache-Control": "no-cache"}
+    
+    data = await run_blocking(None, cache.get_bytes, key)
+    if data is not None:
+        return Response(content=data, media_type="audio/mpeg", headers=headers)
+    
+    chunks = iterate_with_retries(
+        "elevenlabs",
+        stream_text_to_speech_with_elevenlabs,
+        text,
+        limiter_model=ELEVENLABS_MODEL,
+        tokens=len(text)
+    )
+    
+    # Wait for the first chunk so upstream errors still get a proper status code
+    try:
+        with observe_stage("tts_first_chunk"):
+            first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except UpstreamRateLimited:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Speech synthesis failed: {str(e)}")
+    
+    if not TTS_STREAM_TEE:
+        del headers["X-Audio-Url"]
+    
+    async def body():
+        collected = [first_chunk]
+        try:
+            yield first_chunk
+            count_upstream_bytes("in", "tts", len(first_chunk))
+            async for chunk in chunks:
+                count_upstream_bytes("in", "tts", len(chunk))
+                if TTS_STREAM_TEE:
+                    collected.append(chunk)
+                yield chunk
+        finally:
+            # Releases the upstream slot when the client disconnects mid-stream
+            await chunks.aclose()
+        
+        # Only complete clips are cached; a disconnect ends the generator before this
+        if TTS_STREAM_TEE:
+            try:
+                await run_blocking(None, cache.store, key, b"".join(collected))
+            except OSError as store_error:
+                print(f"Could not cache streamed speech: {store_error}")
+    
+    return StreamingResponse(body(), media_type="audio/mpeg", headers=headers)
+
+# Synthesis currently in flight, so concurrent identical requests share one upstream call
+_speech_in_flight = {}
+
+def _speech_key(text: str, pipelined: bool = False) -> str:
+    return tts_cache_key(text, ELEVENLABS_VOICE, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT, pipelined)
+
+async def cached_speech(text: str) -> str:
+    """Make sure the clip for `text` is in the TTS cache and return its key"""
+    cache = get_tts_cache()
+    key = _speech_key(text)
+    if await run_blocking(None, cache.lookup, key):
+        return key
+    
+    task = _speech_in_flight.get(key)
+    if task is None:
+        async def synthesize_and_store():
+            try:
+                with observe_stage("tts"):
+                    data = await call_with_retries(
+                        "elevenlabs",
+                        text_to_speech_bytes_with_elevenlabs,
+                        text,
+                        limiter_model=ELEVENLABS_MODEL,
+                        tokens=len(text)
+                    )
+                count_upstream_bytes("in", "tts", len(data))
+                await run_blocking(None, cache.store, key, data)
+            finally:
+                _speech_in_flight.pop(key, None)
+        
+        task = asyncio.ensure_future(synthesize_and_store())
+        _speech_in_flight[key] = task
+    
+    await asyncio.shield(task)
+    return key
+
 # Complete consultation endpoint
 @app.post("/consultation", response_model=ConsultationResponse)
 async def full_consultation(
     audio: Optional[UploadFile] = File(None),
     image: Optional[UploadFile] = File(None),
-    query: Optional[str] = Form(None)
+    query: Optional[str] = Form(None),
+    pipelined: bool = Form(TTS_PIPELINED)
 ):
-    """Complete AI doctor consultation workflow"""
+    """Complete AI doctor consultation workflow
+    
+    With `pipelined`, speech synthesis starts sentence by sentence while the
+    analysis is still streaming instead of after it has finished.
+    """
     
     transcription = None
     analysis = ""
     audio_url = None
     
-    try:
-        # Step 1: Transcribe audio if provided
-        if audio:
-            transcribe_response = await transcribe_audio(audio)
-            if transcribe_response.success:
-                transcription = transcribe_response.transcription
-                query = transcription
+    with observe_stage("consultation"):
+        try:
+            # Step 1: Transcribe audio if provided
+            if audio:
+                transcribe_response = await transcribe_audio(audio)
+                if transcribe_response.success:
+                    transcription = transcribe_response.transcription
+                    query = transcription
         
-        if not query:
-            raise HTTPException(status_code=400, detail="No query provided (audio or text)")
+            if not query:
+                raise HTTPException(status_code=400, detail="No query provided (audio or text)")
         
-        # Step 2: Analyze query with optional image
-        image_base64 = None
-        if image:
-            image_content = await image.read()
-            image_base64 = base64.b64encode(image_content).decode('utf-8')
+            groq_api_key = os.environ.get("GROQ_API_KEY")
+            if not groq_api_key:
+                raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
         
-        analysis_request = AnalysisRequest(query=query, image_base64=image_base64)
-        analysis_response = await analyze_medical_query(analysis_request)
+            # The raw upload bytes are passed through as-is, no base64 or temp file
+            image_content = await read_upload(image, MAX_IMAGE_UPLOAD_BYTES, "Image") if image else None
         
-        if analysis_response.success:
-            analysis = analysis_response.analysis
+            # Steps 2 and 3
+            analysis, audio_url = await consultation_answer(query, groq_api_key, image_content, pipelined)
         
-        # Step 3: Generate voice response
-        if analysis and not analysis.startswith("Error"):
-            synthesis_request = SynthesisRequest(text=analysis)
+            return ConsultationResponse(
+                transcription=transcription,
+                analysis=analysis,
+                audio_url=audio_url,
+                success=True,
+                message="Consultation completed successfully"
+            )
+        
+        except (UploadTooLarge, UpstreamRateLimited):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Consultation failed: {str(e)}")
+
+async def consultation_answer(query: str, groq_api_key: str, image_content: Optional[bytes], pipelined: bool):
+    """Analyze the query and voice the answer; returns the analysis and its audio URL (or None)"""
+    if pipelined:
+        # Steps 2 and 3 overlapped
+        return await pipelined_analysis_and_speech(query, groq_api_key, image_content)
+    
+    # Step 2: Analyze query with optional image
+    analysis = await run_analysis(query, groq_api_key, image_content)
+    
+    # Step 3: Generate voice response
+    audio_url = None
+    if analysis and not analysis.startswith("Error"):
+        synthesis_request = SynthesisRequest(text=analysis)
+        try:
             synthesis_response = await synthesize_speech(synthesis_request)
             if synthesis_response.success:
                 audio_url = synthesis_response.audio_url
+        except UpstreamRateLimited as tts_error:
+            # The analysis is still worth returning without its audio
+            count_fallback("tts_throttled")
+            print(f"Speech synthesis throttled: {tts_error.detail}")
+    
+    return analysis, audio_url
+
+async def _synthesize_sentence(text: str) -> bytes:
+    key = await cached_speech(text)
+    data = await run_blocking(None, get_tts_cache().get_bytes, key)
+    if data is None:
+        raise RuntimeError("Synthesized clip was evicted before it could be read")
+    return data
+
+async def _no_speech(text: str) -> bytes:
+    raise ValueError("ELEVENLABS_API_KEY not found in environment variables")
+
+def _pipeline_synthesizer():
+    return _synthesize_sentence if os.environ.get("ELEVENLABS_API_KEY") else _no_speech
+
+async def pipelined_analysis_and_speech(query: str, groq_api_key: str, image_content: Optional[bytes] = None):
+    """Stream the analysis and synthesize it sentence by sentence as it arrives
+    
+    Returns the full analysis and the URL of the concatenated MP3, or None
+    when any sentence could not be synthesized.
+    """
+    analysis = ""
+    segments = []
+    speech_error = None
+    
+    tokens = stream_analysis(query, groq_api_key, image_content)
+    async for kind, value in synthesize_pipelined_async(tokens, _pipeline_synthesizer()):
+        if kind == "analysis":
+            analysis += value
+        elif kind == "audio":
+            segments.append(value)
+        else:
+            speech_error = value
+    
+    if speech_error is not None or not segments:
+        # A clip missing sentences must not be cached: it would be served as the whole answer
+        if speech_error is not None:
+            count_fallback("tts_unavailable")
+        return analysis, None
+    
+    # MP3 frames concatenate into a single playable clip, cached apart from whole-text syntheses
+    output_filename = await run_blocking(
+        None, get_tts_cache().store, _speech_key(analysis, pipelined=True), b"".join(segments)
+    )
+    return analysis, f"/audio/{output_filename}"
+
+def _audio_data_url(chunk: bytes) -> str:
+    with span("base64_encode"):
+        return "data:audio/mpeg;base64," + base64.b64encode(chunk).decode('utf-8')
+
+def _sse_event(field: str, value) -> str:
+    """Format one Server-Sent Event named after a ConsultationResponse field"""
+    return f"event: {field}\ndata: {json.dumps({field: value})}\n\n"
+
+# Streaming consultation endpoint
+@app.post("/consultation/stream")
+async def stream_consultation(
+    audio: Optional[UploadFile] = File(None),
+    image: Optional[UploadFile] = File(None),
+    query: Optional[str] = Form(None),
+    pipelined: bool = Form(TTS_PIPELINED)
+):
+    """Consultation workflow that streams each stage as Server-Sent Events
+    
+    Event names are ConsultationResponse fields: one `transcription` event,
+    one `analysis` event per LLM token, one `audio_url` event per MP3 chunk
+    (as a base64 data URL, chunks concatenate into the full clip), then
+    closing `success` and `message` events.
+    
+    With `pipelined`, one `audio_url` event per sentence is interleaved with
+    the analysis tokens, so playback can start before the answer is complete.
+    """
+    
+    if audio and not audio.content_type.startswith('audio/'):
+        raise HTTPException(status_code=400, detail="File must be audio format")
+    
+    # Uploads must be read before the response starts streaming; the image
+    # first, so a rejected image does not leave the audio temp file behind
+    image_content = await read_upload(image, MAX_IMAGE_UPLOAD_BYTES, "Image") if image else None
+    temp_audio_path = await save_audio_upload(audio) if audio else None
+    
+    async def events():
+        nonlocal query
+        with observe_stage("consultation_stream"):
+            try:
+                # Step 1: Transcribe audio if provided
+                if temp_audio_path:
+                    transcription = await transcribe_file(temp_audio_path)
+                    query = transcription
+                    yield _sse_event("transcription", transcription)
+            
+                if not query:
+                    yield _sse_event("success", False)
+                    yield _sse_event("message", "No query provided (audio or text)")
+                    return
+            
+                groq_api_key = os.environ.get("GROQ_API_KEY")
+                if not groq_api_key:
+                    raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+            
+                if pipelined:
+                    # Steps 2 and 3 overlapped, sentence by sentence
+                    tokens = stream_analysis(query, groq_api_key, image_content)
+                    async for kind, value in synthesize_pipelined_async(tokens, _pipeline_synthesizer()):
+                        if kind == "analysis":
+                            yield _sse_event("analysis", value)
+                        elif kind == "audio":
+                            yield _sse_event("audio_url", _audio_data_url(value))
+                        else:
+                            count_fallback("tts_unavailable")
+                
+                    yield _sse_event("success", True)
+                    yield _sse_event("message", "Consultation completed successfully")
+                    return
+            
+                # Step 2: Stream the analysis token by token
+                analysis = ""
+                async for token in stream_analysis(query, groq_api_key, image_content):
+                    analysis += token
+                    yield _sse_event("analysis", token)
+            
+                # Step 3: Stream the voice response
+                if analysis and os.environ.get("ELEVENLABS_API_KEY"):
+                    try:
+                        async for chunk in iterate_with_retries(
+                            "elevenlabs",
+                            stream_text_to_speech_with_elevenlabs,
+                            analysis,
+                            limiter_model=ELEVENLABS_MODEL,
+                            tokens=len(analysis)
+                        ):
+                            yield _sse_event("audio_url", _audio_data_url(chunk))
+                    except Exception as tts_error:
+                        count_fallback("tts_unavailable")
+                        print(f"Streaming speech synthesis failed: {tts_error}")
+            
+                yield _sse_event("success", True)
+                yield _sse_event("message", "Consultation completed successfully")
         
-        return ConsultationResponse(
-            transcription=transcription,
-            analysis=analysis,
-            audio_url=audio_url,
-            success=True,
-            message="Consultation completed successfully"
-        )
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                yield _sse_event("success", False)
+                yield _sse_event("message", f"Consultation failed: {detail}")
+            finally:
+                if temp_audio_path:
+                    _remove_file(temp_audio_path)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _decode_image(image_base64: Optional[str]):
+    if not image_base64:
+        return None
+    with span("base64_decode"):
+        return base64.b64decode(image_base64)
+
+def _estimate_item_tokens(item) -> int:
+    return estimate_tokens(item.query, has_image=bool(item.image_base64))
+
+async def _run_batch_endpoint(items, worker, concurrency: Optional[int]) -> BatchResponse:
+    """Fan a batch out concurrently and collect per-item results and errors"""
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds the {BATCH_MAX_ITEMS} item limit")
+    
+    if not os.environ.get("GROQ_API_KEY"):
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+    
+    concurrency = min(concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    outcomes = await run_batch(items, worker, _estimate_item_tokens, concurrency)
+    
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            results.append(BatchItemResult(index=index, success=False, error=str(outcome)))
+        else:
+            results.append(BatchItemResult(index=index, success=True, **outcome))
+    
+    failed = sum(1 for result in results if not result.success)
+    return BatchResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed,
+        success=failed == 0,
+        message=f"Processed {len(results)} items, {failed} failed"
+    )
+
+# Batch analysis endpoint
+@app.post("/batch/analyze", response_model=BatchResponse)
+async def batch_analyze(request: BatchAnalysisRequest):
+    """Analyze many medical queries concurrently
+    
+    Items run in parallel (up to BATCH_CONCURRENCY) while sharing one
+    tokens-per-minute budget, so throughput follows the upstream rate limit
+    rather than round-trip latency. Each item reports its own error.
+    """
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    
+    async def analyze_item(item: AnalysisRequest):
+        analysis = await run_analysis(item.query, groq_api_key, _decode_image(item.image_base64))
+        return {"analysis": analysis}
+    
+    return await _run_batch_endpoint(request.items, analyze_item, request.concurrency)
+
+# Batch consultation endpoint
+@app.post("/batch/consultation", response_model=BatchResponse)
+async def batch_consultation(request: BatchConsultationRequest):
+    """Run analysis plus voice synthesis for many written consultations concurrently"""
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    
+    async def consult_item(item: ConsultationRequest):
+        if not item.query:
+            raise ValueError("No query provided")
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Consultation failed: {str(e)}")
+        analysis = await run_analysis(item.query, groq_api_key, _decode_image(item.image_base64))
+        
+        audio_url = None
+        if analysis and os.environ.get("ELEVENLABS_API_KEY"):
+            try:
+                key = await cached_speech(analysis)
+                audio_url = f"/audio/{get_tts_cache().filename(key)}"
+            except Exception as tts_error:
+                print(f"Speech synthesis failed: {tts_error}")
+        
+        return {"analysis": analysis, "audio_url": audio_url}
+    
+    return await _run_batch_endpoint(request.items, consult_item, request.concurrency)
+
+async def run_consultation_job(payload: dict, files: dict) -> dict:
+    """Job handler: the /consultation workflow on a queued job's stored inputs"""
+    transcription = None
+    query = payload["query"]
+
+    with observe_stage("consultation_job"):
+        # Step 1: Transcribe audio if provided
+        if "audio" in files:
+            temp_audio_path = await run_blocking(None, write_temp_file, files["audio"], payload["audio_suffix"])
+            try:
+                transcription = await transcribe_file(temp_audio_path)
+                query = transcription
+            finally:
+                _remove_file(temp_audio_path)
+
+        if not query:
+            raise ValueError("No query provided (audio or text)")
+
+        groq_api_key = os.environ.get("GROQ_API_KEY")
+        if not groq_api_key:
+            raise ValueError("GROQ_API_KEY not configured")
+
+        # Steps 2 and 3
+        analysis, audio_url = await consultation_answer(query, groq_api_key, files.get("image"), payload["pipelined"])
+
+    return ConsultationResponse(
+        transcription=transcription,
+        analysis=analysis,
+        audio_url=audio_url,
+        success=True,
+        message="Consultation completed successfully"
+    ).model_dump()
+
+# Asynchronous consultation endpoint
+@app.post("/jobs/consultation", response_model=JobResponse, status_code=202)
+async def submit_consultation_job(
+    response: Response,
+    audio: Optional[UploadFile] = File(None),
+    image: Optional[UploadFile] = File(None),
+    query: Optional[str] = Form(None),
+    pipelined: bool = Form(TTS_PIPELINED),
+    webhook_url: Optional[str] = Form(None)
+):
+    """Queue a consultation and return its job ID straight away
+
+    The consultation runs on the background worker pool, so no connection
+    is held open for the whole STT, LLM and TTS chain. Fetch the result with
+    GET /jobs/{job_id} (add `wait` to long-poll), or pass `webhook_url` to
+    receive that same body when the job finishes. When JOB_QUEUE_MAX jobs
+    are already waiting the answer is 429 with a Retry-After header.
+    """
+    if not audio and not query:
+        raise HTTPException(status_code=400, detail="No query provided (audio or text)")
+    if audio and not audio.content_type.startswith('audio/'):
+        raise HTTPException(status_code=400, detail="File must be audio format")
+    if not os.environ.get("GROQ_API_KEY"):
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY not configured")
+    if webhook_url:
+        check_webhook_url(webhook_url)
+
+    # Inputs are stored with the job, any worker process may run it
+    files = {}
+    if audio:
+        files["audio"] = await read_upload(audio, MAX_AUDIO_UPLOAD_BYTES, "Audio")
+    if image:
+        files["image"] = await read_upload(image, MAX_IMAGE_UPLOAD_BYTES, "Image")
+    payload = {
+        "query": query,
+        "pipelined": pipelined,
+        "audio_suffix": (os.path.splitext(audio.filename or "")[1] or ".wav") if audio else None,
+    }
+
+    queue = get_job_queue()
+    job_id = await queue.submit("consultation", payload, files, webhook_url)
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return await queue.get(job_id)
+
+# Job status and result
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, wait: float = 0):
+    """Status of a job, with its result or error once finished
+
+    With `wait`, the request is held for up to that many seconds (at most
+    JOB_MAX_WAIT) until the job finishes. Finished jobs can be fetched for
+    JOB_RESULT_TTL seconds.
+    """
+    job = await get_job_queue().wait(job_id, min(max(wait, 0), JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+# Real-time voice session
+@app.websocket("/voice/session")
+async def voice_session(websocket: WebSocket, sample_rate: int = AUDIO_TARGET_SAMPLE_RATE, language: str = "en"):
+    """Transcribe the patient utterance by utterance while they are speaking
+
+    The client streams 16-bit little-endian mono PCM at `sample_rate` as
+    binary messages. Server-side voice activity detection finds the end of
+    each utterance and starts its transcription right away, while audio
+    keeps arriving, so a transcript follows the end of speech within one
+    Whisper call. JSON messages are sent back for each utterance, numbered
+    by `utterance`: `speech_start`, `speech_end`, then `transcript` (with
+    `latency_ms` from the end of speech) or `error`.
+
+    The client may send the text messages {"type": "end"} to end the
+    current utterance at once (push-to-talk), and {"type": "close"} to have
+    outstanding transcripts delivered before the server closes.
+    """
+    await websocket.accept()
+
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    if not groq_api_key:
+        await websocket.close(code=1011, reason="GROQ_API_KEY not configured")
+        return
+    if not VOICE_MIN_SAMPLE_RATE <= sample_rate <= VOICE_MAX_SAMPLE_RATE:
+        await websocket.close(code=1008, reason=f"sample_rate must be {VOICE_MIN_SAMPLE_RATE} to {VOICE_MAX_SAMPLE_RATE} Hz")
+        return
+
+    segmenter = UtteranceSegmenter(sample_rate)
+    send_lock = asyncio.Lock()
+    transcriptions = set()
+    utterance = 0
+
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def transcribe_utterance(index, pcm, speech_ended):
+        try:
+            with observe_stage("transcription"):
+                transcription = await transcribe_bytes(pcm_to_wav(pcm, sample_rate), "utterance.wav", language)
+            latency_ms = round((time.perf_counter() - speech_ended) * 1000)
+            await send({"type": "transcript", "utterance": index, "text": transcription, "latency_ms": latency_ms})
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            await send({"type": "error", "utterance": index, "message": f"Transcription failed: {detail}"})
+
+    async def handle(events):
+        nonlocal utterance
+        for event in events:
+            if event[0] == "speech_start":
+                await send({"type": "speech_start", "utterance": utterance, "offset_ms": event[1]})
+                continue
+            _, pcm, offset_ms = event
+            speech_ended = time.perf_counter()
+            duration_ms = len(pcm) * 1000 // (2 * sample_rate)
+            await send({"type": "speech_end", "utterance": utterance, "offset_ms": offset_ms, "duration_ms": duration_ms})
+            # Transcribed while the session keeps listening
+            task = asyncio.create_task(transcribe_utterance(utterance, pcm, speech_ended))
+            transcriptions.add(task)
+            task.add_done_callback(transcriptions.discard)
+            utterance += 1
+
+    async def finish(reason):
+        await handle(segmenter.flush())
+        await asyncio.gather(*transcriptions)
+        await websocket.close(reason=reason)
+
+    deadline = time.monotonic() + VOICE_MAX_SESSION_SECONDS
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                await finish("Session time limit reached")
+                break
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes") is not None:
+                await handle(segmenter.feed(message["bytes"]))
+                continue
+            try:
+                command = json.loads(message.get("text") or "{}").get("type")
+            except (ValueError, AttributeError):
+                command = None
+            if command == "end":
+                await handle(segmenter.flush())
+            elif command == "close":
+                await finish("Session closed by client")
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Nobody is left to receive the transcripts
+        for task in transcriptions:
+            task.cancel()
 
 # Serve audio files
 @app.get("/audio/{filename}")
-async def get_audio(filename: str):
-    """Serve generated audio files"""
-    file_path = f"static/audio/{filename}"
-    if os.path.exists(file_path):
-        return FileResponse(file_path, media_type="audio/mpeg")
-    else:
+async def get_audio(filename: str, request: Request):
+    """Serve generated audio files
+    
+    Clips are content-addressed, so the key doubles as a strong ETag and
+    responses may be cached forever. Freshly generated clips are served
+    from memory; Range requests and older clips are served from disk.
+    """
+    cache = get_tts_cache()
+    key = cache.key_from_filename(os.path.basename(filename))
+    if key is None:
         raise HTTPException(status_code=404, detail="Audio file not found")
+    
+    headers = {"ETag": f'"{key}"', "Cache-Control": AUDIO_CACHE_CONTROL}
+    if f'"{key}"' in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    if "range" not in request.headers:
+        data = cache.memory_bytes(key)
+        if data is not None:
+            return Response(content=data, media_type="audio/mpeg", headers=headers)
+    
+    file_path = cache.path(key)
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    
+    if AUDIO_ACCEL_REDIRECT:
+        # nginx serves the file itself (sendfile, ranges) from its internal location
+        headers["X-Accel-Redirect"] = AUDIO_ACCEL_REDIRECT.rstrip("/") + "/" + cache.relative_path(key)
+        return Response(media_type="audio/mpeg", headers=headers)
+    
+    return FileResponse(file_path, media_type="audio/mpeg", headers=headers, stat_result=stat_result)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,105 @@
+"""
+Audio preprocessing before Whisper uploads
+Downmixes to mono, resamples to 16 kHz, trims leading and trailing silence
+with an energy-based voice activity detector and re-encodes to a compact codec
+"""
+
+import os
+import io
+import logging
+
+AUDIO_PREPROCESSING = os.environ.get("AUDIO_PREPROCESSING", "true").lower() in ("1", "true", "yes")
+
+# Whisper resamples to 16 kHz mono internally, anything more is wasted upload
+AUDIO_TARGET_SAMPLE_RATE = int(os.environ.get("AUDIO_TARGET_SAMPLE_RATE", "16000"))
+
+# "opus" (Ogg/Opus, lossy, smallest) or "flac" (lossless)
+AUDIO_OUTPUT_FORMAT = os.environ.get("AUDIO_OUTPUT_FORMAT", "opus").lower()
+AUDIO_OPUS_BITRATE = os.environ.get("AUDIO_OPUS_BITRATE", "32k")
+
+# Voice activity detection: frames quieter than the threshold count as silence
+AUDIO_VAD_FRAME_MS = int(os.environ.get("AUDIO_VAD_FRAME_MS", "30"))
+AUDIO_VAD_THRESHOLD_DBFS = float(os.environ.get("AUDIO_VAD_THRESHOLD_DBFS", "-45"))
+AUDIO_VAD_RELATIVE_DB = float(os.environ.get("AUDIO_VAD_RELATIVE_DB", "35"))
+AUDIO_VAD_PADDING_MS = int(os.environ.get("AUDIO_VAD_PADDING_MS", "250"))
+
+# Container and filename used for each output codec
+_OUTPUT_FORMATS = {
+    "opus": ("ogg", "audio.ogg", ["-c:a", "libopus", "-application", "voip"]),
+    "flac": ("flac", "audio.flac", []),
+}
+
+
+def frame_levels(segment, frame_ms=AUDIO_VAD_FRAME_MS):
+    """Loudness (dBFS) of consecutive frames of a segment"""
+    return [segment[start:start + frame_ms].dBFS for start in range(0, len(segment), frame_ms)]
+
+
+def speech_threshold(levels):
+    """Energy level above which a frame counts as speech.
+
+    Relative to the loudest frame so quiet recordings are not trimmed away,
+    but never below the absolute floor.
+    """
+    audible = [level for level in levels if level != float("-inf")]
+    if not audible:
+        return AUDIO_VAD_THRESHOLD_DBFS
+    return max(AUDIO_VAD_THRESHOLD_DBFS, max(audible) - AUDIO_VAD_RELATIVE_DB)
+
+
+def trim_silence(segment, frame_ms=AUDIO_VAD_FRAME_MS, padding_ms=AUDIO_VAD_PADDING_MS):
+    """Cut leading and trailing silence, keeping some padding around speech"""
+    levels = frame_levels(segment, frame_ms)
+    threshold = speech_threshold(levels)
+    voiced = [i for i, level in enumerate(levels) if level > threshold]
+    if not voiced:
+        # Nothing looks like speech; let Whisper decide rather than sending nothing
+        return segment
+    start = max(0, voiced[0] * frame_ms - padding_ms)
+    end = min(len(segment), (voiced[-1] + 1) * frame_ms + padding_ms)
+    return segment[start:end]
+
+
+def _export(segment, output_format):
+    container, filename, codec_args = _OUTPUT_FORMATS[output_format]
+    parameters = list(codec_args)
+    if output_format == "opus":
+        parameters += ["-b:a", AUDIO_OPUS_BITRATE]
+    buffer = io.BytesIO()
+    segment.export(buffer, format=container, parameters=parameters)
+    return buffer.getvalue(), filename
+
+
+def preprocess_audio(data, filename="audio"):
+    """Shrink a recording before it is uploaded for transcription.
+
+    Returns (bytes, filename) ready for the Whisper upload. The original
+    bytes are returned when preprocessing is disabled, fails (e.g. ffmpeg
+    missing) or would not make the upload smaller.
+    """
+    if not AUDIO_PREPROCESSING:
+        return data, filename
+
+    extension = os.path.splitext(filename)[1].lstrip(".").lower() or None
+    try:
+        # Imported here: pydub probes for ffmpeg on import, which slows startup
+        from pydub import AudioSegment
+        segment = AudioSegment.from_file(io.BytesIO(data), format=extension)
+        segment = segment.set_channels(1).set_frame_rate(AUDIO_TARGET_SAMPLE_RATE).set_sample_width(2)
+        segment = trim_silence(segment)
+
+        output_format = AUDIO_OUTPUT_FORMAT if AUDIO_OUTPUT_FORMAT in _OUTPUT_FORMATS else "flac"
+        try:
+            processed, processed_name = _export(segment, output_format)
+        except Exception:
+            if output_format == "flac":
+                raise
+            # ffmpeg builds without libopus can still produce FLAC
+            processed, processed_name = _export(segment, "flac")
+    except Exception as e:
+        logging.warning(f"Audio preprocessing skipped: {e}")
+        return data, filename
+
+    if len(processed) >= len(data):
+        return data, filename
+    return processed, processed_name
@@ -0,0 +1,58 @@
+"""
+Concurrent fan-out for batch endpoints
+Items run in parallel under a concurrency cap and a shared tokens-per-minute budget
+"""
+
+import os
+import asyncio
+
+from rate_limit import TokenBucket, WEB_CONCURRENCY
+
+# Largest batch accepted in one request
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "100"))
+
+# Items of one batch processed at the same time
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+
+# LLM tokens per minute all batches together may spend
+BATCH_TOKENS_PER_MINUTE = int(os.environ.get("BATCH_TOKENS_PER_MINUTE", "30000"))
+
+# Rough cost of an image in prompt tokens, used for budgeting only
+IMAGE_TOKEN_ESTIMATE = 1500
+
+_budget = None
+
+
+def get_token_budget():
+    """Process-wide budget shared by every batch request, this worker's share of the total"""
+    global _budget
+    if _budget is None:
+        tokens_per_minute = BATCH_TOKENS_PER_MINUTE / WEB_CONCURRENCY
+        _budget = TokenBucket(rate=tokens_per_minute / 60, capacity=tokens_per_minute)
+    return _budget
+
+
+def estimate_tokens(text, max_tokens=200, has_image=False):
+    """Upper bound on the tokens one analysis call consumes (about 4 characters per token)"""
+    estimate = len(text or "") // 4 + max_tokens
+    if has_image:
+        estimate += IMAGE_TOKEN_ESTIMATE
+    return estimate
+
+
+async def run_batch(items, worker, estimate, concurrency=BATCH_CONCURRENCY):
+    """Run `worker(item)` for every item and return results in input order.
+
+    Each item first reserves `estimate(item)` tokens from the shared budget.
+    A failing item does not stop the others: its slot in the result list
+    holds the exception instead.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    budget = get_token_budget()
+
+    async def run_one(item):
+        async with semaphore:
+            await budget.acquire(estimate(item))
+            return await worker(item)
+
+    return await asyncio.gather(*(run_one(item) for item in items), return_exceptions=True)
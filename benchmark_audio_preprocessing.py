@@ -0,0 +1,56 @@
+"""
+Benchmark the audio preprocessing stage on the bundled recording
+Reports the Whisper upload size before and after preprocessing for each codec,
+for the MP3 as shipped and for the same clip as a 48 kHz stereo browser WAV
+Run: python benchmark_audio_preprocessing.py [audio file]
+"""
+
+import io
+import os
+import sys
+import time
+
+from pydub import AudioSegment
+
+import audio_preprocessing
+from audio_preprocessing import preprocess_audio
+
+
+def benchmark(label, data, filename, output_format, rounds=5):
+    audio_preprocessing.AUDIO_OUTPUT_FORMAT = output_format
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        processed, name = preprocess_audio(data, filename)
+        timings.append(time.perf_counter() - start)
+
+    if processed is data:
+        print(f"{label:>12} {output_format:>5}: {len(data):>9,} bytes, kept original (re-encode was not smaller)")
+        return
+
+    duration = len(AudioSegment.from_file(io.BytesIO(processed))) / 1000
+    print(f"{label:>12} {output_format:>5}: {len(data):>9,} -> {len(processed):>9,} bytes "
+          f"({len(data) / len(processed):.1f}x smaller, {len(data) - len(processed):,} bytes saved), "
+          f"{duration:.2f}s of audio after trimming, {min(timings) * 1000:.1f} ms, upload as {name}")
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "patient_voice_test.mp3"
+    with open(path, "rb") as f:
+        original = f.read()
+
+    segment = AudioSegment.from_file(io.BytesIO(original))
+    print(f"Audio preprocessing benchmark: {path} "
+          f"({len(segment) / 1000:.2f}s, {segment.channels}ch, {segment.frame_rate} Hz)")
+
+    # What browsers typically upload: uncompressed 48 kHz stereo
+    browser_wav = io.BytesIO()
+    segment.set_channels(2).set_frame_rate(48000).export(browser_wav, format="wav")
+
+    inputs = [
+        ("as shipped", original, os.path.basename(path)),
+        ("browser WAV", browser_wav.getvalue(), "recording.wav"),
+    ]
+    for label, data, filename in inputs:
+        for output_format in ("opus", "flac"):
+            benchmark(label, data, filename, output_format)
@@ -0,0 +1,119 @@
+"""
+Import-time benchmark for cold starts
+Imports each entry point in a fresh interpreter under `python -X importtime`,
+reports the import time, interpreter wall time and the slowest packages, and
+checks that nothing heavy or side-effecting happens at import
+Run: python benchmark_import_time.py [module ...] [--runs N] [--max-ms MS]
+Exits with status 1 when a check fails or the import is slower than --max-ms
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MODULES = ["api_backend"]
+
+# Only needed by the Gradio apps or for local recording and playback; an entry
+# point may import them itself, but nothing it imports should pull them in
+LAZY_MODULES = ["gradio", "gtts", "elevenlabs", "speech_recognition", "pydub", "groq"]
+
+
+def import_once(module):
+    """Import `module` in a new interpreter; (wall seconds, importtime rows, files written)
+
+    The interpreter runs in an empty directory so files written at import
+    time (e.g. a test clip) show up.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])))
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=workdir, env=env, capture_output=True, text=True,
+        )
+        wall = time.perf_counter() - started
+        written = sorted(os.listdir(workdir))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return wall, parse_importtime(result.stderr), written
+
+
+def parse_importtime(output):
+    """(name, depth, self_us, cumulative_us) for every line `-X importtime` printed"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented two spaces per level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def slowest_packages(rows, top):
+    """Self time summed per top-level package, slowest first"""
+    totals = {}
+    for name, _, self_us, _ in rows:
+        package = name.split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def benchmark(module, runs, top):
+    walls, imports = [], []
+    rows, written = [], []
+    for _ in range(runs):
+        wall, rows, written = import_once(module)
+        walls.append(wall)
+        imports.append(next(cumulative for name, depth, _, cumulative in rows if name == module and depth == 0))
+
+    indirect = {name for name, depth, _, _ in rows if depth > 1}
+    return {
+        "import_ms": statistics.median(imports) / 1000,
+        "import_min_ms": min(imports) / 1000,
+        "wall_ms": statistics.median(walls) * 1000,
+        "modules": len(rows),
+        "slowest": slowest_packages(rows, top),
+        "eager": [name for name in LAZY_MODULES if name in indirect],
+        "written": written,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time benchmark for cold starts")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="modules to import")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="slowest packages to list")
+    parser.add_argument("--max-ms", type=float, help="fail when the median import takes longer")
+    parser.add_argument("--allow-eager", action="store_true", help="do not fail on eagerly imported heavy modules")
+    args = parser.parse_args(argv)
+
+    failures = []
+    for module in args.modules:
+        result = benchmark(module, args.runs, args.top)
+        print(f"{module}: import {result['import_ms']:.1f} ms (min {result['import_min_ms']:.1f}), "
+              f"interpreter start + import {result['wall_ms']:.1f} ms, {result['modules']} modules")
+        for package, self_us in result["slowest"]:
+            print(f"  {package:<32} {self_us / 1000:>8.1f} ms")
+
+        if result["eager"] and not args.allow_eager:
+            failures.append(f"{module} imports {', '.join(result['eager'])} eagerly")
+        if result["written"]:
+            failures.append(f"{module} writes {', '.join(result['written'])} at import")
+        if args.max_ms is not None and result["import_ms"] > args.max_ms:
+            failures.append(f"{module} takes {result['import_ms']:.1f} ms to import (limit {args.max_ms:.0f} ms)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Per-stage micro-benchmarks of our own code, with fake upstreams
+Measures image encoding, audio preprocessing, request parsing, temp-file
+handling, response serialization and the full API path against zero-latency
+fake providers, and compares the results with a saved baseline
+Run: python benchmark_stages.py [--stage NAME] [--time SECONDS] [--save-baseline] [--baseline FILE]
+Exits with status 1 when a stage regressed by more than --threshold
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import argparse
+import tracemalloc
+
+# Upstreams answer instantly and in-process; the image and transcription
+# caches are disabled so every iteration does the real work
+os.environ.setdefault("PROVIDERS", "fake")
+os.environ.setdefault("FAKE_LATENCY_MS", "0")
+os.environ.setdefault("FAKE_LATENCY_SIGMA", "0")
+os.environ.setdefault("FAKE_STREAM_INTERVAL_MS", "0")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+os.environ.setdefault("ELEVENLABS_API_KEY", "benchmark")
+os.environ.setdefault("UPSTREAM_WARMUP", "false")
+os.environ.setdefault("IMAGE_CACHE_BYTES", "0")
+os.environ.setdefault("STT_CACHE_MEMORY_BYTES", "0")
+os.environ.setdefault("STT_CACHE_PATH", "")
+os.environ.setdefault("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "predicare_benchmark_audio"))
+
+import io
+import base64
+
+import httpx
+from starlette.requests import Request
+from starlette.datastructures import UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from brain_of_the_doctor import encode_image, prepare_image
+from audio_preprocessing import preprocess_audio
+from stt_cache import stt_cache_key
+from uploads import save_upload
+import api_backend
+
+FIXTURE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGES = ["acne.jpg", "skin_rash.jpg"]
+AUDIO = "patient_voice_test.mp3"
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+_loop = asyncio.new_event_loop()
+
+
+def fixture(name):
+    return os.path.join(FIXTURE_DIR, name)
+
+
+def read_fixture(name):
+    with open(fixture(name), "rb") as f:
+        return f.read()
+
+
+def run_async(coroutine_fn):
+    """Wrap an async benchmark body so it can be timed like a plain call"""
+    return lambda: _loop.run_until_complete(coroutine_fn())
+
+
+def multipart_request(fields, files):
+    """Raw body and headers of a multipart POST, built once and parsed many times"""
+    request = httpx.Request("POST", "http://benchmark/consultation", data=fields, files=files)
+    return request.read(), [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in request.headers.items()]
+
+
+def starlette_request(body, headers):
+    scope = {"type": "http", "method": "POST", "path": "/consultation", "headers": headers, "query_string": b""}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+
+def build_stages():
+    """(name, callable) for every benchmarked stage"""
+    stages = []
+    audio = read_fixture(AUDIO)
+
+    # Image encoding
+    for name in IMAGES:
+        data = read_fixture(name)
+        stages.append((f"image.encode_image[{name}]", lambda name=name: encode_image(fixture(name))))
+        stages.append((f"image.prepare_image[{name}]", lambda data=data: prepare_image(data)))
+
+    # Audio handling
+    stages.append((f"audio.preprocess_audio[{AUDIO}]", lambda: preprocess_audio(audio, AUDIO)))
+    stages.append((f"audio.stt_cache_key[{AUDIO}]", lambda: stt_cache_key(audio, "whisper-large-v3", "en")))
+
+    # Request parsing
+    image = read_fixture(IMAGES[0])
+    body, headers = multipart_request(
+        {"query": "I have a red itchy rash on my arm"},
+        {"audio": (AUDIO, audio, "audio/mpeg"), "image": (IMAGES[0], image, "image/jpeg")},
+    )
+
+    async def parse_multipart():
+        form = await starlette_request(body, headers).form()
+        await form.close()
+
+    stages.append(("request.parse_multipart", run_async(parse_multipart)))
+
+    analysis_json = json.dumps({"query": "rash", "image_base64": base64.b64encode(image).decode("utf-8")})
+
+    def parse_analysis_json():
+        request = api_backend.AnalysisRequest.model_validate_json(analysis_json)
+        return base64.b64decode(request.image_base64)
+
+    stages.append(("request.parse_analysis_json", parse_analysis_json))
+
+    # Temp-file handling
+    async def save_and_remove():
+        upload = UploadFile(file=io.BytesIO(audio), filename=AUDIO, size=len(audio))
+        path = await save_upload(upload, len(audio), "Audio", suffix=".mp3")
+        os.unlink(path)
+
+    stages.append(("tempfile.save_upload", run_async(save_and_remove)))
+
+    # Response serialization
+    response = api_backend.ConsultationResponse(
+        transcription="I have a red itchy rash on my arm",
+        analysis="Based on your description, this looks like a mild skin irritation. " * 8,
+        audio_url="/audio/tts_" + "0" * 64 + ".mp3",
+        success=True,
+        message="Consultation completed successfully",
+    )
+    stages.append(("response.json", lambda: JSONResponse(content=jsonable_encoder(response)).body))
+    stages.append(("response.sse_event", lambda: api_backend._sse_event("analysis", " irritation")))
+
+    # Full API path, upstreams faked
+    client = TestClient(api_backend.app)
+
+    def consultation():
+        result = client.post(
+            "/consultation",
+            data={"query": "I have a red itchy rash on my arm"},
+            files={"image": (IMAGES[0], image, "image/jpeg")},
+        )
+        result.raise_for_status()
+
+    def transcribe():
+        result = client.post("/transcribe", files={"audio": (AUDIO, audio, "audio/mpeg")})
+        result.raise_for_status()
+
+    stages.append(("api.transcribe", transcribe))
+    stages.append(("api.consultation", consultation))
+    return stages
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def allocations(fn):
+    """Peak bytes and number of live blocks allocated by one call"""
+    tracemalloc.start()
+    try:
+        before_blocks = len(tracemalloc.take_snapshot().traces)
+        tracemalloc.reset_peak()
+        start_bytes, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        after_blocks = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    return peak_bytes - start_bytes, after_blocks - before_blocks
+
+
+def measure(fn, min_time=1.0, min_runs=20, warmup=3):
+    """Time individual calls until both min_time and min_runs are reached"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - started < min_time:
+        call_started = time.perf_counter_ns()
+        fn()
+        timings.append(time.perf_counter_ns() - call_started)
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    peak_bytes, blocks = allocations(fn)
+    return {
+        "runs": len(timings),
+        "ops_per_sec": round(len(timings) / elapsed, 2),
+        "p50_ms": round(percentile(timings, 0.50) / 1e6, 4),
+        "p99_ms": round(percentile(timings, 0.99) / 1e6, 4),
+        "peak_alloc_kb": round(peak_bytes / 1024, 1),
+        "retained_blocks": blocks,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Names of stages slower than the baseline by more than `threshold`"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        slower = result["ops_per_sec"] < previous["ops_per_sec"] * (1 - threshold)
+        tail = result["p99_ms"] > previous["p99_ms"] * (1 + threshold)
+        if slower or tail:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage micro-benchmarks with fake upstreams")
+    parser.add_argument("--stage", help="only run stages whose name contains this text")
+    parser.add_argument("--time", type=float, default=1.0, help="minimum seconds per stage")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f"{'stage':<44} {'ops/sec':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak KB':>9} {'blocks':>7}  vs baseline")
+    for name, fn in build_stages():
+        if args.stage and args.stage not in name:
+            continue
+        result = measure(fn, min_time=args.time)
+        results[name] = result
+
+        change = ""
+        if name in baseline:
+            ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+            change = f"{(ratio - 1) * 100:+.1f}%"
+            if compare({name: result}, baseline, args.threshold):
+                change += "  REGRESSION"
+        print(f"{name:<44} {result['ops_per_sec']:>10,.1f} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+              f"{result['peak_alloc_kb']:>9,.1f} {result['retained_blocks']:>7}  {change}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(dict(baseline, **results), f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
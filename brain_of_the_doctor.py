@@ -14,21 +14,28 @@ import base64
 #image_path="acne.jpg"
 
 def encode_image(image_path):   
-    image_file=open(image_path, "rb")
-    return base64.b64encode(image_file.read()).decode('utf-8')
+    with open(image_path, "rb") as image_file:
+        return encode_image_bytes(image_file.read())
+
+def encode_image_bytes(image_bytes):
+    """Base64-encode an in-memory image (bytes or memoryview) for the data URL"""
+    return base64.b64encode(image_bytes).decode('utf-8')
+
+from image_preprocessing import preprocess_image
+
+def prepare_image(image_bytes):
+    """Downscale/recompress an image for the vision model, returns (base64 data, MIME type)"""
+    processed, mime_type = preprocess_image(image_bytes)
+    return encode_image_bytes(processed), mime_type
 
 #Step3: Setup Multimodal LLM 
-from groq import Groq
+from providers import get_llm_provider
 
 query="Is there something wrong with my face?"
 model="meta-llama/llama-4-scout-17b-16e-instruct"
 
-def analyze_image_with_query(query, model, encoded_image):
-    if not GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY not found in environment variables")
-    
-    client=Groq(api_key=GROQ_API_KEY)  
-    messages=[
+def build_image_messages(query, encoded_image, mime_type="image/jpeg"):
+    return [
         {
             "role": "user",
             "content": [
@@ -39,14 +46,23 @@ def analyze_image_with_query(query, model, encoded_image):
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{encoded_image}",
+                        "url": f"data:{mime_type};base64,{encoded_image}",
                     },
                 },
             ],
         }]
-    chat_completion=client.chat.completions.create(
-        messages=messages,
-        model=model
-    )
 
-    return chat_completion.choices[0].message.content
+def analyze_image_with_query(query, model, encoded_image, mime_type="image/jpeg"):
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not found in environment variables")
+    
+    messages=build_image_messages(query, encoded_image, mime_type)
+    return get_llm_provider().complete(GROQ_API_KEY, model, messages)
+
+def stream_image_analysis_with_query(query, model, encoded_image, mime_type="image/jpeg"):
+    """Same as analyze_image_with_query but yields the answer token by token"""
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not found in environment variables")
+    
+    messages=build_image_messages(query, encoded_image, mime_type)
+    yield from get_llm_provider().stream(GROQ_API_KEY, model, messages)
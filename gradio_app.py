@@ -88,6 +88,7 @@ with gr.Blocks(title="AI Doctor with Vision and Voice") as iface:
         outputs=[speech_output, doctor_response, audio_output]
     )
 
-iface.launch(debug=True, share=True)
+if __name__ == "__main__":
+    iface.launch(debug=True, share=True)
 
 #http://127.0.0.1:7860
\ No newline at end of file
@@ -5,11 +5,15 @@ load_dotenv()
 import os
 import gradio as gr
 import asyncio
+import tempfile
 from concurrent.futures import ThreadPoolExecutor
 
-from brain_of_the_doctor import encode_image, analyze_image_with_query
+from brain_of_the_doctor import prepare_image, analyze_image_with_query, stream_image_analysis_with_query
 from voice_of_the_patient import transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_elevenlabs
+from voice_of_the_doctor import text_to_speech_with_elevenlabs, text_to_speech_bytes_with_elevenlabs
+from speech_pipeline import TTS_PIPELINED, synthesize_pipelined
+from circuit_breaker import get_breaker, CircuitOpen
+from providers import get_llm_provider
 
 # System prompt for the AI doctor
 system_prompt = """You have to act as a professional doctor, i know you are not but this is for learning purpose. 
@@ -49,39 +53,85 @@ def analyze_image_simple(image_filepath, query_text):
         return "No image provided for analysis"
     
     try:
-        # First try with vision model
+        # First try with vision model, unless it has been failing
+        vision_model = "meta-llama/llama-4-scout-17b-16e-instruct"
         full_query = system_prompt + " " + query_text
-        encoded_image = encode_image(image_filepath)
-        result = analyze_image_with_query(
-            query=full_query,
-            encoded_image=encoded_image,
-            model="meta-llama/llama-4-scout-17b-16e-instruct"
-        )
+        with open(image_filepath, "rb") as image_file:
+            encoded_image, mime_type = prepare_image(image_file.read())
+        with get_breaker(vision_model).guard():
+            result = analyze_image_with_query(
+                query=full_query,
+                encoded_image=encoded_image,
+                mime_type=mime_type,
+                model=vision_model
+            )
         return result
     except Exception as vision_error:
-        print(f"Vision model failed: {vision_error}")
+        if not isinstance(vision_error, CircuitOpen):
+            print(f"Vision model failed: {vision_error}")
         
         # Fallback to text-only analysis
         try:
-            from groq import Groq
-            client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-            
-            fallback_prompt = f"""Based on the patient's description: '{query_text}', provide a medical assessment. 
-            Act as a professional doctor (for educational purposes). Provide a concise medical opinion and suggest remedies.
-            Keep your response to 2-3 sentences maximum. Start with 'Based on your description...'"""
-            
             print(f"Using fallback text-only analysis...")
-            completion = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[{"role": "user", "content": fallback_prompt}],
+            return get_llm_provider().complete(
+                os.environ.get("GROQ_API_KEY"),
+                "llama-3.1-8b-instant",
+                [{"role": "user", "content": fallback_prompt(query_text)}],
                 max_tokens=150
             )
             
-            return completion.choices[0].message.content
-            
         except Exception as fallback_error:
             print(f"Fallback also failed: {fallback_error}")
-            return f"I apologize, but I'm unable to analyze images at the moment. Based on your description '{query_text}', I recommend consulting with a medical professional for proper diagnosis and treatment."
+            return unavailable_message(query_text)
+
+def fallback_prompt(query_text):
+    return f"""Based on the patient's description: '{query_text}', provide a medical assessment. 
+            Act as a professional doctor (for educational purposes). Provide a concise medical opinion and suggest remedies.
+            Keep your response to 2-3 sentences maximum. Start with 'Based on your description...'"""
+
+def unavailable_message(query_text):
+    return f"I apologize, but I'm unable to analyze images at the moment. Based on your description '{query_text}', I recommend consulting with a medical professional for proper diagnosis and treatment."
+
+def stream_image_analysis_simple(image_filepath, query_text):
+    """Streaming version of analyze_image_simple, yields the answer token by token"""
+    produced = False
+    try:
+        vision_model = "meta-llama/llama-4-scout-17b-16e-instruct"
+        full_query = system_prompt + " " + query_text
+        with open(image_filepath, "rb") as image_file:
+            encoded_image, mime_type = prepare_image(image_file.read())
+        with get_breaker(vision_model).guard():
+            for token in stream_image_analysis_with_query(
+                query=full_query,
+                encoded_image=encoded_image,
+                mime_type=mime_type,
+                model=vision_model
+            ):
+                produced = True
+                yield token
+        return
+    except Exception as vision_error:
+        if produced:
+            raise
+        if not isinstance(vision_error, CircuitOpen):
+            print(f"Vision model failed: {vision_error}")
+    
+    # Fallback to text-only analysis
+    try:
+        print(f"Using fallback text-only analysis...")
+        for token in get_llm_provider().stream(
+            os.environ.get("GROQ_API_KEY"),
+            "llama-3.1-8b-instant",
+            [{"role": "user", "content": fallback_prompt(query_text)}],
+            max_tokens=150
+        ):
+            produced = True
+            yield token
+    except Exception as fallback_error:
+        if produced:
+            raise
+        print(f"Fallback also failed: {fallback_error}")
+        yield unavailable_message(query_text)
 
 def generate_voice_simple(text):
     """Simple voice generation function"""
@@ -96,8 +146,30 @@ def generate_voice_simple(text):
         print(f"Voice generation error: {str(e)}")
         return None
 
-def process_inputs_optimized(audio_file, image_file, progress=gr.Progress()):
-    """Optimized processing function with progress tracking"""
+def analyze_and_speak_pipelined(image_filepath, query_text):
+    """Analyze the image and synthesize the answer sentence by sentence as it streams"""
+    tokens = stream_image_analysis_simple(image_filepath, query_text)
+    if not os.environ.get("ELEVENLABS_API_KEY"):
+        return "".join(tokens), None
+    
+    doctor_response, segments = synthesize_pipelined(tokens, text_to_speech_bytes_with_elevenlabs)
+    if not segments:
+        return doctor_response, None
+    
+    # One file per answer, so concurrent sessions don't overwrite each other's audio
+    with tempfile.NamedTemporaryFile(prefix="doctor_response_", suffix=".mp3", delete=False) as f:
+        for segment in segments:
+            f.write(segment)
+    return doctor_response, f.name
+
+def process_inputs_optimized(audio_file, image_file, progress=gr.Progress(), pipelined=TTS_PIPELINED):
+    """Optimized processing function with progress tracking
+    
+    With `pipelined` (TTS_PIPELINED), speech for each sentence is generated
+    while the rest of the analysis is still streaming. This only applies when
+    an image is given; without one the reply is a fixed one-line message,
+    which is synthesized in one piece.
+    """
     
     # Initialize results
     transcription = ""
@@ -115,6 +187,13 @@ def process_inputs_optimized(audio_file, image_file, progress=gr.Progress()):
             transcription = "No audio provided"
             return transcription, "Please record some audio first", None
         
+        if pipelined and image_file:
+            # Steps 2 and 3 overlapped
+            progress(0.5, desc="Analyzing image and generating voice response...")
+            doctor_response, audio_output = analyze_and_speak_pipelined(image_file, transcription)
+            progress(1.0, desc="Complete!")
+            return transcription, doctor_response, audio_output
+        
         # Step 2: Analyze image with transcribed text
         progress(0.5, desc="Analyzing image...")
         if image_file:
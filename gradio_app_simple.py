@@ -4,7 +4,7 @@ load_dotenv()
 
 import os
 import gradio as gr
-from groq import Groq
+from providers import get_llm_provider
 
 from voice_of_the_patient import transcribe_with_groq
 from voice_of_the_doctor import text_to_speech_with_elevenlabs
@@ -40,8 +40,6 @@ def medical_analysis_text_only(query_text):
         return "Please provide a description of your symptoms for analysis."
     
     try:
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        
         medical_prompt = f"""{system_prompt}
 
 Patient describes: "{query_text}"
@@ -54,15 +52,14 @@ Please provide:
 
 Keep your response concise (2-3 sentences) and always recommend consulting a healthcare professional for proper diagnosis."""
         
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": medical_prompt}],
+        return get_llm_provider().complete(
+            os.environ.get("GROQ_API_KEY"),
+            "llama-3.1-8b-instant",
+            [{"role": "user", "content": medical_prompt}],
             max_tokens=200,
             temperature=0.7
         )
         
-        return completion.choices[0].message.content
-        
     except Exception as e:
         return f"I'm unable to provide analysis at the moment. For your symptoms '{query_text}', please consult with a medical professional for proper evaluation and treatment."
 
@@ -0,0 +1,149 @@
+"""
+Hedged upstream requests
+When a call has not answered within the recent p95 latency, a second identical
+call is started and whichever finishes first wins, within a budget of extra
+requests
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+
+HEDGING = os.environ.get("HEDGING", "false").lower() in ("1", "true", "yes")
+
+# Hedge once a call is slower than this percentile of recent latencies
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+
+# Delay bounds, and the delay used until enough latencies have been observed
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_INITIAL_DELAY = float(os.environ.get("HEDGE_INITIAL_DELAY", "3"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.environ.get("HEDGE_WINDOW", "200"))
+
+# Extra requests allowed per primary request (0.1 = at most 10% more traffic)
+HEDGE_BUDGET_RATIO = float(os.environ.get("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_BURST = float(os.environ.get("HEDGE_BUDGET_BURST", "5"))
+
+
+class Hedger:
+    """Latency window, hedge budget and win counters for one upstream model.
+
+    Every primary call earns HEDGE_BUDGET_RATIO credits (up to
+    HEDGE_BUDGET_BURST) and every hedge spends one, so hedges cannot grow
+    traffic by more than the ratio even when the upstream is slow for everyone.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._latencies = deque(maxlen=HEDGE_WINDOW)
+        self._credits = HEDGE_BUDGET_BURST
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def delay(self):
+        """Seconds to wait for the primary before hedging"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY
+        index = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))
+        return max(HEDGE_MIN_DELAY, samples[index])
+
+    def _record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _start_call(self):
+        with self._lock:
+            self.calls += 1
+            self._credits = min(HEDGE_BUDGET_BURST, self._credits + HEDGE_BUDGET_RATIO)
+
+    def _spend_hedge(self):
+        with self._lock:
+            if self._credits < 1:
+                self.budget_denied += 1
+                return False
+            self._credits -= 1
+            self.hedges += 1
+            return True
+
+    async def _timed(self, make_call):
+        started = time.perf_counter()
+        result = await make_call()
+        self._record(time.perf_counter() - started)
+        return result
+
+    async def run(self, make_call):
+        """Await `make_call()`, racing a second attempt if the first is slow.
+
+        `make_call` must return a fresh coroutine on every call. The loser
+        is cancelled; if one attempt fails the other is still awaited.
+        """
+        self._start_call()
+        primary = asyncio.ensure_future(self._timed(make_call))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.delay())
+            if done or not self._spend_hedge():
+                return await primary
+
+            hedge = asyncio.ensure_future(self._timed(make_call))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+            # Both attempts failed, report the primary's error
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self):
+        delay = self.delay()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "win_ratio": round(self.hedge_wins / self.hedges, 4) if self.hedges else 0.0,
+                "budget_denied": self.budget_denied,
+                "delay_s": round(delay, 3),
+            }
+
+
+_hedgers = {}
+
+
+def get_hedger(name):
+    """Return the shared hedger for an upstream model, creating it on first use"""
+    hedger = _hedgers.get(name)
+    if hedger is None:
+        hedger = Hedger(name)
+        _hedgers[name] = hedger
+    return hedger
+
+
+async def hedged(name, make_call):
+    """Run `make_call()` through the model's hedger, or directly when HEDGING is off"""
+    if not HEDGING:
+        return await make_call()
+    return await get_hedger(name).run(make_call)
+
+
+def hedging_stats():
+    """Per model hedging counters, for /health"""
+    return {
+        "enabled": HEDGING,
+        "models": {name: hedger.stats() for name, hedger in _hedgers.items()},
+    }
@@ -0,0 +1,157 @@
+"""
+Image preprocessing before vision calls
+Applies EXIF orientation, downscales and recompresses large photos, and
+detects the real MIME type so the data URL is labelled correctly
+"""
+
+import os
+import io
+import json
+import hashlib
+import logging
+import threading
+
+from PIL import Image, ImageOps
+
+from cache import LRUCache, SQLiteCache
+
+IMAGE_PREPROCESSING = os.environ.get("IMAGE_PREPROCESSING", "true").lower() in ("1", "true", "yes")
+
+# Longest side sent to the vision model, larger images are downscaled
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", "1568"))
+
+# JPEG quality used when an image is re-encoded
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+
+# Preprocessed images kept in memory, keyed by input hash
+IMAGE_CACHE_BYTES = int(os.environ.get("IMAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Optional SQLite file shared across restarts and workers; empty disables it
+IMAGE_CACHE_PATH = os.environ.get("IMAGE_CACHE_PATH", "")
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "10000"))
+
+
+class ImageCache:
+    """Memory LRU of (bytes, MIME type), backed by an optional persistent SQLite cache"""
+
+    def __init__(self, memory_bytes=IMAGE_CACHE_BYTES, path=IMAGE_CACHE_PATH, max_entries=IMAGE_CACHE_MAX_ENTRIES):
+        self._memory = LRUCache(memory_bytes, sizeof=lambda entry: len(entry[0]))
+        self._persistent = SQLiteCache(path, "images", max_entries=max_entries) if path else None
+
+    def get(self, key):
+        entry = self._memory.get(key)
+        if entry is None and self._persistent is not None:
+            row = self._persistent.get(key)
+            if row is not None:
+                # Stored as "<MIME type>\n<image bytes>"
+                mime_type, _, data = bytes(row).partition(b"\n")
+                entry = (data, mime_type.decode("ascii"))
+                self._memory.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self._memory.put(key, entry)
+        if self._persistent is not None:
+            data, mime_type = entry
+            self._persistent.put(key, mime_type.encode("ascii") + b"\n" + bytes(data))
+
+    def stats(self):
+        return {
+            "memory": self._memory.stats(),
+            "persistent": self._persistent.stats() if self._persistent is not None else None,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Return the process-wide image cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
+
+
+def detect_mime_type(data):
+    """Detect the image type from its magic bytes"""
+    header = bytes(data[:12])
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def _cache_key(data):
+    digest = hashlib.sha256(data).hexdigest()
+    params = json.dumps([digest, IMAGE_MAX_DIMENSION, IMAGE_JPEG_QUALITY])
+    return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+
+def _process(data):
+    original_mime = detect_mime_type(data)
+    image = Image.open(io.BytesIO(data))
+    image.load()
+
+    # EXIF tag 0x0112 is the orientation, 1 means already upright
+    needs_rotation = image.getexif().get(0x0112, 1) != 1
+    if needs_rotation:
+        image = ImageOps.exif_transpose(image)
+    needs_resize = max(image.size) > IMAGE_MAX_DIMENSION
+
+    if needs_resize:
+        image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.Resampling.LANCZOS)
+
+    # Flatten transparency onto white, vision models do not need alpha
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image.convert("RGBA"), mask=image.convert("RGBA").split()[-1])
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    processed = output.getvalue()
+
+    # A small, upright image may already be smaller than our re-encode
+    if not needs_resize and not needs_rotation and len(processed) >= len(data):
+        return bytes(data), original_mime
+    return processed, "image/jpeg"
+
+
+def preprocess_image(data):
+    """Prepare an uploaded image for the vision model.
+
+    Returns (image bytes, MIME type). Results are cached by input hash;
+    anything Pillow cannot read is passed through unchanged with its
+    detected MIME type.
+    """
+    if not IMAGE_PREPROCESSING:
+        return data, detect_mime_type(data)
+
+    key = _cache_key(data)
+    cache = get_image_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        result = _process(data)
+    except Exception as e:
+        logging.warning(f"Image preprocessing skipped: {e}")
+        return data, detect_mime_type(data)
+
+    cache.put(key, result)
+    return result
+
+
+def cache_stats():
+    return get_image_cache().stats()
@@ -0,0 +1,430 @@
+"""
+Background jobs for long consultations
+Submitted jobs wait in a SQLite queue shared by all workers and run on a
+bounded pool of tasks in each server process. Results are kept for
+JOB_RESULT_TTL seconds and fetched by polling, long-polling or a webhook
+"""
+
+import os
+import hmac
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import httpx
+from fastapi import HTTPException
+
+from upstream_pool import run_blocking
+from rate_limit import WEB_CONCURRENCY
+from metrics import JOBS
+
+# SQLite file holding queued jobs and results; serve.py puts it in SHARED_STATE_DIR
+JOBS_PATH = os.environ.get("JOBS_PATH") or "jobs.sqlite3"
+
+# Jobs each server process runs at the same time; 0 only accepts submissions
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+
+# Jobs allowed to wait across all workers, further submissions get 429
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "100"))
+
+# How long a finished job and its result can be fetched, in seconds
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "3600"))
+
+# A job still running after this many seconds fails
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", "300"))
+
+# Runs of a job cut short by a restart or crash before it is given up
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "2"))
+
+# How often idle workers look for jobs submitted to other processes
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+
+# Longest long-poll (GET /jobs/{id}?wait=), kept under common 30 s proxy timeouts
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", "25"))
+
+# How often expired results and jobs abandoned by dead workers are cleaned up
+JOB_SWEEP_INTERVAL = float(os.environ.get("JOB_SWEEP_INTERVAL", "60"))
+
+# Hosts webhooks may be sent to, comma separated ("*" for any); empty disables webhooks
+JOB_WEBHOOK_HOSTS = [host.strip().lower() for host in os.environ.get("JOB_WEBHOOK_HOSTS", "").split(",") if host.strip()]
+
+# When set, webhook bodies are signed with HMAC-SHA256 in X-Predicare-Signature
+JOB_WEBHOOK_SECRET = os.environ.get("JOB_WEBHOOK_SECRET", "")
+JOB_WEBHOOK_TIMEOUT = float(os.environ.get("JOB_WEBHOOK_TIMEOUT", "10"))
+JOB_WEBHOOK_ATTEMPTS = 3
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# Assumed job duration for Retry-After before any job has finished
+_DEFAULT_JOB_SECONDS = 10.0
+
+
+class QueueFull(HTTPException):
+    """429 raised when JOB_QUEUE_MAX jobs are already waiting"""
+
+    def __init__(self, retry_after):
+        super().__init__(
+            status_code=429,
+            detail="Job queue is full, please retry later",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        )
+
+
+def check_webhook_url(url):
+    """Refuse webhook URLs that are malformed or point outside JOB_WEBHOOK_HOSTS"""
+    if not JOB_WEBHOOK_HOSTS:
+        raise HTTPException(status_code=400, detail="Webhooks are not enabled on this server")
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise HTTPException(status_code=400, detail="webhook_url must be an http(s) URL")
+    if "*" not in JOB_WEBHOOK_HOSTS and parsed.hostname.lower() not in JOB_WEBHOOK_HOSTS:
+        raise HTTPException(status_code=400, detail=f"Webhooks to {parsed.hostname} are not allowed")
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc).isoformat() if value is not None else None
+
+
+class JobStore:
+    """Jobs, their input files and results in a SQLite file.
+
+    WAL mode and BEGIN IMMEDIATE transactions make it safe to share between
+    the threads and worker processes of one host: a job is claimed by
+    exactly one worker, and the queue limit holds across all of them.
+    """
+
+    def __init__(self, path=JOBS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT, status TEXT, payload TEXT, webhook_url TEXT, "
+            "result TEXT, error TEXT, attempts INTEGER DEFAULT 0, "
+            "created_at REAL, started_at REAL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        # Inputs are dropped as soon as the job finishes, results stay until they expire
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files (job_id TEXT, name TEXT, data BLOB, PRIMARY KEY (job_id, name))"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        # Taking the write lock up front makes check-then-write atomic across processes
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def submit(self, kind, payload, files, webhook_url=None, max_queued=JOB_QUEUE_MAX):
+        """Queue a job and return its ID, or None when max_queued jobs are already waiting"""
+        job_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= max_queued:
+                return None
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, webhook_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), webhook_url, time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO job_files (job_id, name, data) VALUES (?, ?, ?)",
+                [(job_id, name, data) for name, data in files.items()],
+            )
+        return job_id
+
+    def claim(self):
+        """Mark the oldest queued job running; (job_id, kind, payload, files) or None"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, kind, payload = row
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, time.time(), job_id),
+            )
+            files = dict(conn.execute("SELECT name, data FROM job_files WHERE job_id = ?", (job_id,)).fetchall())
+        return job_id, kind, json.loads(payload), files
+
+    def finish(self, job_id, result=None, error=None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (FAILED if error else SUCCEEDED, json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id, RUNNING),
+            )
+            conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+
+    def release(self, job_id):
+        """Put a job interrupted by a shutdown back in the queue; the run does not count as an attempt"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, attempts = attempts - 1 WHERE id = ? AND status = ?",
+                (QUEUED, job_id, RUNNING),
+            )
+
+    def get(self, job_id):
+        """Public view of a job, or None when it does not exist or has expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, status, webhook_url, result, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            kind, status, webhook_url, result, error, created_at, started_at, finished_at = row
+            if finished_at is not None and time.time() - finished_at > JOB_RESULT_TTL:
+                return None
+            position = None
+            if status == QUEUED:
+                position = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, created_at)
+                ).fetchone()[0]
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "created_at": _timestamp(created_at),
+            "started_at": _timestamp(started_at),
+            "finished_at": _timestamp(finished_at),
+            "queue_position": position,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "webhook_url": webhook_url,
+        }
+
+    def sweep(self, ttl=JOB_RESULT_TTL, timeout=JOB_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS):
+        """Delete expired jobs and recover ones whose worker died; (removed, IDs of jobs given up)"""
+        now = time.time()
+        # A live worker fails its job at `timeout`, so anything running well past it was abandoned
+        abandoned = now - timeout - max(JOB_SWEEP_INTERVAL, 30)
+        with self._transaction() as conn:
+            removed = conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - ttl,)).rowcount
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ? AND started_at < ? AND attempts < ?",
+                (QUEUED, RUNNING, abandoned, max_attempts),
+            )
+            given_up = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND started_at < ?", (RUNNING, abandoned)
+            ).fetchall()]
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND started_at < ?",
+                (FAILED, f"Job was interrupted {max_attempts} times", now, RUNNING, abandoned),
+            )
+            conn.execute("DELETE FROM job_files WHERE job_id NOT IN (SELECT id FROM jobs WHERE status IN (?, ?))",
+                         (QUEUED, RUNNING))
+        return removed, given_up
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            # Recent jobs only, so the estimate follows current upstream latency
+            average = self._conn.execute(
+                "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs "
+                "WHERE finished_at IS NOT NULL AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT 50)"
+            ).fetchone()[0]
+        return {
+            "path": self.path,
+            "statuses": {status: counts.get(status, 0) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)},
+            "average_seconds": round(average, 3) if average is not None else None,
+        }
+
+
+class JobQueue:
+    """Submit jobs and run them on JOB_WORKERS tasks in this process.
+
+    Handlers map a job kind to `async handler(payload, files)` returning a
+    JSON-serializable result; an exception fails the job with its message.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self.handlers = {}
+        self._tasks = []
+        self._deliveries = set()
+        # Set on local submissions, so idle workers start at once instead of at the next poll
+        self._wakeup = asyncio.Event()
+        # Replaced after every local completion, so long-polls here return at once
+        self._changed = asyncio.Event()
+
+    def start(self, handlers):
+        self.handlers = dict(handlers)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_periodically()))
+
+    async def stop(self):
+        """Cancel the workers; jobs they were running go back to the queue"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._deliveries, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind, payload, files=None, webhook_url=None):
+        """Queue a job and return its ID; raises QueueFull (429) when the queue is full"""
+        job_id = await run_blocking(None, self.store.submit, kind, payload, files or {}, webhook_url)
+        if job_id is None:
+            JOBS.labels("rejected").inc()
+            raise QueueFull(await run_blocking(None, self.retry_after))
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id):
+        return await run_blocking(None, self.store.get, job_id)
+
+    async def wait(self, job_id, timeout):
+        """The job once it has finished or `timeout` seconds have passed; None if unknown"""
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self._changed
+            job = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            # Jobs run by other workers are only seen by polling
+            try:
+                await asyncio.wait_for(changed.wait(), min(JOB_POLL_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up: one average job spread over every runner"""
+        average = self.store.stats()["average_seconds"] or _DEFAULT_JOB_SECONDS
+        return average / max(1, self.workers * WEB_CONCURRENCY)
+
+    async def _work(self):
+        while True:
+            claim = asyncio.ensure_future(run_blocking(None, self.store.claim))
+            try:
+                job = await asyncio.shield(claim)
+            except asyncio.CancelledError:
+                # The claim finishes in its thread regardless; hand the job straight back
+                job = await claim
+                if job is not None:
+                    await self._release(job[0])
+                raise
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*job)
+
+    async def _release(self, job_id):
+        # Off the event loop like the claim, and shielded so a second cancellation cannot drop it
+        release = asyncio.ensure_future(run_blocking(None, self.store.release, job_id))
+        await asyncio.shield(release)
+
+    async def _run(self, job_id, kind, payload, files):
+        result = error = None
+        try:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"No handler for job kind '{kind}'")
+            result = await asyncio.wait_for(handler(payload, files), JOB_TIMEOUT)
+        except asyncio.CancelledError:
+            # Shutting down: the next worker to start picks the job up again
+            await self._release(job_id)
+            raise
+        except asyncio.TimeoutError:
+            error = f"Job timed out after {JOB_TIMEOUT:.0f} seconds"
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+
+        await run_blocking(None, self.store.finish, job_id, result, error)
+        JOBS.labels(FAILED if error else SUCCEEDED).inc()
+        self._changed.set()
+        self._changed = asyncio.Event()
+        await self._notify(job_id)
+
+    async def _notify(self, job_id):
+        job = await self.get(job_id)
+        if job is not None and job["webhook_url"]:
+            delivery = asyncio.create_task(self._deliver(job))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, job):
+        """POST the finished job (the GET /jobs/{id} body) to its webhook, retrying server errors"""
+        url = job.pop("webhook_url")
+        body = json.dumps(job).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if JOB_WEBHOOK_SECRET:
+            signature = hmac.new(JOB_WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+            headers["X-Predicare-Signature"] = f"sha256={signature}"
+
+        failure = None
+        async with httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT) as client:
+            for attempt in range(JOB_WEBHOOK_ATTEMPTS):
+                try:
+                    response = await client.post(url, content=body, headers=headers)
+                    if response.status_code < 500:
+                        if response.status_code >= 400:
+                            logging.warning(f"Webhook for job {job['job_id']} was refused: HTTP {response.status_code}")
+                        return
+                    failure = f"HTTP {response.status_code}"
+                except httpx.HTTPError as e:
+                    failure = str(e) or type(e).__name__
+                if attempt + 1 < JOB_WEBHOOK_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
+        logging.warning(f"Webhook for job {job['job_id']} failed: {failure}")
+
+    async def _sweep_periodically(self):
+        while True:
+            try:
+                removed, given_up = await run_blocking(None, self.store.sweep)
+                if removed:
+                    logging.info(f"Job sweep removed {removed} expired jobs")
+                for job_id in given_up:
+                    JOBS.labels(FAILED).inc()
+                    await self._notify(job_id)
+            except Exception as sweep_error:
+                logging.warning(f"Job sweep failed: {sweep_error}")
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
+
+    def stats(self):
+        return dict(self.store.stats(), workers=self.workers, queue_max=JOB_QUEUE_MAX)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue, opening its store on first use"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(JobStore())
+        return _queue
+
+
+def job_stats():
+    return get_job_queue().stats()
@@ -0,0 +1,233 @@
+"""
+Prometheus metrics for the API
+Per-stage latency histograms, byte counters, fallback and error counts, and
+gauges for in-flight requests and cache hit ratios, served on /metrics
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+from rate_limit import error_status_code
+from tracing import span, annotate
+
+# Set by serve.py when running several workers: every worker writes its samples
+# there and /metrics aggregates them, whichever worker answers the scrape
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Upstream stages take from tens of milliseconds (cached) to tens of seconds
+_STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "predicare_stage_duration_seconds",
+    "Duration of each pipeline stage",
+    ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "predicare_stage_errors_total",
+    "Failed pipeline stages by cause (HTTP status or exception type)",
+    ["stage", "cause"],
+)
+FALLBACKS = Counter(
+    "predicare_fallbacks_total",
+    "Degraded answers by cause, e.g. vision to text-only or missing audio",
+    ["cause"],
+)
+HTTP_BYTES = Counter(
+    "predicare_http_bytes_total",
+    "Request bytes received and response bytes sent, by endpoint",
+    ["direction", "endpoint"],
+)
+UPSTREAM_BYTES = Counter(
+    "predicare_upstream_bytes_total",
+    "Bytes exchanged with upstream providers",
+    ["direction", "stage"],
+)
+HTTP_REQUESTS = Counter(
+    "predicare_http_requests_total",
+    "Completed requests by endpoint and status code",
+    ["endpoint", "status"],
+)
+IN_FLIGHT = Gauge(
+    "predicare_http_requests_in_flight",
+    "Requests currently being handled, by endpoint",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+JOBS = Counter(
+    "predicare_jobs_total",
+    "Background jobs by outcome: succeeded, failed, or rejected because the queue was full",
+    ["outcome"],
+)
+
+# Known endpoints, anything else is reported as "other" to bound label cardinality
+_ENDPOINTS = (
+    "/transcribe", "/analyze", "/synthesize/stream", "/synthesize", "/consultation/stream",
+    "/consultation", "/batch/analyze", "/batch/consultation", "/jobs", "/audio", "/health", "/metrics",
+)
+
+
+def endpoint_label(path):
+    if path == "/":
+        return "/"
+    for endpoint in _ENDPOINTS:
+        if path == endpoint or path.startswith(endpoint + "/"):
+            return endpoint
+    return "other"
+
+
+def error_cause(error):
+    status = error_status_code(error)
+    return str(status) if status is not None else type(error).__name__
+
+
+@contextmanager
+def observe_stage(stage):
+    """Time the enclosed block as `stage`, counting failures by cause.
+
+    The block is also recorded as a trace span of the current request.
+    """
+    started = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    except Exception as e:
+        STAGE_ERRORS.labels(stage, error_cause(e)).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def count_fallback(cause):
+    FALLBACKS.labels(cause).inc()
+    annotate(**{f"fallback.{cause}": True})
+
+
+def count_upstream_bytes(direction, stage, amount):
+    UPSTREAM_BYTES.labels(direction, stage).inc(amount)
+
+
+class MetricsMiddleware:
+    """Count requests, in-flight requests and bytes in each direction per endpoint"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        endpoint = endpoint_label(scope["path"])
+        status = "500"
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                HTTP_BYTES.labels("in", endpoint).inc(len(message.get("body", b"")))
+            return message
+
+        async def counting_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            elif message["type"] == "http.response.body":
+                HTTP_BYTES.labels("out", endpoint).inc(len(message.get("body", b"")))
+            await send(message)
+
+        IN_FLIGHT.labels(endpoint).inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            IN_FLIGHT.labels(endpoint).dec()
+            HTTP_REQUESTS.labels(endpoint, status).inc()
+
+
+class StatsCollector:
+    """Expose the caches', limiters' and breakers' own stats() at scrape time.
+
+    These are the answering worker's own numbers, also in multiprocess mode.
+    """
+
+    def __init__(self, caches, pool, limiters, breakers, jobs=None):
+        # Callables returning the same dicts /health reports
+        self.caches = caches
+        self.pool = pool
+        self.limiters = limiters
+        self.breakers = breakers
+        self.jobs = jobs
+
+    def describe(self):
+        # Without this, registering calls collect() and opens the caches at import
+        return []
+
+    def collect(self):
+        hit_ratio = GaugeMetricFamily("predicare_cache_hit_ratio", "Cache hits / lookups", labels=["cache"])
+        hits = CounterMetricFamily("predicare_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("predicare_cache_misses", "Cache misses", labels=["cache"])
+        for name, stats in self.caches().items():
+            if stats is None:
+                continue
+            hit_ratio.add_metric([name], stats["hit_ratio"])
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+        yield hit_ratio
+        yield hits
+        yield misses
+
+        slots = GaugeMetricFamily("predicare_upstream_slots_in_use", "Busy upstream pool slots", labels=["provider"])
+        for provider, stats in self.pool()["providers"].items():
+            slots.add_metric([provider], stats["limit"] - stats["available"])
+        yield slots
+
+        limits = GaugeMetricFamily("predicare_upstream_concurrency_limit", "Adaptive concurrency limit", labels=["limiter"])
+        throttled = CounterMetricFamily("predicare_upstream_throttled", "429 responses seen", labels=["limiter"])
+        for name, stats in self.limiters().items():
+            limits.add_metric([name], stats["concurrency_limit"])
+            throttled.add_metric([name], stats["throttled"])
+        yield limits
+        yield throttled
+
+        circuit = GaugeMetricFamily("predicare_circuit_open", "1 while a model's circuit is not closed", labels=["model"])
+        for model, stats in self.breakers().items():
+            circuit.add_metric([model], 0 if stats["state"] == "closed" else 1)
+        yield circuit
+
+        if self.jobs is not None:
+            # Counted in the shared job store, so every worker reports the same totals
+            jobs = GaugeMetricFamily("predicare_jobs", "Background jobs by status", labels=["status"])
+            for status, count in self.jobs()["statuses"].items():
+                jobs.add_metric([status], count)
+            yield jobs
+
+
+_stats_collector = None
+
+
+def register_stats(caches, pool, limiters, breakers, jobs=None):
+    """Publish component stats on /metrics; call once per process"""
+    global _stats_collector
+    _stats_collector = StatsCollector(caches, pool, limiters, breakers, jobs)
+    REGISTRY.register(_stats_collector)
+
+
+def render():
+    """Current metrics in the Prometheus text format, with its content type"""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if _stats_collector is not None:
+        registry.register(_stats_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_stopped():
+    """Drop this worker's live gauges from the shared samples when it shuts down"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -30,6 +30,68 @@ export interface ConsultationResponse {
   message: string;
 }
 
+// Background consultation job (POST /jobs/consultation, GET /jobs/{job_id})
+export interface JobResponse {
+  job_id: string;
+  kind: string;
+  status: 'queued' | 'running' | 'succeeded' | 'failed';
+  created_at: string;
+  started_at?: string;
+  finished_at?: string;
+  queue_position?: number; // jobs ahead of this one while queued
+  result?: ConsultationResponse;
+  error?: string;
+}
+
+// Live voice session messages (WebSocket /voice/session), one set per utterance
+export type VoiceSessionMessage =
+  | { type: 'speech_start'; utterance: number; offset_ms: number }
+  | { type: 'speech_end'; utterance: number; offset_ms: number; duration_ms: number }
+  | { type: 'transcript'; utterance: number; text: string; latency_ms: number }
+  | { type: 'error'; utterance: number; message: string };
+
+// Streaming consultation events, named after ConsultationResponse fields
+export type ConsultationStreamEvent =
+  | { event: 'transcription'; data: { transcription: string } }
+  | { event: 'analysis'; data: { analysis: string } }
+  | { event: 'audio_url'; data: { audio_url: string } }
+  | { event: 'success'; data: { success: boolean } }
+  | { event: 'message'; data: { message: string } };
+
+// One Server-Timing entry, e.g. upstream_groq;dur=812.4;desc="2 calls"
+export interface ServerTimingEntry {
+  name: string;
+  duration: number; // milliseconds
+  description?: string;
+}
+
+// Where the server spent its time on one request
+export interface RequestTiming {
+  path: string;
+  traceId?: string; // matches the exported trace when tracing is enabled
+  entries: ServerTimingEntry[];
+}
+
+// Parse a Server-Timing header value
+export function parseServerTiming(header: string | null): ServerTimingEntry[] {
+  if (!header) {
+    return [];
+  }
+  return header.split(',').map(part => {
+    const [name, ...params] = part.trim().split(';');
+    const entry: ServerTimingEntry = { name: name.trim(), duration: 0 };
+    for (const param of params) {
+      const [key, value = ''] = param.trim().split('=');
+      if (key === 'dur') {
+        entry.duration = parseFloat(value) || 0;
+      } else if (key === 'desc') {
+        entry.description = value.replace(/^"|"$/g, '');
+      }
+    }
+    return entry;
+  }).filter(entry => entry.name);
+}
+
 export interface HealthCheckResponse {
   status: string;
   timestamp: string;
@@ -43,13 +105,30 @@ export interface HealthCheckResponse {
 export class PredicareAPI {
   private baseURL: string;
 
+  // Timing of the most recent request, and an optional callback for every request
+  lastTiming: RequestTiming | null = null;
+  onTiming?: (timing: RequestTiming) => void;
+
   constructor(baseURL: string = 'http://localhost:8000') {
     this.baseURL = baseURL;
   }
 
+  // fetch() that records the Server-Timing and X-Trace-Id response headers
+  private async request(path: string, init?: RequestInit): Promise<Response> {
+    const response = await fetch(`${this.baseURL}${path}`, init);
+    const timing: RequestTiming = {
+      path,
+      traceId: response.headers.get('X-Trace-Id') ?? undefined,
+      entries: parseServerTiming(response.headers.get('Server-Timing')),
+    };
+    this.lastTiming = timing;
+    this.onTiming?.(timing);
+    return response;
+  }
+
   // Health check
   async healthCheck(): Promise<HealthCheckResponse> {
-    const response = await fetch(`${this.baseURL}/health`);
+    const response = await this.request('/health');
     if (!response.ok) {
       throw new Error(`Health check failed: ${response.statusText}`);
     }
@@ -61,7 +140,7 @@ export class PredicareAPI {
     const formData = new FormData();
     formData.append('audio', audioFile);
 
-    const response = await fetch(`${this.baseURL}/transcribe`, {
+    const response = await this.request('/transcribe', {
       method: 'POST',
       body: formData,
     });
@@ -78,7 +157,7 @@ export class PredicareAPI {
     query: string,
     imageBase64?: string
   ): Promise<AnalysisResponse> {
-    const response = await fetch(`${this.baseURL}/analyze`, {
+    const response = await this.request('/analyze', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -98,7 +177,7 @@ export class PredicareAPI {
 
   // Convert text to speech
   async synthesizeSpeech(text: string): Promise<SynthesisResponse> {
-    const response = await fetch(`${this.baseURL}/synthesize`, {
+    const response = await this.request('/synthesize', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -113,6 +192,28 @@ export class PredicareAPI {
     return response.json();
   }
 
+  // URL that streams speech for `text`, playable directly as an <audio> src
+  getSpeechStreamURL(text: string): string {
+    return `${this.baseURL}/synthesize/stream?text=${encodeURIComponent(text)}`;
+  }
+
+  // Convert text to speech, resolving as soon as the first audio bytes arrive
+  async synthesizeSpeechStream(text: string): Promise<ReadableStream<Uint8Array>> {
+    const response = await this.request('/synthesize/stream', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ text }),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Speech synthesis failed: ${response.statusText}`);
+    }
+
+    return response.body;
+  }
+
   // Complete consultation workflow
   async fullConsultation(
     audioFile?: File,
@@ -133,7 +234,7 @@ export class PredicareAPI {
       formData.append('query', query);
     }
 
-    const response = await fetch(`${this.baseURL}/consultation`, {
+    const response = await this.request('/consultation', {
       method: 'POST',
       body: formData,
     });
@@ -145,6 +246,151 @@ export class PredicareAPI {
     return response.json();
   }
 
+  // Complete consultation workflow, streamed stage by stage (Server-Sent Events)
+  async streamConsultation(
+    onEvent: (event: ConsultationStreamEvent) => void,
+    audioFile?: File,
+    imageFile?: File,
+    query?: string
+  ): Promise<void> {
+    const formData = new FormData();
+    
+    if (audioFile) {
+      formData.append('audio', audioFile);
+    }
+    
+    if (imageFile) {
+      formData.append('image', imageFile);
+    }
+    
+    if (query) {
+      formData.append('query', query);
+    }
+
+    const response = await this.request('/consultation/stream', {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Consultation failed: ${response.statusText}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) {
+        break;
+      }
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        let event = '';
+        let data = '';
+        for (const line of block.split('\n')) {
+          if (line.startsWith('event: ')) {
+            event = line.slice(7);
+          } else if (line.startsWith('data: ')) {
+            data += line.slice(6);
+          }
+        }
+        if (event && data) {
+          onEvent({ event, data: JSON.parse(data) } as ConsultationStreamEvent);
+        }
+      }
+    }
+  }
+
+  // Queue a consultation; returns at once with the job ID
+  async submitConsultationJob(
+    audioFile?: File,
+    imageFile?: File,
+    query?: string,
+    webhookURL?: string
+  ): Promise<JobResponse> {
+    const formData = new FormData();
+    
+    if (audioFile) {
+      formData.append('audio', audioFile);
+    }
+    
+    if (imageFile) {
+      formData.append('image', imageFile);
+    }
+    
+    if (query) {
+      formData.append('query', query);
+    }
+    
+    if (webhookURL) {
+      formData.append('webhook_url', webhookURL);
+    }
+
+    const response = await this.request('/jobs/consultation', {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (response.status === 429) {
+      const retryAfter = Number(response.headers.get('Retry-After') || '1');
+      throw new Error(`Job queue is full, retry in ${retryAfter} seconds`);
+    }
+    if (!response.ok) {
+      throw new Error(`Job submission failed: ${response.statusText}`);
+    }
+
+    return response.json();
+  }
+
+  // Job status; with waitSeconds the server holds the request until the job finishes
+  async getJob(jobId: string, waitSeconds: number = 0): Promise<JobResponse> {
+    const response = await this.request(`/jobs/${jobId}?wait=${waitSeconds}`);
+
+    if (!response.ok) {
+      throw new Error(`Job lookup failed: ${response.statusText}`);
+    }
+
+    return response.json();
+  }
+
+  // Long-poll a job until it has finished
+  async waitForJob(jobId: string): Promise<JobResponse> {
+    while (true) {
+      const job = await this.getJob(jobId, 25);
+      if (job.status === 'succeeded' || job.status === 'failed') {
+        return job;
+      }
+    }
+  }
+
+  // Live voice session: send 16-bit mono PCM chunks with socket.send() while the
+  // patient speaks, each utterance is transcribed as soon as they pause.
+  // socket.send(JSON.stringify({ type: 'end' })) ends an utterance at once,
+  // { type: 'close' } waits for the last transcripts before the server closes.
+  openVoiceSession(
+    onMessage: (message: VoiceSessionMessage) => void,
+    sampleRate: number = 16000,
+    language: string = 'en'
+  ): WebSocket {
+    const url = new URL(`${this.baseURL}/voice/session`);
+    url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+    url.searchParams.set('sample_rate', String(sampleRate));
+    url.searchParams.set('language', language);
+
+    const socket = new WebSocket(url.toString());
+    socket.binaryType = 'arraybuffer';
+    socket.onmessage = event => onMessage(JSON.parse(event.data) as VoiceSessionMessage);
+    return socket;
+  }
+
   // Get audio file URL
   getAudioURL(filename: string): string {
     return `${this.baseURL}/audio/${filename}`;
@@ -249,6 +495,15 @@ console.log(analysis.analysis);
 const consultation = await api.fullConsultation(audioFile, imageFile);
 console.log(consultation);
 
+// Where the seconds went on that consultation
+console.table(api.lastTiming?.entries);
+api.onTiming = timing => {
+  const total = timing.entries.find(entry => entry.name === 'total');
+  if (total && total.duration > 5000) {
+    console.warn(`Slow ${timing.path} (trace ${timing.traceId})`, timing.entries);
+  }
+};
+
 // React Component Example:
 function MedicalConsultation() {
   const { fullConsultation } = usePredicareAPI();
@@ -0,0 +1,252 @@
+"""
+Pluggable speech-to-text, LLM and text-to-speech backends
+"live" calls Groq and ElevenLabs through the shared clients; "fake" answers
+in-process with configurable latency, error rate and payload size, so the
+whole stack can be load-tested and profiled without network access
+"""
+
+import os
+import math
+import time
+import random
+import hashlib
+import threading
+
+from upstream_clients import get_groq_client, get_elevenlabs_client, resolve_elevenlabs_voice
+
+# Backend per stage: "live" or "fake" (PROVIDERS sets all three at once)
+PROVIDERS = os.environ.get("PROVIDERS", "live").lower()
+STT_PROVIDER = (os.environ.get("STT_PROVIDER") or PROVIDERS).lower()
+LLM_PROVIDER = (os.environ.get("LLM_PROVIDER") or PROVIDERS).lower()
+TTS_PROVIDER = (os.environ.get("TTS_PROVIDER") or PROVIDERS).lower()
+
+# Fake latency is log-normal: median in milliseconds and shape (0 = constant)
+FAKE_LATENCY_MS = float(os.environ.get("FAKE_LATENCY_MS", "300"))
+FAKE_LATENCY_SIGMA = float(os.environ.get("FAKE_LATENCY_SIGMA", "0.5"))
+FAKE_STT_LATENCY_MS = float(os.environ.get("FAKE_STT_LATENCY_MS", str(FAKE_LATENCY_MS)))
+FAKE_LLM_LATENCY_MS = float(os.environ.get("FAKE_LLM_LATENCY_MS", str(FAKE_LATENCY_MS)))
+FAKE_TTS_LATENCY_MS = float(os.environ.get("FAKE_TTS_LATENCY_MS", str(FAKE_LATENCY_MS)))
+
+# Delay between streamed tokens / audio chunks
+FAKE_STREAM_INTERVAL_MS = float(os.environ.get("FAKE_STREAM_INTERVAL_MS", "10"))
+
+# Share of calls that fail, and the HTTP status they fail with
+FAKE_ERROR_RATE = float(os.environ.get("FAKE_ERROR_RATE", "0"))
+FAKE_ERROR_STATUS = int(os.environ.get("FAKE_ERROR_STATUS", "503"))
+
+# Payload sizes: words per answer, MP3 bytes per input character, bytes per streamed chunk
+FAKE_LLM_WORDS = int(os.environ.get("FAKE_LLM_WORDS", "60"))
+FAKE_TTS_BYTES_PER_CHAR = int(os.environ.get("FAKE_TTS_BYTES_PER_CHAR", "270"))
+FAKE_TTS_CHUNK_BYTES = int(os.environ.get("FAKE_TTS_CHUNK_BYTES", "4096"))
+
+# Same seed and input give the same latency, failure and output
+FAKE_SEED = os.environ.get("FAKE_SEED", "0")
+
+
+class LiveSTT:
+    """Groq Whisper"""
+
+    def transcribe(self, api_key, audio_bytes, filename, model, language):
+        client = get_groq_client(api_key)
+        transcription = client.audio.transcriptions.create(
+            model=model,
+            file=(filename, audio_bytes),
+            language=language
+        )
+        return transcription.text
+
+
+class LiveLLM:
+    """Groq chat completions"""
+
+    def complete(self, api_key, model, messages, **options):
+        client = get_groq_client(api_key)
+        completion = client.chat.completions.create(messages=messages, model=model, **options)
+        return completion.choices[0].message.content
+
+    def stream(self, api_key, model, messages, **options):
+        client = get_groq_client(api_key)
+        stream = client.chat.completions.create(messages=messages, model=model, stream=True, **options)
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class LiveTTS:
+    """ElevenLabs text to speech"""
+
+    def _generate(self, api_key, text, voice, model, output_format, stream):
+        client = get_elevenlabs_client(api_key)
+        return client.generate(
+            text=text,
+            voice=resolve_elevenlabs_voice(client, voice),
+            output_format=output_format,
+            model=model,
+            stream=stream
+        )
+
+    def synthesize(self, api_key, text, voice, model, output_format):
+        return b"".join(self._generate(api_key, text, voice, model, output_format, stream=False))
+
+    def stream(self, api_key, text, voice, model, output_format):
+        for chunk in self._generate(api_key, text, voice, model, output_format, stream=True):
+            if chunk:
+                yield chunk
+
+
+class FakeProviderError(Exception):
+    """Injected failure, carries a status code like the SDK errors do"""
+
+    def __init__(self, stage, status_code=FAKE_ERROR_STATUS):
+        super().__init__(f"Injected {stage} failure ({status_code})")
+        self.status_code = status_code
+
+
+_FAKE_SENTENCES = [
+    "Based on your description, this looks like a mild skin irritation.",
+    "It may be caused by an allergic reaction, dry skin or a minor infection.",
+    "Keep the area clean and dry and avoid scratching it.",
+    "A fragrance-free moisturizer or an over-the-counter hydrocortisone cream may help.",
+    "Seek medical attention quickly if it spreads, blisters or comes with a fever.",
+    "Please consult a healthcare professional for a proper diagnosis.",
+]
+
+
+class _Fake:
+    """Seeded randomness shared by the fake backends"""
+
+    stage = "fake"
+    latency_ms = FAKE_LATENCY_MS
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _rng(self, *parts):
+        digest = hashlib.sha256(repr((FAKE_SEED, self.stage) + parts).encode("utf-8")).digest()
+        return random.Random(digest)
+
+    def _latency(self, rng):
+        if FAKE_LATENCY_SIGMA <= 0:
+            return self.latency_ms / 1000
+        return self.latency_ms / 1000 * math.exp(rng.gauss(0, FAKE_LATENCY_SIGMA))
+
+    def _begin(self, *parts):
+        """Sleep for the sampled latency, then fail if this call drew an error.
+
+        The draw depends on the call count too, so a retry of a failed call
+        can succeed while a replayed run still sees the same sequence.
+        """
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+        rng = self._rng("call", call_number, *parts)
+        time.sleep(self._latency(rng))
+        if rng.random() < FAKE_ERROR_RATE:
+            with self._lock:
+                self.failures += 1
+            raise FakeProviderError(self.stage)
+
+    def stats(self):
+        return {"calls": self.calls, "failures": self.failures}
+
+
+class FakeSTT(_Fake):
+    stage = "stt"
+    latency_ms = FAKE_STT_LATENCY_MS
+
+    def transcribe(self, api_key, audio_bytes, filename, model, language):
+        digest = hashlib.sha256(audio_bytes).hexdigest()
+        self._begin(digest, model, language)
+        return f"I have had an itchy red rash on my arm for a few days (recording {digest[:8]})."
+
+
+class FakeLLM(_Fake):
+    stage = "llm"
+    latency_ms = FAKE_LLM_LATENCY_MS
+
+    def _answer(self, rng):
+        words = []
+        while len(words) < FAKE_LLM_WORDS:
+            words.extend(rng.choice(_FAKE_SENTENCES).split())
+        return " ".join(words[:FAKE_LLM_WORDS]).rstrip(".") + "."
+
+    def complete(self, api_key, model, messages, **options):
+        self._begin(repr(messages), model)
+        return self._answer(self._rng(repr(messages), model))
+
+    def stream(self, api_key, model, messages, **options):
+        self._begin(repr(messages), model)
+        for index, word in enumerate(self._answer(self._rng(repr(messages), model)).split(" ")):
+            time.sleep(FAKE_STREAM_INTERVAL_MS / 1000)
+            yield word if index == 0 else " " + word
+
+
+class FakeTTS(_Fake):
+    stage = "tts"
+    latency_ms = FAKE_TTS_LATENCY_MS
+
+    def _audio(self, text):
+        # An MPEG frame header followed by padding, the size is what matters here
+        size = max(len(text), 1) * FAKE_TTS_BYTES_PER_CHAR
+        return (b"\xff\xf3\x48\xc4" + bytes(size))[:size]
+
+    def synthesize(self, api_key, text, voice, model, output_format):
+        self._begin(text, voice, model, output_format)
+        return self._audio(text)
+
+    def stream(self, api_key, text, voice, model, output_format):
+        self._begin(text, voice, model, output_format)
+        audio = self._audio(text)
+        for start in range(0, len(audio), FAKE_TTS_CHUNK_BYTES):
+            if start:
+                time.sleep(FAKE_STREAM_INTERVAL_MS / 1000)
+            yield audio[start:start + FAKE_TTS_CHUNK_BYTES]
+
+
+_BACKENDS = {
+    "stt": {"live": LiveSTT, "fake": FakeSTT},
+    "llm": {"live": LiveLLM, "fake": FakeLLM},
+    "tts": {"live": LiveTTS, "fake": FakeTTS},
+}
+_SELECTED = {"stt": STT_PROVIDER, "llm": LLM_PROVIDER, "tts": TTS_PROVIDER}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def _get_provider(stage):
+    with _providers_lock:
+        provider = _providers.get(stage)
+        if provider is None:
+            name = _SELECTED[stage]
+            if name not in _BACKENDS[stage]:
+                raise ValueError(f"Unknown {stage} provider '{name}', expected one of {sorted(_BACKENDS[stage])}")
+            provider = _BACKENDS[stage][name]()
+            _providers[stage] = provider
+        return provider
+
+
+def get_stt_provider():
+    return _get_provider("stt")
+
+
+def get_llm_provider():
+    return _get_provider("llm")
+
+
+def get_tts_provider():
+    return _get_provider("tts")
+
+
+def provider_stats():
+    """Selected backend per stage, with call counts for the fakes"""
+    with _providers_lock:
+        providers = dict(_providers)
+    stats = {}
+    for stage in _BACKENDS:
+        stats[stage] = {"backend": _SELECTED[stage]}
+        if isinstance(providers.get(stage), _Fake):
+            stats[stage].update(providers[stage].stats())
+    return stats
@@ -0,0 +1,342 @@
+"""
+Rate limiting and retries for upstream calls
+Token buckets for requests and tokens per minute, an AIMD concurrency limit
+and a retry loop that honors 429 Retry-After, shared per provider and model
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+
+import httpx
+from fastapi import HTTPException
+
+from upstream_pool import run_blocking, iterate_blocking, PROVIDER_CONCURRENCY
+from tracing import span
+from hedging import hedged
+
+# Provider quotas per model, 0 disables the bucket (ElevenLabs counts characters)
+PROVIDER_QUOTAS = {
+    "groq": (
+        int(os.environ.get("GROQ_REQUESTS_PER_MINUTE", "0")),
+        int(os.environ.get("GROQ_TOKENS_PER_MINUTE", "0")),
+    ),
+    "elevenlabs": (
+        int(os.environ.get("ELEVENLABS_REQUESTS_PER_MINUTE", "0")),
+        int(os.environ.get("ELEVENLABS_CHARACTERS_PER_MINUTE", "0")),
+    ),
+}
+
+# Worker processes sharing these quotas (serve.py and uvicorn read the same
+# variable); each process enforces an equal share
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# Retry policy: exponential backoff with full jitter, capped per attempt
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get("UPSTREAM_RETRY_BASE_DELAY", "0.5"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get("UPSTREAM_RETRY_MAX_DELAY", "20"))
+
+# Status codes worth retrying besides 429
+_RETRYABLE_STATUS = {408, 409, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity`.
+
+    Waiters are served in arrival order, so a large request cannot be
+    starved by a stream of small ones.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` tokens are available and take them"""
+        # A single request larger than the bucket would wait forever otherwise
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def available(self):
+        self._refill()
+        return self._tokens
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit tuned by AIMD from upstream throttling.
+
+    Every success raises the limit by 1/limit (about +1 per round trip of
+    `limit` calls); a 429 halves it, at most once per `decrease_interval`
+    seconds so one burst of rejections only counts once.
+    """
+
+    def __init__(self, maximum, minimum=1, decrease_factor=0.5, decrease_interval=1.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            while self.in_flight >= max(self.minimum, int(self.limit)):
+                await self._condition.wait()
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.decrease_interval:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            self._last_decrease = now
+
+
+class UpstreamRateLimited(HTTPException):
+    """429 raised when a provider keeps throttling after every retry"""
+
+    def __init__(self, provider, retry_after=None):
+        headers = {"Retry-After": str(max(1, int(retry_after + 0.999)))} if retry_after else None
+        super().__init__(
+            status_code=429,
+            detail=f"{provider} rate limit reached, please retry later",
+            headers=headers
+        )
+
+
+def error_status_code(error):
+    """HTTP status of an SDK error, or None for connection errors and the like"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_seconds(error):
+    """Delay requested by the provider's Retry-After header, if any"""
+    # Groq errors carry the httpx response; ElevenLabs' ApiError only a plain headers dict
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None) or {}
+    value = next((value for name, value in headers.items() if name.lower() == "retry-after"), None)
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_connection_error(error):
+    # The SDKs wrap httpx transport errors in their own connection error types
+    return isinstance(error, httpx.TransportError) or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class UpstreamLimiter:
+    """Request and token buckets plus adaptive concurrency for one provider model"""
+
+    def __init__(self, provider, model, requests_per_minute=0, tokens_per_minute=0, max_concurrency=None):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency or PROVIDER_CONCURRENCY.get(provider, 16))
+        self._paused_until = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+
+    async def acquire(self, tokens=0):
+        # Everyone waits out a Retry-After, not just the caller that saw the 429
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.requests:
+            await self.requests.acquire(1)
+        if self.tokens and tokens:
+            await self.tokens.acquire(tokens)
+        await self.concurrency.acquire()
+        self.calls += 1
+
+    async def release(self):
+        await self.concurrency.release()
+
+    def on_success(self):
+        self.concurrency.on_success()
+
+    def on_throttle(self, retry_after=None):
+        self.throttled += 1
+        self.concurrency.on_throttle()
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+
+_limiters = {}
+
+
+def get_limiter(provider, model=None):
+    """Return the shared limiter for a provider model, creating it on first use"""
+    key = (provider, model)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        requests_per_minute, tokens_per_minute = PROVIDER_QUOTAS.get(provider, (0, 0))
+        limiter = UpstreamLimiter(
+            provider, model, requests_per_minute / WEB_CONCURRENCY, tokens_per_minute / WEB_CONCURRENCY
+        )
+        _limiters[key] = limiter
+    return limiter
+
+
+def _retry_delay(limiter, error, attempt):
+    """Seconds to wait before retrying `error`, or None if it should be raised"""
+    status = error_status_code(error)
+    if status == 429:
+        retry_after = retry_after_seconds(error)
+        limiter.on_throttle(retry_after)
+        return retry_after if retry_after is not None else backoff_delay(attempt)
+    if status in _RETRYABLE_STATUS or (status is None and _is_connection_error(error)):
+        return backoff_delay(attempt)
+    return None
+
+
+def _give_up(limiter, error, delay):
+    if error_status_code(error) == 429:
+        return UpstreamRateLimited(limiter.provider, delay)
+    return error
+
+
+async def call_with_retries(provider, fn, *args, limiter_model=None, tokens=0, hedge=False, **kwargs):
+    """run_blocking with rate limiting and retries.
+
+    Throttling (429) and transient errors (5xx, timeouts, dropped
+    connections) are retried up to UPSTREAM_MAX_RETRIES times, waiting for
+    Retry-After when the provider sends one. A 429 that outlasts the retries
+    is raised as UpstreamRateLimited; anything else is raised unchanged.
+
+    `limiter_model` and `tokens` select and charge the limiter and are not
+    passed on to `fn`. With `hedge`, each attempt is raced against a second
+    call through the `limiter_model` hedger, so only upstream latency is
+    sampled and a hedge never repeats the limiter wait or the backoff.
+    """
+    limiter = get_limiter(provider, limiter_model)
+    attempt = 0
+    while True:
+        with span("rate_limit_wait", provider=provider):
+            await limiter.acquire(tokens)
+        try:
+            with span(f"upstream_{provider}", model=limiter_model or "", attempt=attempt):
+                if hedge:
+                    result = await hedged(limiter_model, lambda: run_blocking(provider, fn, *args, **kwargs))
+                else:
+                    result = await run_blocking(provider, fn, *args, **kwargs)
+        except Exception as e:
+            failure = e
+            delay = _retry_delay(limiter, e, attempt)
+            if delay is None:
+                raise
+            if attempt >= UPSTREAM_MAX_RETRIES or delay > UPSTREAM_RETRY_MAX_DELAY:
+                error = _give_up(limiter, e, delay)
+                if error is e:
+                    raise
+                raise error from e
+        else:
+            limiter.on_success()
+            return result
+        finally:
+            await limiter.release()
+
+        logging.warning(f"{provider} call failed ({failure}), retrying in {delay:.2f}s")
+        limiter.retries += 1
+        attempt += 1
+        with span("retry_backoff", provider=provider):
+            await asyncio.sleep(delay)
+
+
+async def iterate_with_retries(provider, fn, *args, limiter_model=None, tokens=0, **kwargs):
+    """iterate_blocking with rate limiting and retries.
+
+    Only failures before the first item are retried; once output has been
+    yielded an error is raised to the caller as-is.
+    """
+    limiter = get_limiter(provider, limiter_model)
+    attempt = 0
+    while True:
+        produced = False
+        with span("rate_limit_wait", provider=provider):
+            await limiter.acquire(tokens)
+        try:
+            with span(f"upstream_{provider}_stream", model=limiter_model or "", attempt=attempt):
+                async for item in iterate_blocking(provider, fn, *args, **kwargs):
+                    produced = True
+                    yield item
+        except Exception as e:
+            failure = e
+            delay = None if produced else _retry_delay(limiter, e, attempt)
+            if delay is None:
+                raise
+            if attempt >= UPSTREAM_MAX_RETRIES or delay > UPSTREAM_RETRY_MAX_DELAY:
+                error = _give_up(limiter, e, delay)
+                if error is e:
+                    raise
+                raise error from e
+        else:
+            limiter.on_success()
+            return
+        finally:
+            await limiter.release()
+
+        logging.warning(f"{provider} stream failed ({failure}), retrying in {delay:.2f}s")
+        limiter.retries += 1
+        attempt += 1
+        with span("retry_backoff", provider=provider):
+            await asyncio.sleep(delay)
+
+
+def limiter_stats():
+    """Per provider and model limiter state, for /health"""
+    return {
+        f"{provider}:{model}" if model else provider: limiter.stats()
+        for (provider, model), limiter in _limiters.items()
+    }
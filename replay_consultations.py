@@ -0,0 +1,233 @@
+"""
+Offline replay of consultation requests from a JSONL file
+Runs every record through the same transcription, analysis and speech stages
+as the /consultation endpoint, without starting the HTTP server, and appends
+one result line per record to the output file as soon as it finishes
+
+Input lines: {"id": ..., "query": "...", "image_path": "...", "audio_path": "..."}
+(all optional except that a record needs a query or an audio file; relative
+paths are resolved against the input file's directory)
+
+Run: python replay_consultations.py input.jsonl results.jsonl [--concurrency 8] [--offset N | --resume]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from api_backend import transcribe_file, run_analysis, cached_speech
+from batch import get_token_budget, estimate_tokens, BATCH_CONCURRENCY
+from tts_cache import get_tts_cache
+from upstream_pool import shutdown_pool
+from upstream_clients import close_clients
+
+
+def read_records(path, offset=0):
+    """Yield (line number, record or error) for every non-empty line from `offset` on"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            if line_number < offset or not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f"Invalid JSON: {e}")
+
+
+def completed_lines(path):
+    """Line numbers already present in a previous results file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["line"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # A run killed mid-write can leave a truncated last line
+                continue
+    return done
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _resolve(path, base_dir):
+    if not path:
+        return None
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+async def replay_record(record, base_dir, groq_api_key, speech=True):
+    """Run one record through the consultation pipeline and return its result fields"""
+    query = record.get("query")
+    transcription = None
+
+    audio_path = _resolve(record.get("audio_path"), base_dir)
+    if audio_path:
+        transcription = await transcribe_file(audio_path)
+        query = transcription
+
+    if not query:
+        raise ValueError("No query provided (audio or text)")
+
+    image_content = None
+    image_path = _resolve(record.get("image_path"), base_dir)
+    if image_path:
+        with open(image_path, "rb") as f:
+            image_content = f.read()
+
+    await get_token_budget().acquire(estimate_tokens(query, has_image=image_content is not None))
+    analysis = await run_analysis(query, groq_api_key, image_content)
+
+    audio_url = None
+    speech_error = None
+    if speech and analysis and not analysis.startswith("Error"):
+        # Like the API, keep the analysis when only the voice synthesis fails
+        try:
+            key = await cached_speech(analysis)
+            audio_url = f"/audio/{get_tts_cache().filename(key)}"
+        except Exception as e:
+            speech_error = getattr(e, "detail", None) or str(e)
+
+    return {
+        "transcription": transcription,
+        "analysis": analysis,
+        "audio_url": audio_url,
+        "speech_error": speech_error,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, succeeded, failed, skipped, elapsed):
+    latencies = sorted(latencies)
+    processed = succeeded + failed
+    return {
+        "processed": processed,
+        "succeeded": succeeded,
+        "failed": failed,
+        "skipped": skipped,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(processed / elapsed, 3) if elapsed else 0.0,
+        "latency_s": {
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p90": round(percentile(latencies, 0.90), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+    }
+
+
+async def replay(input_path, output_path, concurrency=BATCH_CONCURRENCY, offset=0, resume=False, speech=True):
+    """Replay every record of `input_path` and append results to `output_path`"""
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    if not groq_api_key:
+        raise SystemExit("GROQ_API_KEY not configured")
+    speech = speech and bool(os.environ.get("ELEVENLABS_API_KEY"))
+
+    base_dir = os.path.dirname(os.path.abspath(input_path))
+    done = completed_lines(output_path) if resume else set()
+    # Restarting at an offset continues an earlier run, so its results are kept
+    append = resume or offset > 0
+
+    # Bounded queue so a large input file is streamed, not loaded
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    latencies = []
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    start = time.perf_counter()
+
+    with open(output_path, "a" if append else "w", encoding="utf-8") as out:
+        if append and out.tell() and not _ends_with_newline(output_path):
+            # Start after the truncated line left by an interrupted run
+            out.write("\n")
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                line_number, record = item
+                result = {"line": line_number}
+                began = time.perf_counter()
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    if "id" in record:
+                        result["id"] = record["id"]
+                    result.update(await replay_record(record, base_dir, groq_api_key, speech))
+                    result["success"] = True
+                    counts["succeeded"] += 1
+                except Exception as e:
+                    result["success"] = False
+                    result["error"] = getattr(e, "detail", None) or str(e)
+                    counts["failed"] += 1
+                result["latency_s"] = round(time.perf_counter() - began, 3)
+                latencies.append(result["latency_s"])
+
+                # One complete line per record, flushed so an interrupted run can resume
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+
+        async def produce(workers):
+            for line_number, record in read_records(input_path, offset):
+                if line_number in done:
+                    counts["skipped"] += 1
+                    continue
+                await queue.put((line_number, record))
+            for _ in range(workers):
+                await queue.put(None)
+
+        # A worker that dies (e.g. the output disk is full) cancels the rest,
+        # instead of leaving the producer blocked on the full queue
+        workers = max(1, concurrency)
+        try:
+            async with asyncio.TaskGroup() as group:
+                for _ in range(workers):
+                    group.create_task(worker())
+                group.create_task(produce(workers))
+        except ExceptionGroup as failure:
+            raise failure.exceptions[0]
+
+    return summarize(latencies, counts["succeeded"], counts["failed"], counts["skipped"], time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay consultation requests from a JSONL file")
+    parser.add_argument("input", help="JSONL file of consultation requests")
+    parser.add_argument("output", help="JSONL file results are written to")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="records processed at the same time")
+    parser.add_argument("--offset", type=int, default=0, help="skip the first N lines of the input and append to the output")
+    parser.add_argument("--resume", action="store_true", help="append to the output, skipping lines it already has")
+    parser.add_argument("--no-speech", action="store_true", help="skip voice synthesis")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = asyncio.run(replay(
+            args.input,
+            args.output,
+            concurrency=args.concurrency,
+            offset=args.offset,
+            resume=args.resume,
+            speech=not args.no_speech
+        ))
+    finally:
+        shutdown_pool()
+        close_clients()
+
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
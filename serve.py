@@ -0,0 +1,100 @@
+"""
+Production server
+Runs api_backend under uvicorn with several worker processes that share the
+TTS, transcription and image caches, the job queue and the metrics through
+SHARED_STATE_DIR.
+SIGHUP restarts the workers one at a time (picking up new code and settings)
+while the others keep serving. Provider quotas and the batch token budget are
+split by the --workers count given at startup, so change the number of workers
+by restarting serve.py, not with SIGTTIN / SIGTTOU
+Run: python serve.py [--workers N] [--host HOST] [--port PORT]
+"""
+
+import os
+import shutil
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Worker processes; 0 means one per CPU available to the container
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "0"))
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+
+# Cache files and metric samples shared by all workers; point it at a volume to
+# keep the caches across deploys (SQLite needs a local disk, not NFS)
+SHARED_STATE_DIR = os.environ.get("SHARED_STATE_DIR", "var")
+
+# Seconds a stopping worker gets to finish its in-flight requests
+GRACEFUL_SHUTDOWN_TIMEOUT = float(os.environ.get("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+
+def available_cpus():
+    """CPUs this process may use, honouring a cgroup (container) CPU quota"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _default_env(name, value):
+    # Empty values (e.g. STT_CACHE_PATH= copied from .env.example) count as unset
+    if not os.environ.get(name):
+        os.environ[name] = value
+
+
+def configure_shared_state(directory, workers):
+    """Point every cache at SHARED_STATE_DIR and tell the workers how many they are.
+
+    Runs before uvicorn starts the workers, which inherit the environment.
+    """
+    os.makedirs(directory, exist_ok=True)
+    _default_env("TTS_CACHE_DIR", os.path.join(directory, "audio"))
+    _default_env("STT_CACHE_PATH", os.path.join(directory, "transcriptions.sqlite3"))
+    _default_env("IMAGE_CACHE_PATH", os.path.join(directory, "images.sqlite3"))
+    _default_env("JOBS_PATH", os.path.join(directory, "jobs.sqlite3"))
+
+    # Rate-limit quotas and the batch token budget are split between workers
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    if workers > 1:
+        _default_env("PROMETHEUS_MULTIPROC_DIR", os.path.join(directory, "metrics"))
+        # Samples left by a previous run would be added to this one's
+        metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="worker processes (0 = one per CPU)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args(argv)
+
+    workers = args.workers or available_cpus()
+    configure_shared_state(SHARED_STATE_DIR, workers)
+    print(f"Starting {workers} worker(s) on {args.host}:{args.port}, shared state in {SHARED_STATE_DIR}")
+
+    import uvicorn
+    uvicorn.run(
+        "api_backend:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+    )
+
+
+if __name__ == "__main__":
+    main()
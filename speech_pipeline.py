@@ -0,0 +1,157 @@
+"""
+Sentence-pipelined text-to-speech
+Splits a streaming LLM answer at sentence boundaries and synthesizes each
+sentence while the rest of the answer is still being generated
+"""
+
+import os
+import re
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Short fragments ("Hi.") are merged into the next sentence to avoid tiny TTS calls
+TTS_MIN_SENTENCE_CHARS = int(os.environ.get("TTS_MIN_SENTENCE_CHARS", "40"))
+
+# Whether the consultation flows use the pipelined mode by default
+TTS_PIPELINED = os.environ.get("TTS_PIPELINED", "false").lower() in ("1", "true", "yes")
+
+# Sentence end: terminal punctuation (optionally closed by a quote or bracket) followed by whitespace
+_SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+# Abbreviations that end with a period but do not end a sentence
+_ABBREVIATIONS = ("dr.", "mr.", "mrs.", "ms.", "e.g.", "i.e.", "vs.", "etc.", "approx.")
+
+
+class SentenceSplitter:
+    """Incrementally cut streamed text into complete sentences"""
+
+    def __init__(self, min_chars=TTS_MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add a chunk of text and return the sentences it completed"""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            if len(candidate) < self.min_chars:
+                continue
+            if candidate.lower().endswith(_ABBREVIATIONS):
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever is left once the stream has ended"""
+        tail = self._buffer.strip()
+        self._buffer = ""
+        return tail or None
+
+
+def synthesize_pipelined(tokens, synthesize, max_workers=4):
+    """Blocking pipeline for the Gradio apps.
+
+    Consumes the token iterator, hands every completed sentence to
+    `synthesize(text) -> bytes` on a worker thread, and returns the full
+    text together with the audio segments in sentence order.
+    """
+    splitter = SentenceSplitter()
+    text = ""
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-pipeline") as executor:
+        for token in tokens:
+            text += token
+            for sentence in splitter.feed(token):
+                futures.append(executor.submit(synthesize, sentence))
+        tail = splitter.flush()
+        if tail:
+            futures.append(executor.submit(synthesize, tail))
+
+        segments = []
+        for future in futures:
+            try:
+                segments.append(future.result())
+            except Exception as e:
+                # A gap in the middle of the answer is worse than stopping early
+                logging.error(f"Pipelined speech synthesis failed: {e}")
+                for pending in futures:
+                    pending.cancel()
+                break
+
+    return text, segments
+
+
+async def synthesize_pipelined_async(tokens, synthesize):
+    """Async pipeline for the API.
+
+    `tokens` is an async iterator of text chunks and `synthesize` a coroutine
+    function returning audio bytes. Yields ("analysis", token) as soon as each
+    token arrives and ("audio", bytes) for every sentence, strictly in order,
+    as soon as that sentence and all the ones before it are synthesized.
+    If a sentence fails, ("audio_error", exception) is yielded once and no
+    further audio follows, so callers can tell a partial clip from a full one.
+    """
+    output = asyncio.Queue()
+    audio_tasks = asyncio.Queue()
+    finished = object()
+
+    def schedule(sentence):
+        audio_tasks.put_nowait(asyncio.ensure_future(synthesize(sentence)))
+
+    async def produce_text():
+        splitter = SentenceSplitter()
+        try:
+            async for token in tokens:
+                await output.put(("analysis", token))
+                for sentence in splitter.feed(token):
+                    schedule(sentence)
+            tail = splitter.flush()
+            if tail:
+                schedule(tail)
+        except Exception as e:
+            await output.put(("error", e))
+        finally:
+            audio_tasks.put_nowait(None)
+            await output.put((finished, None))
+
+    async def produce_audio():
+        failed = False
+        while True:
+            task = await audio_tasks.get()
+            if task is None:
+                break
+            if failed:
+                task.cancel()
+                continue
+            try:
+                await output.put(("audio", await task))
+            except Exception as e:
+                logging.error(f"Pipelined speech synthesis failed: {e}")
+                failed = True
+                await output.put(("audio_error", e))
+        await output.put((finished, None))
+
+    producers = [asyncio.ensure_future(produce_text()), asyncio.ensure_future(produce_audio())]
+    try:
+        remaining = len(producers)
+        while remaining:
+            kind, value = await output.get()
+            if kind is finished:
+                remaining -= 1
+            elif kind == "error":
+                raise value
+            else:
+                yield kind, value
+    finally:
+        for producer in producers:
+            producer.cancel()
+        while not audio_tasks.empty():
+            task = audio_tasks.get_nowait()
+            if task is not None:
+                task.cancel()
@@ -0,0 +1,67 @@
+"""
+Transcription result cache keyed by audio content
+Retried uploads of the same recording are answered without calling Whisper again
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+from cache import LRUCache, SQLiteCache
+
+# How long a transcription stays valid, in seconds
+STT_CACHE_TTL = float(os.environ.get("STT_CACHE_TTL", str(24 * 3600)))
+
+# In-memory tier size (transcripts are small, this holds thousands)
+STT_CACHE_MEMORY_BYTES = int(os.environ.get("STT_CACHE_MEMORY_BYTES", str(8 * 1024 * 1024)))
+
+# Optional SQLite file shared across restarts and workers; empty disables it
+STT_CACHE_PATH = os.environ.get("STT_CACHE_PATH", "")
+STT_CACHE_MAX_ENTRIES = int(os.environ.get("STT_CACHE_MAX_ENTRIES", "100000"))
+
+
+def stt_cache_key(audio_bytes, stt_model, language):
+    """Digest of the audio content plus the parameters that change the transcript"""
+    digest = hashlib.sha256(audio_bytes).hexdigest()
+    return hashlib.sha256(json.dumps([digest, stt_model, language]).encode("utf-8")).hexdigest()
+
+
+class TranscriptionCache:
+    """Memory LRU with TTL, backed by an optional persistent SQLite cache"""
+
+    def __init__(self, ttl=STT_CACHE_TTL, memory_bytes=STT_CACHE_MEMORY_BYTES, path=STT_CACHE_PATH, max_entries=STT_CACHE_MAX_ENTRIES):
+        self._memory = LRUCache(memory_bytes, ttl=ttl, sizeof=lambda text: len(text.encode("utf-8")))
+        self._persistent = SQLiteCache(path, "transcriptions", ttl=ttl, max_entries=max_entries) if path else None
+
+    def get(self, key):
+        text = self._memory.get(key)
+        if text is None and self._persistent is not None:
+            text = self._persistent.get(key)
+            if text is not None:
+                self._memory.put(key, text)
+        return text
+
+    def put(self, key, text):
+        self._memory.put(key, text)
+        if self._persistent is not None:
+            self._persistent.put(key, text)
+
+    def stats(self):
+        return {
+            "memory": self._memory.stats(),
+            "persistent": self._persistent.stats() if self._persistent is not None else None,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_stt_cache():
+    """Return the process-wide transcription cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TranscriptionCache()
+        return _cache
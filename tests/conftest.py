@@ -0,0 +1,21 @@
+"""
+Shared test setup
+Runs against the fake upstream providers with no artificial latency, so
+nothing here needs API keys or the network
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault("PROVIDERS", "fake")
+os.environ.setdefault("FAKE_LATENCY_MS", "0")
+os.environ.setdefault("FAKE_STREAM_INTERVAL_MS", "0")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("ELEVENLABS_API_KEY", "test")
+os.environ.setdefault("UPSTREAM_WARMUP", "false")
+os.environ.setdefault("JOB_WEBHOOK_HOSTS", "hooks.test")
+
+# Keep the caches and queue the API opens out of the working tree
+_STATE_DIR = tempfile.mkdtemp(prefix="predicare-tests-")
+os.environ.setdefault("TTS_CACHE_DIR", os.path.join(_STATE_DIR, "audio"))
+os.environ.setdefault("JOBS_PATH", os.path.join(_STATE_DIR, "jobs.sqlite3"))
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import api_backend
+import rate_limit
+import stt_cache
+import tts_cache
+from providers import FakeProviderError
+from rate_limit import UpstreamRateLimited, get_limiter
+from stt_cache import TranscriptionCache
+from tts_cache import TTSCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = TTSCache(str(tmp_path))
+    monkeypatch.setattr(tts_cache, "_cache", cache)
+    return cache
+
+
+def _fail_sentence(monkeypatch, failing_call):
+    synthesize = api_backend.text_to_speech_bytes_with_elevenlabs
+    calls = []
+
+    def flaky(text, *args, **kwargs):
+        calls.append(text)
+        if len(calls) == failing_call:
+            raise RuntimeError("injected TTS failure")
+        return synthesize(text, *args, **kwargs)
+
+    monkeypatch.setattr(api_backend, "text_to_speech_bytes_with_elevenlabs", flaky)
+    return calls
+
+
+def test_pipelined_clip_is_cached_under_its_own_key(cache):
+    analysis, audio_url = asyncio.run(api_backend.pipelined_analysis_and_speech("itchy rash", "key"))
+
+    pipelined_key = api_backend._speech_key(analysis, pipelined=True)
+    assert audio_url == f"/audio/{cache.filename(pipelined_key)}"
+    assert cache.get_bytes(api_backend._speech_key(analysis)) is None
+
+
+def test_partial_pipelined_clip_is_not_cached(cache, monkeypatch):
+    calls = _fail_sentence(monkeypatch, failing_call=2)
+
+    analysis, audio_url = asyncio.run(api_backend.pipelined_analysis_and_speech("itchy rash", "key"))
+
+    assert len(calls) >= 2
+    assert analysis
+    assert audio_url is None
+    assert cache.get_bytes(api_backend._speech_key(analysis, pipelined=True)) is None
+    assert cache.get_bytes(api_backend._speech_key(analysis)) is None
+
+
+@pytest.fixture
+def transcriptions(monkeypatch):
+    cache = TranscriptionCache(path="")
+    monkeypatch.setattr(stt_cache, "_cache", cache)
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+    monkeypatch.setattr(rate_limit, "UPSTREAM_RETRY_BASE_DELAY", 0.001)
+    return cache
+
+
+def _whisper(monkeypatch, failures):
+    calls = []
+
+    def request(api_key, upload_bytes, upload_name, model, language):
+        calls.append(upload_name)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return "itchy rash"
+
+    monkeypatch.setattr(api_backend, "request_transcription_with_groq", request)
+    return calls
+
+
+def test_throttled_transcription_is_retried(transcriptions, monkeypatch):
+    calls = _whisper(monkeypatch, [FakeProviderError("stt", 429), FakeProviderError("stt", 503)])
+
+    assert asyncio.run(api_backend.transcribe_bytes(b"audio", "clip.mp3")) == "itchy rash"
+
+    limiter = get_limiter("groq", api_backend.STT_MODEL)
+    assert len(calls) == 3
+    assert (limiter.retries, limiter.throttled) == (2, 1)
+
+
+def test_transcription_throttled_past_the_retries_is_a_429(transcriptions, monkeypatch):
+    _whisper(monkeypatch, [FakeProviderError("stt", 429)] * (rate_limit.UPSTREAM_MAX_RETRIES + 1))
+
+    with pytest.raises(UpstreamRateLimited):
+        asyncio.run(api_backend.transcribe_bytes(b"audio", "clip.mp3"))
+
+
+def test_cached_transcription_skips_the_limiter(transcriptions, monkeypatch):
+    calls = _whisper(monkeypatch, [])
+    asyncio.run(api_backend.transcribe_bytes(b"audio", "clip.mp3"))
+
+    async def throttled(*args, **kwargs):
+        raise AssertionError("a cache hit must not wait for the limiter")
+
+    monkeypatch.setattr(api_backend, "call_with_retries", throttled)
+
+    assert asyncio.run(api_backend.transcribe_bytes(b"audio", "clip.mp3")) == "itchy rash"
+    assert len(calls) == 1
@@ -0,0 +1,36 @@
+import time
+
+from cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used_to_fit():
+    evicted = []
+    cache = LRUCache(10, on_evict=lambda key, value: evicted.append(key))
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+
+    cache.put("c", b"1234")
+
+    assert evicted == ["b"]
+    assert "a" in cache and "c" in cache
+    assert cache.stats()["bytes"] == 8
+
+
+def test_lru_refuses_values_above_max_bytes():
+    cache = LRUCache(4)
+    assert cache.put("a", b"12") is True
+    assert cache.put("a", b"12345") is False
+    assert cache.get("a") is None
+
+
+def test_lru_expires_entries_after_ttl():
+    evicted = []
+    cache = LRUCache(100, ttl=60, on_evict=lambda key, value: evicted.append(key))
+    cache.put("old", b"x", stored_at=time.time() - 120)
+    cache.put("new", b"x")
+
+    assert cache.get("old") is None
+    assert cache.expire() == 0
+    assert evicted == ["old"]
+    assert cache.get("new") == b"x"
@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN, is_model_failure
+from providers import FakeProviderError
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def _fail(breaker, error):
+    with pytest.raises(type(error)):
+        with breaker.guard():
+            raise error
+
+
+def test_opens_after_consecutive_model_failures():
+    breaker = CircuitBreaker("vision", failure_threshold=2, recovery_timeout=60)
+    _fail(breaker, FakeProviderError("llm"))
+    assert breaker.state == CLOSED
+    _fail(breaker, FakeProviderError("llm"))
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpen):
+        with breaker.guard():
+            pytest.fail("an open circuit must not run the call")
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_client_errors_do_not_count():
+    breaker = CircuitBreaker("vision", failure_threshold=1, recovery_timeout=60)
+    _fail(breaker, BadRequest())
+    assert breaker.state == CLOSED
+
+
+def test_only_upstream_outages_are_model_failures():
+    assert is_model_failure(FakeProviderError("llm", status_code=503))
+    assert is_model_failure(FakeProviderError("llm", status_code=408))
+    assert is_model_failure(asyncio.TimeoutError())
+    assert is_model_failure(httpx.ConnectError("connection refused"))
+
+    # Throttling and local errors without a status leave the model alone
+    assert not is_model_failure(Throttled())
+    assert not is_model_failure(ValueError("GROQ_API_KEY is not set"))
+    assert not is_model_failure(KeyError("choices"))
+
+
+def test_half_open_probe_closes_on_success():
+    breaker = CircuitBreaker("vision", failure_threshold=1, recovery_timeout=0, half_open_probes=1)
+    _fail(breaker, FakeProviderError("llm"))
+    assert breaker.state == HALF_OPEN
+
+    with breaker.guard():
+        # Only one probe at a time while half-open
+        assert breaker.allow() is False
+
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = CircuitBreaker("vision", failure_threshold=1, recovery_timeout=60)
+    _fail(breaker, FakeProviderError("llm"))
+    assert breaker.state == OPEN
+    breaker.recovery_timeout = 0
+    assert breaker.state == HALF_OPEN
+
+    breaker.recovery_timeout = 60
+    _fail(breaker, FakeProviderError("llm"))
+
+    assert breaker.state == OPEN
+    assert breaker.stats()["times_opened"] == 2
@@ -0,0 +1,118 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+
+import hedging
+import rate_limit
+import upstream_pool
+from hedging import Hedger
+
+
+@pytest.fixture
+def hedger(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGING", True)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 0.0)
+    monkeypatch.setattr(hedging, "_hedgers", {})
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+    monkeypatch.setattr(upstream_pool, "_semaphores", {})
+    return hedging.get_hedger("test-model")
+
+
+def _upstream_error(status):
+    request = httpx.Request("POST", "https://upstream.test")
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError("upstream error", request=request, response=response)
+
+
+def test_delay_uses_the_initial_value_until_enough_samples(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_INITIAL_DELAY", 3.0)
+    for latency in (0.1, 0.2, 0.3, 0.4):
+        hedger._record(latency)
+    assert hedger.delay() == 3.0
+
+
+def test_delay_is_the_configured_percentile(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_PERCENTILE", 50)
+    for latency in range(1, 11):
+        hedger._record(latency / 10)
+    assert hedger.delay() == pytest.approx(0.6)
+
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 2.0)
+    assert hedger.delay() == 2.0
+
+
+def test_hedges_are_limited_by_the_budget(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_INITIAL_DELAY", 0.01)
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET_BURST", 1.0)
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET_RATIO", 0.0)
+    slow = Hedger("slow-model")
+
+    async def scenario():
+        async def call():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        return [await slow.run(call) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == ["ok"] * 3
+    stats = slow.stats()
+    assert stats["hedges"] == 1
+    assert stats["budget_denied"] == 2
+
+
+def test_losing_attempt_keeps_its_provider_slot_until_the_thread_ends(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_INITIAL_DELAY", 0.05)
+    calls = []
+
+    def upstream():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return "primary"
+        return "hedge"
+
+    def available():
+        return upstream_pool.pool_stats()["providers"]["groq"]["available"]
+
+    async def scenario():
+        result = await rate_limit.call_with_retries(
+            "groq", upstream, limiter_model="test-model", hedge=True
+        )
+        during = available()
+        await asyncio.sleep(0.4)
+        return result, during, available()
+
+    result, during, after = asyncio.run(scenario())
+    limit = upstream_pool.PROVIDER_CONCURRENCY["groq"]
+    assert result == "hedge"
+    assert during == limit - 1
+    assert after == limit
+    assert hedger.stats()["hedge_wins"] == 1
+
+
+def test_each_attempt_is_hedged_and_timed_without_the_backoff(hedger, monkeypatch):
+    monkeypatch.setattr(rate_limit, "backoff_delay", lambda attempt: 0.2)
+    calls = []
+
+    def upstream():
+        calls.append(None)
+        if len(calls) == 1:
+            raise _upstream_error(503)
+        return "ok"
+
+    async def scenario():
+        started = time.perf_counter()
+        result = await rate_limit.call_with_retries(
+            "groq", upstream, limiter_model="test-model", hedge=True
+        )
+        return result, time.perf_counter() - started
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == "ok"
+    assert elapsed >= 0.2
+    assert hedger.calls == 2
+    assert len(hedger._latencies) == 1
+    assert hedger._latencies[0] < 0.1
@@ -0,0 +1,171 @@
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import functools
+
+import httpx
+import pytest
+
+import jobs
+from jobs import JobStore, JobQueue, QueueFull, QUEUED, RUNNING, SUCCEEDED, FAILED
+from providers import get_llm_provider
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_job_runs_through_queued_running_succeeded(store):
+    job_id = store.submit("consultation", {"query": "rash"}, {"image": b"jpeg"})
+    second_id = store.submit("consultation", {"query": "cough"}, {})
+    assert store.get(job_id)["status"] == QUEUED
+    assert store.get(second_id)["queue_position"] == 1
+
+    claimed_id, kind, payload, files = store.claim()
+    assert (claimed_id, kind, payload, files) == (job_id, "consultation", {"query": "rash"}, {"image": b"jpeg"})
+    assert store.get(job_id)["status"] == RUNNING
+    assert store.get(second_id)["queue_position"] == 0
+
+    store.finish(job_id, result={"analysis": "ok"})
+    job = store.get(job_id)
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"analysis": "ok"}
+    assert job["finished_at"] is not None
+    assert store.stats()["statuses"] == {QUEUED: 1, RUNNING: 0, SUCCEEDED: 1, FAILED: 0}
+
+
+def test_failed_job_keeps_its_error(store):
+    job_id = store.submit("consultation", {}, {})
+    store.claim()
+    store.finish(job_id, error="upstream down")
+    assert (store.get(job_id)["status"], store.get(job_id)["error"]) == (FAILED, "upstream down")
+
+
+def test_submit_refuses_when_the_queue_is_full(store):
+    assert store.submit("consultation", {}, {}, max_queued=1) is not None
+    assert store.submit("consultation", {}, {}, max_queued=1) is None
+
+
+def test_release_puts_the_job_back_without_using_an_attempt(store):
+    job_id = store.submit("consultation", {}, {"audio": b"wav"})
+    store.claim()
+    store.release(job_id)
+
+    assert store.get(job_id)["status"] == QUEUED
+    assert store.claim()[3] == {"audio": b"wav"}
+    assert store._conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == 1
+
+
+def test_sweep_requeues_abandoned_jobs_then_gives_up(store):
+    job_id = store.submit("consultation", {}, {})
+    abandoned = time.time() - 3600
+
+    store.claim()
+    store._conn.execute("UPDATE jobs SET started_at = ?", (abandoned,))
+    assert store.sweep(timeout=60, max_attempts=2) == (0, [])
+    assert store.get(job_id)["status"] == QUEUED
+
+    store.claim()
+    store._conn.execute("UPDATE jobs SET started_at = ?", (abandoned,))
+    assert store.sweep(timeout=60, max_attempts=2) == (0, [job_id])
+    assert store.get(job_id)["status"] == FAILED
+
+
+def test_sweep_removes_expired_results(store):
+    job_id = store.submit("consultation", {}, {})
+    store.claim()
+    store.finish(job_id, result={})
+    store._conn.execute("UPDATE jobs SET finished_at = ?", (time.time() - 120,))
+
+    assert store.sweep(ttl=60)[0] == 1
+    assert store.get(job_id) is None
+
+
+def _run_queue(store, handler, scenario):
+    async def main():
+        queue = JobQueue(store, workers=1)
+        queue.start({"consultation": handler})
+        try:
+            return await scenario(queue)
+        finally:
+            await queue.stop()
+
+    return asyncio.run(main())
+
+
+async def _fake_consultation(payload, files):
+    # The blocking provider call, as the real handler makes it
+    analysis = await asyncio.to_thread(
+        get_llm_provider().complete, "key", "model", [{"role": "user", "content": payload["query"]}]
+    )
+    return {"analysis": analysis}
+
+
+def test_queue_runs_jobs_and_long_polls_for_the_result(store):
+    async def scenario(queue):
+        job_id = await queue.submit("consultation", {"query": "rash"})
+        return await queue.wait(job_id, timeout=5)
+
+    job = _run_queue(store, _fake_consultation, scenario)
+    assert job["status"] == SUCCEEDED
+    assert job["result"]["analysis"]
+
+
+def test_queue_full_is_a_429_with_retry_after(store, monkeypatch):
+    monkeypatch.setattr(store, "submit", lambda *args: None)
+
+    async def scenario(queue):
+        with pytest.raises(QueueFull) as error:
+            await queue.submit("consultation", {"query": "rash"})
+        return error.value
+
+    error = _run_queue(store, _fake_consultation, scenario)
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+
+
+def test_stop_returns_the_running_job_to_the_queue(store):
+    async def hang(payload, files):
+        await asyncio.sleep(60)
+
+    async def scenario(queue):
+        job_id = await queue.submit("consultation", {})
+        while store.get(job_id)["status"] != RUNNING:
+            await asyncio.sleep(0.01)
+        return job_id
+
+    job_id = _run_queue(store, hang, scenario)
+    assert store.get(job_id)["status"] == QUEUED
+
+
+def test_webhook_is_signed_and_retried_on_server_errors(store, monkeypatch):
+    received = []
+
+    def hook(request):
+        received.append(request)
+        return httpx.Response(503 if len(received) == 1 else 204)
+
+    monkeypatch.setattr(jobs, "JOB_WEBHOOK_SECRET", "secret")
+    monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(hook)))
+    # Keep the retry backoff short
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay, *args: sleep(delay / 100, *args))
+
+    async def scenario(queue):
+        job_id = await queue.submit("consultation", {"query": "rash"}, webhook_url="http://hooks.test/done")
+        await queue.wait(job_id, timeout=5)
+        while len(received) < 2:
+            await sleep(0.01)
+        return job_id
+
+    job_id = _run_queue(store, _fake_consultation, scenario)
+
+    assert len(received) == 2
+    body = received[-1].content
+    assert json.loads(body)["job_id"] == job_id
+    assert "webhook_url" not in json.loads(body)
+    signature = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    assert received[-1].headers["X-Predicare-Signature"] == f"sha256={signature}"
@@ -0,0 +1,75 @@
+import time
+import asyncio
+
+import httpx
+
+from rate_limit import TokenBucket, AdaptiveConcurrency, retry_after_seconds
+
+
+def test_token_bucket_bursts_then_waits_for_refill():
+    async def scenario():
+        bucket = TokenBucket(rate=20, capacity=2)
+        started = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        burst = time.monotonic() - started
+        await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.02
+    assert 0.04 <= total < 0.5
+
+
+def test_token_bucket_caps_oversized_requests_at_capacity():
+    async def scenario():
+        bucket = TokenBucket(rate=1, capacity=5)
+        await asyncio.wait_for(bucket.acquire(50), 1)
+        return bucket.available()
+
+    assert asyncio.run(scenario()) < 1
+
+
+def test_adaptive_concurrency_halves_once_per_interval():
+    limiter = AdaptiveConcurrency(maximum=8, decrease_interval=60)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == 4
+
+    # About +1 per round trip of `limit` successes
+    for _ in range(5):
+        limiter.on_success()
+    assert int(limiter.limit) == 5
+
+
+def test_adaptive_concurrency_blocks_at_the_limit():
+    async def scenario():
+        limiter = AdaptiveConcurrency(maximum=2, minimum=1, decrease_interval=0)
+        await limiter.acquire()
+        await limiter.acquire()
+        limiter.on_throttle()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        await limiter.release()
+        await asyncio.sleep(0.01)
+        # One slot over the halved limit of 1 is still taken
+        still_blocked = not waiter.done()
+        await limiter.release()
+        await asyncio.wait_for(waiter, 1)
+        return blocked, still_blocked, limiter.in_flight
+
+    assert asyncio.run(scenario()) == (True, True, 1)
+
+
+def test_retry_after_from_response_or_plain_headers():
+    class ApiError(Exception):
+        def __init__(self, headers):
+            self.headers = headers
+
+    response_error = Exception()
+    response_error.response = httpx.Response(429, headers={"retry-after": "3"})
+
+    assert retry_after_seconds(response_error) == 3.0
+    assert retry_after_seconds(ApiError({"Retry-After": "7"})) == 7.0
+    assert retry_after_seconds(ApiError(None)) is None
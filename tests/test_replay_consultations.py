@@ -0,0 +1,64 @@
+import json
+import asyncio
+
+import pytest
+
+import replay_consultations
+from replay_consultations import replay
+
+
+def _write_records(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(count):
+            f.write(json.dumps({"id": index, "query": f"rash {index}"}) + "\n")
+
+
+def _result_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["line"] for line in f]
+
+
+@pytest.fixture
+def records(tmp_path):
+    path = tmp_path / "input.jsonl"
+    _write_records(path, 6)
+    return str(path)
+
+
+def test_offset_restart_keeps_earlier_results(records, tmp_path):
+    output = str(tmp_path / "results.jsonl")
+    asyncio.run(replay(records, output, concurrency=2, speech=False))
+    summary = asyncio.run(replay(records, output, concurrency=2, offset=4, speech=False))
+
+    assert summary["processed"] == 2
+    assert sorted(_result_lines(output)) == [0, 1, 2, 3, 4, 4, 5, 5]
+
+
+def test_resume_skips_finished_lines_after_a_truncated_write(records, tmp_path):
+    output = tmp_path / "results.jsonl"
+    asyncio.run(replay(records, str(output), concurrency=2, speech=False))
+    kept = output.read_text(encoding="utf-8").splitlines()[:3]
+    output.write_text("\n".join(kept) + '\n{"line": 5, "anal', encoding="utf-8")
+
+    summary = asyncio.run(replay(records, str(output), concurrency=2, resume=True, speech=False))
+
+    assert (summary["processed"], summary["skipped"]) == (3, 3)
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 7
+    assert sorted(json.loads(line)["line"] for line in lines if line.endswith("}")) == list(range(6))
+
+
+def test_output_failure_is_raised_instead_of_hanging(tmp_path, monkeypatch):
+    records = str(tmp_path / "input.jsonl")
+    _write_records(records, 20)
+
+    async def unserializable(record, base_dir, groq_api_key, speech=True):
+        return {"analysis": object()}
+
+    monkeypatch.setattr(replay_consultations, "replay_record", unserializable)
+
+    async def run():
+        return await asyncio.wait_for(replay(records, str(tmp_path / "results.jsonl"), concurrency=1), 5)
+
+    with pytest.raises(TypeError):
+        asyncio.run(run())
@@ -0,0 +1,49 @@
+from providers import FakeLLM
+from speech_pipeline import SentenceSplitter
+
+
+def _split(text, min_chars=0, chunk=3):
+    splitter = SentenceSplitter(min_chars=min_chars)
+    sentences = []
+    for start in range(0, len(text), chunk):
+        sentences.extend(splitter.feed(text[start:start + chunk]))
+    tail = splitter.flush()
+    return sentences + ([tail] if tail else [])
+
+
+def test_splits_at_sentence_ends():
+    assert _split("The rash is mild. Keep it dry! Does it itch? ") == [
+        "The rash is mild.", "Keep it dry!", "Does it itch?"
+    ]
+
+
+def test_does_not_split_after_abbreviations():
+    assert _split("Ask Dr. Smith about creams, e.g. hydrocortisone. Rest well.") == [
+        "Ask Dr. Smith about creams, e.g. hydrocortisone.", "Rest well."
+    ]
+
+
+def test_does_not_split_decimals():
+    assert _split("Apply 2.5 mg twice a day. Stop after 1.5 weeks.") == [
+        "Apply 2.5 mg twice a day.", "Stop after 1.5 weeks."
+    ]
+
+
+def test_short_fragments_join_the_next_sentence():
+    assert _split("Hi. The rash looks like mild eczema to me. ", min_chars=20) == [
+        "Hi. The rash looks like mild eczema to me."
+    ]
+
+
+def test_streamed_answer_is_reassembled_in_order():
+    tokens = list(FakeLLM().stream("key", "model", [{"role": "user", "content": "rash"}]))
+    splitter = SentenceSplitter()
+    sentences = []
+    for token in tokens:
+        sentences.extend(splitter.feed(token))
+    tail = splitter.flush()
+    if tail:
+        sentences.append(tail)
+
+    assert len(sentences) > 1
+    assert " ".join(sentences) == "".join(tokens)
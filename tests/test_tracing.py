@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import tracing
+from api_backend import app
+from tracing import _parse_traceparent
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_SPAN_ID = "00f067aa0ba902b7"
+
+
+class CollectingExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    collecting = CollectingExporter()
+    monkeypatch.setattr(tracing, "_exporter", collecting)
+    monkeypatch.setattr(tracing, "_exporter_configured", True)
+    return collecting
+
+
+def test_parse_traceparent():
+    assert _parse_traceparent(f"00-{TRACE_ID}-{PARENT_SPAN_ID}-01") == (TRACE_ID, PARENT_SPAN_ID)
+    assert _parse_traceparent(f"00-{'0' * 32}-{PARENT_SPAN_ID}-01") == (None, None)
+    assert _parse_traceparent(f"00-{'z' * 32}-{PARENT_SPAN_ID}-01") == (None, None)
+    assert _parse_traceparent("garbage") == (None, None)
+
+
+def test_incoming_traceparent_is_continued(exporter):
+    response = TestClient(app).post(
+        "/analyze",
+        json={"query": "itchy rash on my arm"},
+        headers={"traceparent": f"00-{TRACE_ID}-{PARENT_SPAN_ID}-01"},
+    )
+    assert response.status_code == 200
+    assert response.headers["x-trace-id"] == TRACE_ID
+
+    [trace] = exporter.traces
+    root = trace.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert root["traceId"] == TRACE_ID
+    assert root["parentSpanId"] == PARENT_SPAN_ID
+    # Every inner span hangs off the request span
+    assert {span.parent_span_id for span in trace.spans} == {trace.root.span_id}
+
+
+def test_server_timing_lists_the_request_steps(exporter):
+    response = TestClient(app).post("/analyze", json={"query": "itchy rash on my arm"})
+    assert response.status_code == 200
+    assert len(response.headers["x-trace-id"]) == 32
+
+    timings = response.headers["server-timing"].split(", ")
+    names = [entry.split(";")[0] for entry in timings]
+    assert "upstream_groq" in names
+    assert names[-1] == "total"
+
+
+def test_server_timing_can_be_turned_off(exporter, monkeypatch):
+    monkeypatch.setattr(tracing, "SERVER_TIMING", False)
+    response = TestClient(app).post("/analyze", json={"query": "itchy rash on my arm"})
+    assert "server-timing" not in response.headers
+    assert "x-trace-id" in response.headers
@@ -0,0 +1,32 @@
+import os
+
+from tts_cache import TTSCache, tts_cache_key
+
+
+def _clip_files(directory):
+    return [name for _, _, names in os.walk(directory) for name in names if name.endswith(".mp3")]
+
+
+def test_tts_quota_is_shared_by_workers(tmp_path):
+    # Two caches on one directory stand for two worker processes
+    first = TTSCache(str(tmp_path), max_bytes=300, ttl=0)
+    second = TTSCache(str(tmp_path), max_bytes=300, ttl=0)
+    keys = [tts_cache_key(f"sentence {i}", "voice", "model", "mp3") for i in range(6)]
+
+    for index, key in enumerate(keys):
+        (first if index % 2 else second).store(key, b"x" * 100)
+
+    assert len(_clip_files(tmp_path)) == 3
+    assert first.stats()["disk"]["bytes"] == 300
+    assert first.lookup(keys[0]) is None
+    assert second.lookup(keys[5]) == TTSCache.filename(keys[5])
+
+
+def test_tts_cache_indexes_clips_left_on_disk(tmp_path):
+    key = tts_cache_key("hello", "voice", "model", "mp3")
+    TTSCache(str(tmp_path), ttl=0).store(key, b"audio")
+    os.remove(tmp_path / "index.sqlite3")
+
+    cache = TTSCache(str(tmp_path), ttl=0)
+
+    assert cache.get_bytes(key) == b"audio"
@@ -0,0 +1,85 @@
+import io
+import os
+import asyncio
+
+import pytest
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from starlette.middleware import Middleware
+
+import uploads
+from api_backend import app
+from uploads import RequestSizeLimitMiddleware, UploadTooLarge, read_upload, save_upload
+
+ORIGIN = "https://frontend.test"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Rebuild the middleware stack with a 1 KB request limit
+    middleware = [
+        Middleware(RequestSizeLimitMiddleware, max_bytes=1024) if entry.cls is RequestSizeLimitMiddleware else entry
+        for entry in app.user_middleware
+    ]
+    monkeypatch.setattr(app, "user_middleware", middleware)
+    monkeypatch.setattr(app, "middleware_stack", None)
+    return TestClient(app)
+
+
+def _upload(data, size=None):
+    return UploadFile(io.BytesIO(data), size=size, filename="upload.bin")
+
+
+def test_read_upload_refuses_a_declared_size_over_the_limit():
+    with pytest.raises(UploadTooLarge) as error:
+        asyncio.run(read_upload(_upload(b"x" * 10, size=10), 5, "Image"))
+    assert error.value.status_code == 413
+
+
+def test_read_upload_stops_once_the_chunks_cross_the_limit(monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_SIZE", 4)
+    assert asyncio.run(read_upload(_upload(b"x" * 8), 8, "Image")) == b"x" * 8
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(_upload(b"x" * 9), 8, "Image"))
+
+
+def test_save_upload_removes_the_partial_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(uploads.tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_SIZE", 4)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(save_upload(_upload(b"x" * 9), 8, "Audio", suffix=".wav"))
+    assert os.listdir(tmp_path) == []
+
+    path = asyncio.run(save_upload(_upload(b"x" * 8), 8, "Audio", suffix=".wav"))
+    with open(path, "rb") as saved:
+        assert saved.read() == b"x" * 8
+
+
+def test_declared_oversized_request_gets_413_with_cors_headers(client):
+    response = client.post(
+        "/transcribe",
+        files={"audio": ("symptoms.wav", b"\0" * 2048, "audio/wav")},
+        headers={"Origin": ORIGIN},
+    )
+    assert response.status_code == 413
+    assert "limit" in response.json()["detail"]
+    assert "access-control-allow-origin" in response.headers
+
+
+def test_chunked_request_is_cut_off_at_the_limit(client):
+    def body():
+        for _ in range(4):
+            yield b" " * 512
+
+    response = client.post(
+        "/analyze",
+        content=body(),
+        headers={"Content-Type": "application/json", "Origin": ORIGIN},
+    )
+    assert response.status_code == 413
+    assert "access-control-allow-origin" in response.headers
+
+
+def test_transcribe_refuses_non_audio_uploads(client):
+    response = client.post("/transcribe", files={"audio": ("notes.txt", b"hello", "text/plain")})
+    assert response.status_code == 400
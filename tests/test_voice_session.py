@@ -0,0 +1,75 @@
+import io
+import math
+import wave
+import random
+import struct
+
+from voice_session import UtteranceSegmenter, pcm_to_wav
+
+RATE = 16000
+FRAME_BYTES = RATE * 30 // 1000 * 2
+
+
+def tone(ms, amplitude=8000):
+    count = RATE * ms // 1000
+    return struct.pack(f"<{count}h", *(int(amplitude * math.sin(2 * math.pi * 440 * i / RATE)) for i in range(count)))
+
+
+def noise(ms, amplitude=30):
+    rng = random.Random(ms)
+    count = RATE * ms // 1000
+    return struct.pack(f"<{count}h", *(rng.randint(-amplitude, amplitude) for _ in range(count)))
+
+
+def segment(audio, chunk=1000, **options):
+    settings = dict(frame_ms=30, padding_ms=90, end_silence_ms=300, min_speech_ms=90, max_utterance_ms=3000)
+    settings.update(options)
+    segmenter = UtteranceSegmenter(RATE, **settings)
+    events = []
+    # Uneven chunks, as a client would send them
+    for start in range(0, len(audio), chunk):
+        events.extend(segmenter.feed(audio[start:start + chunk]))
+    return events + segmenter.flush()
+
+
+def test_utterances_end_at_pauses_and_keep_padding():
+    events = segment(noise(600) + tone(900) + noise(600) + tone(900) + noise(600))
+
+    assert [event[0] for event in events] == ["speech_start", "utterance", "speech_start", "utterance"]
+    # Starts 90 ms (3 frames) of padding before the tone at 600 ms
+    assert events[0] == ("speech_start", 510)
+    assert events[1][2] == 510
+    # 30 voiced frames plus 3 frames of padding on each side
+    assert len(events[1][1]) == 36 * FRAME_BYTES
+    assert events[2] == ("speech_start", 2010)
+
+
+def test_digital_silence_counts_as_silence():
+    events = segment(noise(600, amplitude=0) + tone(900) + noise(600, amplitude=0))
+
+    assert [event[0] for event in events] == ["speech_start", "utterance"]
+
+
+def test_clicks_shorter_than_min_speech_are_dropped():
+    events = segment(noise(600) + tone(60) + noise(600))
+
+    assert events == []
+
+
+def test_long_speech_is_cut_at_max_utterance():
+    events = segment(noise(300) + tone(2000) + noise(600), max_utterance_ms=900)
+
+    utterances = [event for event in events if event[0] == "utterance"]
+    assert len(utterances) == 3
+    assert len(utterances[0][1]) == 30 * FRAME_BYTES
+
+
+def test_flush_ends_an_utterance_in_progress():
+    events = segment(noise(600) + tone(600))
+
+    assert [event[0] for event in events] == ["speech_start", "utterance"]
+
+
+def test_pcm_to_wav_header():
+    with wave.open(io.BytesIO(pcm_to_wav(tone(100), RATE))) as wav:
+        assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate(), wav.getnframes()) == (1, 2, RATE, 1600)
@@ -0,0 +1,258 @@
+"""
+Per-request tracing
+Every HTTP request gets a trace ID and a list of timed spans (upload reads,
+temp files, base64 work, upstream calls, fallbacks, TTS). Finished traces go
+to a pluggable exporter as OTLP/JSON and are summarised in a Server-Timing
+response header
+"""
+
+import os
+import json
+import time
+import logging
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from starlette.datastructures import MutableHeaders
+
+from upstream_pool import run_blocking
+
+TRACING = os.environ.get("TRACING", "true").lower() in ("1", "true", "yes")
+
+# Add the Server-Timing header (it tells clients how long each internal step took)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+# Where finished traces go: "none" or "file" (one OTLP/JSON export request per line)
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+
+SERVICE_NAME = os.environ.get("SERVICE_NAME", "predicare-api")
+
+# OTLP span kinds and status codes
+_KIND_INTERNAL = 1
+_KIND_SERVER = 2
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class Span:
+    """One timed step, recorded on the trace when it ends"""
+
+    def __init__(self, trace, name, parent_span_id, kind=_KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+        self.trace._finish(self)
+
+    def to_otlp(self):
+        record = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.start_ns + int((self.duration or 0) * 1e9)),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": _STATUS_ERROR, "message": self.error} if self.error else {"code": _STATUS_OK},
+        }
+        if self.parent_span_id:
+            record["parentSpanId"] = self.parent_span_id
+        return record
+
+
+class Trace:
+    """The root span of one request and the spans finished under it.
+
+    Spans are flat children of the request span: concurrent steps (batch
+    items, pipelined TTS) would otherwise need per-task parent tracking.
+    """
+
+    def __init__(self, name, trace_id=None, parent_span_id=None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.root = Span(self, name, parent_span_id, kind=_KIND_SERVER)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def _finish(self, span):
+        if span is not self.root:
+            with self._lock:
+                self.spans.append(span)
+
+    def start_span(self, name, **attributes):
+        return Span(self, name, self.root.span_id, attributes=attributes)
+
+    def server_timing(self):
+        """Server-Timing value: finished spans summed by name, then the total so far"""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                duration, count = totals.get(span.name, (0.0, 0))
+                totals[span.name] = (duration + span.duration, count + 1)
+        entries = []
+        for name, (duration, count) in totals.items():
+            entry = f"{name};dur={duration * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.root._started) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_otlp(self):
+        with self._lock:
+            spans = [self.root.to_otlp()] + [span.to_otlp() for span in self.spans]
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "predicare.tracing"}, "spans": spans}],
+            }]
+        }
+
+
+class FileExporter:
+    """Append each finished trace to a file as one line of OTLP/JSON"""
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        line = json.dumps(trace.to_otlp(), separators=(",", ":")) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+_EXPORTERS = {"none": lambda: None, "file": FileExporter}
+
+_exporter = None
+_exporter_configured = False
+
+
+def set_exporter(exporter):
+    """Replace the exporter; anything with an export(trace) method, or None"""
+    global _exporter, _exporter_configured
+    _exporter = exporter
+    _exporter_configured = True
+
+
+def get_exporter():
+    if not _exporter_configured:
+        if TRACE_EXPORTER not in _EXPORTERS:
+            raise ValueError(f"Unknown trace exporter '{TRACE_EXPORTER}', expected one of {sorted(_EXPORTERS)}")
+        set_exporter(_EXPORTERS[TRACE_EXPORTER]())
+    return _exporter
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record the enclosed block as a span of the current request; no-op outside one"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, **attributes)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end()
+
+
+def annotate(**attributes):
+    """Set attributes on the current request's root span"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.root.attributes.update(attributes)
+
+
+def _parse_traceparent(value):
+    """(trace_id, parent_span_id) from a W3C traceparent header, or (None, None)"""
+    parts = value.split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        try:
+            int(parts[1], 16)
+            int(parts[2], 16)
+        except ValueError:
+            return None, None
+        if parts[1] != "0" * 32:
+            return parts[1], parts[2]
+    return None, None
+
+
+class TracingMiddleware:
+    """Open a trace per request, add Server-Timing / X-Trace-Id, export when done.
+
+    Incoming W3C traceparent headers are continued. For streamed responses
+    the header can only cover what finished before the first byte; the
+    exported trace has everything.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING:
+            return await self.app(scope, receive, send)
+
+        trace_id = parent_span_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"traceparent":
+                trace_id, parent_span_id = _parse_traceparent(value.decode("latin-1"))
+                break
+
+        trace = Trace(f"{scope['method']} {scope['path']}", trace_id, parent_span_id)
+        trace.root.attributes.update({"http.request.method": scope["method"], "url.path": scope["path"]})
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.root.attributes["http.response.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    trace.root.error = f"HTTP {message['status']}"
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Trace-Id", trace.trace_id)
+                if SERVER_TIMING:
+                    headers.append("Server-Timing", trace.server_timing())
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as e:
+            trace.root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace.root.end()
+            exporter = get_exporter()
+            if exporter is not None:
+                try:
+                    await run_blocking(None, exporter.export, trace)
+                except Exception as export_error:
+                    logging.warning(f"Trace export failed: {export_error}")
@@ -0,0 +1,427 @@
+"""
+Content-addressed cache for synthesized speech
+Identical (text, voice, model, output_format) requests are synthesized once
+and served from memory or disk afterwards. Clips live in directories sharded
+by key prefix and are removed by size quota, by age and by a periodic sweep.
+The disk quota is tracked in a SQLite index inside the cache directory, so
+it holds for all workers sharing the directory together
+"""
+
+import os
+import json
+import time
+import string
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from cache import LRUCache
+
+# Where cached clips are written; served by the API under /audio/. Workers
+# sharing the directory pick up each other's clips on a miss
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "static/audio")
+
+# Disk quota for cached clips, shared by all workers using TTS_CACHE_DIR; least
+# recently used clips are deleted first
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Recently used clips also kept in memory
+TTS_CACHE_MEMORY_BYTES = int(os.environ.get("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+
+# Clips older than this many seconds are deleted (0 keeps them until the quota evicts them)
+TTS_CACHE_TTL = int(os.environ.get("TTS_CACHE_TTL", str(7 * 24 * 3600)))
+
+# How often the background sweeper removes expired clips and abandoned partial writes
+TTS_CACHE_SWEEP_INTERVAL = float(os.environ.get("TTS_CACHE_SWEEP_INTERVAL", "300"))
+
+# Keep a copy of speech streamed by /synthesize/stream so replays skip ElevenLabs
+TTS_STREAM_TEE = os.environ.get("TTS_STREAM_TEE", "true").lower() in ("1", "true", "yes")
+
+# Clips are content-addressed, so clients and CDNs may cache them indefinitely
+AUDIO_CACHE_CONTROL = os.environ.get("AUDIO_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+# Internal location of TTS_CACHE_DIR on a fronting nginx; when set the API answers
+# with X-Accel-Redirect and nginx sends the file with sendfile
+AUDIO_ACCEL_REDIRECT = os.environ.get("AUDIO_ACCEL_REDIRECT", "")
+
+_FILE_PREFIX = "tts_"
+_FILE_SUFFIX = ".mp3"
+_PART_SUFFIX = ".part"
+
+# SQLite file in TTS_CACHE_DIR holding the sizes and last use of the clips
+_INDEX_NAME = "index.sqlite3"
+
+# Characters of the key used as the shard directory name
+_SHARD_CHARS = 2
+
+# Partial writes older than this are left over from a crash
+_STALE_PART_SECONDS = 3600
+
+
+def tts_cache_key(text, voice, model, output_format, pipelined=False):
+    """Digest identifying one synthesized clip.
+
+    Clips joined from sentence-by-sentence synthesis sound different from a
+    whole-text synthesis of the same answer, so they get their own keys.
+    """
+    parts = [text, voice, model, output_format]
+    if pipelined:
+        parts.append("pipelined")
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ClipIndex:
+    """LRU index of the clips on disk, bounded by their total size, with optional TTL.
+
+    Same interface as cache.LRUCache with clip sizes as values, but kept in
+    a SQLite file (WAL mode, BEGIN IMMEDIATE) so every worker sharing the
+    cache directory sees the same entries and the quota covers them all.
+    `on_evict(key, size)` is called for each dropped clip once the change
+    is committed.
+    """
+
+    def __init__(self, path, max_bytes, ttl=None, on_evict=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS clips (key TEXT PRIMARY KEY, size INTEGER, stored_at REAL, used_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS clips_used_at ON clips (used_at)")
+
+    @contextmanager
+    def _transaction(self):
+        # Taking the write lock up front keeps the quota check and eviction atomic across processes
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _evicted(self, dropped):
+        self.evictions += len(dropped)
+        if self.on_evict:
+            for key, size in dropped:
+                self.on_evict(key, size)
+
+    def get(self, key):
+        """Return the clip's size and mark it used, or None if it is not indexed"""
+        now = time.time()
+        dropped = []
+        with self._transaction() as conn:
+            row = conn.execute("SELECT size, stored_at FROM clips WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            size, stored_at = row
+            if self.ttl is not None and now - stored_at > self.ttl:
+                conn.execute("DELETE FROM clips WHERE key = ?", (key,))
+                dropped.append((key, size))
+            else:
+                conn.execute("UPDATE clips SET used_at = ? WHERE key = ?", (now, key))
+        if dropped:
+            self.misses += 1
+            self._evicted(dropped)
+            return None
+        self.hits += 1
+        return size
+
+    def put(self, key, size, stored_at=None):
+        """Index a clip and evict the least recently used ones above max_bytes"""
+        now = time.time()
+        with self._transaction() as conn:
+            if size > self.max_bytes:
+                conn.execute("DELETE FROM clips WHERE key = ?", (key,))
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO clips (key, size, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, size, stored_at or now, now),
+            )
+            dropped = self._over_quota(conn)
+        self._evicted(dropped)
+        return True
+
+    def _over_quota(self, conn):
+        excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM clips").fetchone()[0] - self.max_bytes
+        dropped = []
+        if excess <= 0:
+            return dropped
+        for key, size in conn.execute("SELECT key, size FROM clips ORDER BY used_at"):
+            dropped.append((key, size))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM clips WHERE key = ?", [(key,) for key, _ in dropped])
+        return dropped
+
+    def sync(self, entries, scanned_at):
+        """Match the index to (stored_at, key, size) entries found on disk.
+
+        Clips missing from the index are added; rows without a clip are
+        dropped unless they were written after the scan started at
+        scanned_at, since another worker may have stored them meanwhile.
+        """
+        found = {key for _, key, _ in entries}
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO clips (key, size, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                [(key, size, stored_at, stored_at) for stored_at, key, size in entries],
+            )
+            gone = [
+                (key,) for key, used_at in conn.execute("SELECT key, used_at FROM clips")
+                if key not in found and used_at < scanned_at
+            ]
+            conn.executemany("DELETE FROM clips WHERE key = ?", gone)
+            dropped = self._over_quota(conn)
+        self._evicted(dropped)
+
+    def pop(self, key):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT size FROM clips WHERE key = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM clips WHERE key = ?", (key,))
+        return row[0] if row else None
+
+    def expire(self):
+        """Drop every clip older than the TTL and return how many were dropped"""
+        if self.ttl is None:
+            return 0
+        cutoff = time.time() - self.ttl
+        with self._transaction() as conn:
+            dropped = conn.execute("SELECT key, size FROM clips WHERE stored_at < ?", (cutoff,)).fetchall()
+            conn.execute("DELETE FROM clips WHERE stored_at < ?", (cutoff,))
+        self._evicted(dropped)
+        return len(dropped)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM clips WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM clips").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM clips").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class TTSCache:
+    """Two-tier (memory, disk) LRU cache of synthesized clips keyed by tts_cache_key"""
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES,
+                 memory_bytes=TTS_CACHE_MEMORY_BYTES, ttl=TTS_CACHE_TTL):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._disk = ClipIndex(
+            os.path.join(directory, _INDEX_NAME), max_bytes, ttl=ttl or None, on_evict=self._remove_file
+        )
+        self._memory = LRUCache(memory_bytes)
+        self._lock = threading.Lock()
+        self._shards = set()
+        self.hits = 0
+        self.misses = 0
+        self.swept = 0
+        self._load()
+
+    @staticmethod
+    def filename(key):
+        return f"{_FILE_PREFIX}{key}{_FILE_SUFFIX}"
+
+    @staticmethod
+    def key_from_filename(filename):
+        """Inverse of filename(), or None for anything that is not a clip name"""
+        if not (filename.startswith(_FILE_PREFIX) and filename.endswith(_FILE_SUFFIX)):
+            return None
+        key = filename[len(_FILE_PREFIX):-len(_FILE_SUFFIX)]
+        if len(key) != 64 or not all(c in string.hexdigits for c in key):
+            return None
+        return key
+
+    def relative_path(self, key):
+        return os.path.join(key[:_SHARD_CHARS], self.filename(key))
+
+    def path(self, key):
+        return os.path.join(self.directory, self.relative_path(key))
+
+    def _shard_dir(self, key):
+        shard = key[:_SHARD_CHARS]
+        directory = os.path.join(self.directory, shard)
+        if shard not in self._shards:
+            os.makedirs(directory, exist_ok=True)
+            self._shards.add(shard)
+        return directory
+
+    def _load(self):
+        """Bring the shared index in line with the clips on disk.
+
+        Clips written before the index existed are added by modification
+        time, and clips from before sharding, stored flat in the cache
+        directory, are moved into their shard.
+        """
+        scanned_at = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            full_path = os.path.join(self.directory, name)
+            if len(name) == _SHARD_CHARS and os.path.isdir(full_path):
+                self._shards.add(name)
+                for clip in os.listdir(full_path):
+                    key = self.key_from_filename(clip)
+                    if key is None:
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(full_path, clip))
+                    except OSError:
+                        # Evicted by another worker meanwhile
+                        continue
+                    entries.append((stat.st_mtime, key, stat.st_size))
+                continue
+            key = self.key_from_filename(name)
+            if key is not None:
+                stat = os.stat(full_path)
+                os.replace(full_path, os.path.join(self._shard_dir(key), name))
+                entries.append((stat.st_mtime, key, stat.st_size))
+        self._disk.sync(entries, scanned_at)
+
+    def _remove_file(self, key, size):
+        self._memory.pop(key)
+        try:
+            os.unlink(self.path(key))
+        except OSError:
+            pass
+
+    def _adopt(self, key):
+        """Index a clip found on disk but missing from the index; False if there is none"""
+        try:
+            stat = os.stat(self.path(key))
+        except OSError:
+            return False
+        if self._disk.ttl and time.time() - stat.st_mtime > self._disk.ttl:
+            return False
+        return self._disk.put(key, stat.st_size, stored_at=stat.st_mtime)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, key):
+        """Return the cached clip's filename, or None on a miss"""
+        # Not answered from memory: another worker may have evicted the file
+        if (self._disk.get(key) is not None and os.path.exists(self.path(key))) or self._adopt(key):
+            self._count(True)
+            return self.filename(key)
+        self._disk.pop(key)
+        self._count(False)
+        return None
+
+    def get_bytes(self, key):
+        """Return the cached clip's bytes, or None on a miss"""
+        data = self._memory.get(key)
+        if data is None and (self._disk.get(key) is not None or self._adopt(key)):
+            try:
+                with open(self.path(key), "rb") as f:
+                    data = f.read()
+                self._memory.put(key, data)
+            except OSError:
+                self._disk.pop(key)
+        self._count(data is not None)
+        return data
+
+    def store(self, key, data):
+        """Write a clip to the cache and return its filename"""
+        # Write to a temporary file first so readers never see a partial clip
+        fd, temp_path = tempfile.mkstemp(dir=self._shard_dir(key), suffix=_PART_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        self._memory.put(key, data)
+        if not self._disk.put(key, len(data)):
+            logging.warning(f"Clip of {len(data)} bytes exceeds TTS_CACHE_MAX_BYTES and was not cached")
+        return self.filename(key)
+
+    def memory_bytes(self, key):
+        """Return the clip if it is in the memory tier, without touching the disk"""
+        return self._memory.get(key)
+
+    def sweep(self):
+        """Delete expired clips and abandoned partial writes, return how many files went"""
+        removed = self._disk.expire()
+        cutoff = time.time() - _STALE_PART_SECONDS
+        for shard in list(self._shards):
+            shard_dir = os.path.join(self.directory, shard)
+            try:
+                names = os.listdir(shard_dir)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(_PART_SUFFIX):
+                    continue
+                part_path = os.path.join(shard_dir, name)
+                try:
+                    if os.stat(part_path).st_mtime < cutoff:
+                        os.unlink(part_path)
+                        removed += 1
+                except OSError:
+                    pass
+        with self._lock:
+            self.swept += removed
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "swept": self.swept,
+            "disk": self._disk.stats(),
+            "memory": self._memory.stats(),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """Return the process-wide TTS cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache()
+        return _cache
@@ -0,0 +1,139 @@
+"""
+Size-bounded upload handling
+Uploads are copied in chunks instead of being read into memory whole, and
+oversized requests are rejected with 413 before they are buffered
+"""
+
+import os
+import tempfile
+
+from fastapi import HTTPException
+from starlette.formparsers import MultiPartParser
+from starlette.responses import JSONResponse
+
+from tracing import span
+
+# Per-field limits (Whisper itself rejects audio above 25 MB)
+MAX_AUDIO_UPLOAD_BYTES = int(os.environ.get("MAX_AUDIO_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+MAX_IMAGE_UPLOAD_BYTES = int(os.environ.get("MAX_IMAGE_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+# Whole request body limit, enforced while the body is still arriving
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(50 * 1024 * 1024)))
+
+# Multipart file parts stay in memory up to this size, then roll over to disk
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+MultiPartParser.max_file_size = UPLOAD_SPOOL_THRESHOLD
+
+
+class UploadTooLarge(HTTPException):
+    """413 raised when an upload exceeds its limit"""
+
+    def __init__(self, field, limit):
+        super().__init__(
+            status_code=413,
+            detail=f"{field} upload exceeds the {limit // (1024 * 1024)} MB limit"
+        )
+
+
+def _check_declared_size(upload, field, max_bytes):
+    # Starlette records the part size once the spooled file is complete
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(field, max_bytes)
+
+
+async def save_upload(upload, max_bytes, field, suffix=""):
+    """Copy an upload to a temporary file chunk by chunk and return its path"""
+    _check_declared_size(upload, field, max_bytes)
+
+    with span("tempfile_write", field=field) as write_span:
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        written = 0
+        try:
+            with temp_file:
+                while True:
+                    chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise UploadTooLarge(field, max_bytes)
+                    temp_file.write(chunk)
+        except BaseException:
+            os.unlink(temp_file.name)
+            raise
+        if write_span is not None:
+            write_span.attributes["bytes"] = written
+        return temp_file.name
+
+
+def write_temp_file(data, suffix=""):
+    """Write bytes already in memory (e.g. a queued job's audio) to a temporary file"""
+    with span("tempfile_write", bytes=len(data)):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            temp_file.write(data)
+        return temp_file.name
+
+
+async def read_upload(upload, max_bytes, field):
+    """Read an upload into memory, refusing anything above max_bytes"""
+    _check_declared_size(upload, field, max_bytes)
+
+    with span("upload_read", field=field) as read_span:
+        buffer = bytearray()
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(buffer) + len(chunk) > max_bytes:
+                raise UploadTooLarge(field, max_bytes)
+            buffer += chunk
+        if read_span is not None:
+            read_span.attributes["bytes"] = len(buffer)
+        return bytes(buffer)
+
+
+class RequestSizeLimitMiddleware:
+    """Reject request bodies above MAX_REQUEST_BYTES with 413.
+
+    Requests that declare a larger Content-Length are refused before any
+    of the body is read; chunked bodies are cut off as soon as they cross
+    the limit.
+    """
+
+    def __init__(self, app, max_bytes=MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _detail(self):
+        return f"Request body exceeds the {self.max_bytes // (1024 * 1024)} MB limit"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > self.max_bytes:
+                    response = JSONResponse(status_code=413, content={"detail": self._detail()})
+                    return await response(scope, receive, send)
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing as-is
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
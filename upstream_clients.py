@@ -0,0 +1,127 @@
+"""
+Process-wide registry of pooled, keep-alive upstream clients
+Every module gets its Groq and ElevenLabs clients from here so connections are reused
+"""
+
+import os
+import logging
+import threading
+
+import httpx
+
+# Connection pool tuning shared by all upstream clients
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "60"))
+UPSTREAM_HTTP2 = os.environ.get("UPSTREAM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Retries inside the Groq SDK; the API retries through rate_limit instead, so
+# leaving these on would multiply attempts and hide 429s from the limiter
+GROQ_SDK_MAX_RETRIES = int(os.environ.get("GROQ_SDK_MAX_RETRIES", "0"))
+
+GROQ_BASE_URL = "https://api.groq.com"
+ELEVENLABS_BASE_URL = "https://api.elevenlabs.io"
+
+_lock = threading.Lock()
+_clients = {}
+_http_clients = {}
+_voice_ids = {}
+
+
+def _http2_enabled():
+    if not UPSTREAM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logging.warning("UPSTREAM_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1")
+        return False
+    return True
+
+
+def _build_http_client():
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=UPSTREAM_TIMEOUT,
+        http2=_http2_enabled(),
+    )
+
+
+def get_groq_client(api_key=None):
+    """Return the shared Groq client for this API key"""
+    api_key = api_key or os.environ.get("GROQ_API_KEY")
+    key = ("groq", api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from groq import Groq
+            http_client = _build_http_client()
+            client = Groq(api_key=api_key, http_client=http_client, max_retries=GROQ_SDK_MAX_RETRIES)
+            _clients[key] = client
+            _http_clients[key] = (http_client, GROQ_BASE_URL)
+        return client
+
+
+def get_elevenlabs_client(api_key=None):
+    """Return the shared ElevenLabs client for this API key"""
+    api_key = api_key or os.environ.get("ELEVENLABS_API_KEY")
+    key = ("elevenlabs", api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from elevenlabs.client import ElevenLabs
+            http_client = _build_http_client()
+            client = ElevenLabs(api_key=api_key, httpx_client=http_client)
+            _clients[key] = client
+            _http_clients[key] = (http_client, ELEVENLABS_BASE_URL)
+        return client
+
+
+def resolve_elevenlabs_voice(client, voice_name):
+    """Map a voice name to its ID once instead of listing voices on every request"""
+    key = (id(client), voice_name)
+    voice_id = _voice_ids.get(key)
+    if voice_id is None:
+        voices = client.voices.get_all(show_legacy=True).voices
+        voice_id = next((v.voice_id for v in voices if v.name == voice_name), None)
+        if voice_id is None:
+            # Let the SDK raise its own "voice not found" error
+            return voice_name
+        _voice_ids[key] = voice_id
+    return voice_id
+
+
+def warm_up():
+    """Open a keep-alive connection to every configured upstream.
+
+    Called once at application startup so the first real request does not
+    pay for DNS, TCP and TLS setup.
+    """
+    if os.environ.get("GROQ_API_KEY"):
+        get_groq_client()
+    if os.environ.get("ELEVENLABS_API_KEY"):
+        get_elevenlabs_client()
+
+    with _lock:
+        targets = list(_http_clients.values())
+
+    for http_client, base_url in targets:
+        try:
+            http_client.head(base_url)
+        except httpx.HTTPError as e:
+            logging.warning(f"Warm-up request to {base_url} failed: {e}")
+
+
+def close_clients():
+    """Close every pooled connection"""
+    with _lock:
+        for http_client, _ in _http_clients.values():
+            http_client.close()
+        _clients.clear()
+        _http_clients.clear()
+        _voice_ids.clear()
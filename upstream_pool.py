@@ -0,0 +1,145 @@
+"""
+Bounded execution pool for the blocking upstream SDKs
+Runs Groq and ElevenLabs calls off the event loop with per-provider concurrency limits
+"""
+
+import os
+import asyncio
+import threading
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Total number of threads available for blocking upstream work
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "64"))
+
+# Maximum number of in-flight calls per provider
+PROVIDER_CONCURRENCY = {
+    "groq": int(os.environ.get("GROQ_MAX_CONCURRENCY", "32")),
+    "elevenlabs": int(os.environ.get("ELEVENLABS_MAX_CONCURRENCY", "16")),
+}
+
+_executor = None
+_semaphores = {}
+
+
+def get_executor():
+    """Return the shared thread pool, creating it on first use"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=UPSTREAM_POOL_SIZE,
+            thread_name_prefix="upstream"
+        )
+    return _executor
+
+
+def _get_semaphore(provider):
+    semaphore = _semaphores.get(provider)
+    if semaphore is None:
+        limit = PROVIDER_CONCURRENCY.get(provider, UPSTREAM_POOL_SIZE)
+        semaphore = asyncio.Semaphore(limit)
+        _semaphores[provider] = semaphore
+    return semaphore
+
+
+async def _submit(provider, call):
+    """Start `call` in the pool once the provider has a free slot.
+
+    The slot is released when the thread finishes, not when the awaiting
+    task is cancelled (e.g. the losing side of a hedged request), so the
+    provider limit counts calls that are really still running.
+    """
+    loop = asyncio.get_running_loop()
+    if provider is None:
+        return get_executor().submit(call)
+
+    semaphore = _get_semaphore(provider)
+    await semaphore.acquire()
+    try:
+        future = get_executor().submit(call)
+    except BaseException:
+        semaphore.release()
+        raise
+
+    def release(_):
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            # The loop is closed, nobody is left waiting for the slot
+            pass
+
+    future.add_done_callback(release)
+    return future
+
+
+async def run_blocking(provider, fn, *args, **kwargs):
+    """Run a blocking call in the pool without stalling the event loop.
+
+    At most PROVIDER_CONCURRENCY[provider] calls for the same provider run at
+    once; further callers wait here instead of piling up threads.
+    """
+    ctx = contextvars.copy_context()
+    future = await _submit(provider, functools.partial(ctx.run, fn, *args, **kwargs))
+    return await asyncio.wrap_future(future)
+
+
+async def iterate_blocking(provider, fn, *args, **kwargs):
+    """Consume a blocking iterator in the pool and yield its items asynchronously.
+
+    Used for streaming SDK responses: the provider slot is held until the
+    pool thread returns, i.e. the iterator is exhausted or, after the
+    consumer stops early, the next item arrives.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def pump():
+        try:
+            for item in fn(*args, **kwargs):
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+    future = await _submit(provider, functools.partial(ctx.run, pump))
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                break
+            yield item
+        await asyncio.wrap_future(future)
+    finally:
+        stop.set()
+
+
+def pool_stats():
+    """Snapshot of configured limits and current free slots per provider"""
+    return {
+        "pool_size": UPSTREAM_POOL_SIZE,
+        "providers": {
+            provider: {
+                "limit": limit,
+                "available": _semaphores[provider]._value if provider in _semaphores else limit,
+            }
+            for provider, limit in PROVIDER_CONCURRENCY.items()
+        },
+    }
+
+
+def shutdown_pool():
+    """Stop the shared pool, letting in-flight calls finish"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+    _semaphores.clear()
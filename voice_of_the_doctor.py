@@ -4,9 +4,9 @@ load_dotenv()
 
 #Step1a: Setup Text to Speech–TTS–model with gTTS
 import os
-from gtts import gTTS
 
 def text_to_speech_with_gtts_old(input_text, output_filepath):
+    from gtts import gTTS
     language="en"
 
     audioobj= gTTS(
@@ -18,21 +18,25 @@ def text_to_speech_with_gtts_old(input_text, output_filepath):
 
 
 input_text="Hi this is Ai with Hassan!"
-text_to_speech_with_gtts_old(input_text=input_text, output_filepath="gtts_testing.mp3")
+#text_to_speech_with_gtts_old(input_text=input_text, output_filepath="gtts_testing.mp3")
 
 #Step1b: Setup Text to Speech–TTS–model with ElevenLabs
-import elevenlabs
-from elevenlabs.client import ElevenLabs
+from upstream_clients import get_elevenlabs_client, resolve_elevenlabs_voice
+from providers import get_tts_provider
 
 ELEVENLABS_API_KEY=os.environ.get("ELEVENLABS_API_KEY")
+ELEVENLABS_VOICE="Aria"
+ELEVENLABS_MODEL="eleven_turbo_v2"
+ELEVENLABS_OUTPUT_FORMAT="mp3_22050_32"
 
 def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
-    client=ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    import elevenlabs
+    client=get_elevenlabs_client(ELEVENLABS_API_KEY)
     audio=client.generate(
         text= input_text,
-        voice= "Aria",
-        output_format= "mp3_22050_32",
-        model= "eleven_turbo_v2"
+        voice= resolve_elevenlabs_voice(client, ELEVENLABS_VOICE),
+        output_format= ELEVENLABS_OUTPUT_FORMAT,
+        model= ELEVENLABS_MODEL
     )
     elevenlabs.save(audio, output_filepath)
 
@@ -44,6 +48,7 @@ import subprocess
 import platform
 
 def text_to_speech_with_gtts(input_text, output_filepath):
+    from gtts import gTTS
     language="en"
 
     audioobj= gTTS(
@@ -74,14 +79,27 @@ def text_to_speech_with_elevenlabs(input_text, output_filepath):
     if not ELEVENLABS_API_KEY:
         raise ValueError("ELEVENLABS_API_KEY not found in environment variables")
     
-    client=ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    audio=client.generate(
-        text= input_text,
-        voice= "Aria",
-        output_format= "mp3_22050_32",
-        model= "eleven_turbo_v2"
-    )
-    elevenlabs.save(audio, output_filepath)
+    audio=text_to_speech_bytes_with_elevenlabs(input_text)
+    with open(output_filepath, "wb") as f:
+        f.write(audio)
     return output_filepath
 
+def text_to_speech_bytes_with_elevenlabs(input_text):
+    """Return the synthesized MP3 as bytes instead of writing it to disk"""
+    if not ELEVENLABS_API_KEY:
+        raise ValueError("ELEVENLABS_API_KEY not found in environment variables")
+    
+    return get_tts_provider().synthesize(
+        ELEVENLABS_API_KEY, input_text, ELEVENLABS_VOICE, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT
+    )
+
+def stream_text_to_speech_with_elevenlabs(input_text):
+    """Yield MP3 chunks as ElevenLabs produces them instead of saving a file"""
+    if not ELEVENLABS_API_KEY:
+        raise ValueError("ELEVENLABS_API_KEY not found in environment variables")
+    
+    yield from get_tts_provider().stream(
+        ELEVENLABS_API_KEY, input_text, ELEVENLABS_VOICE, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT
+    )
+
 #text_to_speech_with_elevenlabs(input_text, output_filepath="elevenlabs_testing_autoplay.mp3")
\ No newline at end of file
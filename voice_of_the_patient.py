@@ -5,9 +5,6 @@ load_dotenv()
 #Step1: Setup Audio recorder (ffmpeg & portaudio)
 # ffmpeg, portaudio, pyaudio
 import logging
-import speech_recognition as sr
-from pydub import AudioSegment
-from io import BytesIO
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -20,6 +17,11 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
     timeout (int): Maximum time to wait for a phrase to start (in seconds).
     phrase_time_lfimit (int): Maximum time for the phrase to be recorded (in seconds).
     """
+    # Only needed for recording, the API and Gradio apps never load them
+    import speech_recognition as sr
+    from pydub import AudioSegment
+    from io import BytesIO
+    
     recognizer = sr.Recognizer()
     
     try:
@@ -47,27 +49,50 @@ audio_filepath="patient_voice_test_for_patient.mp3"
 
 #Step2: Setup Speech to text–STT–model for transcription
 import os
-from groq import Groq
+from providers import get_stt_provider
+from stt_cache import get_stt_cache, stt_cache_key
+from audio_preprocessing import preprocess_audio
 
 GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
 stt_model="whisper-large-v3"
 
-def transcribe_with_groq(GROQ_API_KEY, audio_filepath, stt_model):
+def transcribe_with_groq(GROQ_API_KEY, audio_filepath, stt_model, language="en"):
     if not GROQ_API_KEY:
         raise ValueError("GROQ_API_KEY not found in environment variables")
     
     if not audio_filepath or not os.path.exists(audio_filepath):
         raise ValueError(f"Audio file not found: {audio_filepath}")
     
-    client = Groq(api_key=GROQ_API_KEY)
+    with open(audio_filepath, "rb") as audio_file:
+        audio_bytes = audio_file.read()
     
-    try:
-        with open(audio_filepath, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model=stt_model,
-                file=audio_file,
-                language="en"
-            )
-        return transcription.text
-    except Exception as e:
-        raise Exception(f"Error transcribing audio: {str(e)}")
+    return transcribe_bytes_with_groq(GROQ_API_KEY, audio_bytes, os.path.basename(audio_filepath), stt_model, language)
+
+def transcribe_bytes_with_groq(GROQ_API_KEY, audio_bytes, filename, stt_model, language="en"):
+    """transcribe_with_groq for audio already in memory, e.g. one utterance of a live voice session"""
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not found in environment variables")
+    
+    # Identical recordings (e.g. client retries) are only transcribed once
+    cache = get_stt_cache()
+    cache_key = stt_cache_key(audio_bytes, stt_model, language)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # 16 kHz mono, silence trimmed, compact codec
+    upload_bytes, upload_name = preprocess_audio(audio_bytes, filename)
+    
+    transcription = request_transcription_with_groq(GROQ_API_KEY, upload_bytes, upload_name, stt_model, language)
+    cache.put(cache_key, transcription)
+    return transcription
+
+def request_transcription_with_groq(GROQ_API_KEY, upload_bytes, upload_name, stt_model, language="en"):
+    """The Whisper request alone, for audio that is already preprocessed
+    
+    SDK errors are raised unchanged: their status code and Retry-After are
+    what the API's retry loop and rate limiter act on.
+    """
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not found in environment variables")
+    return get_stt_provider().transcribe(GROQ_API_KEY, upload_bytes, upload_name, stt_model, language)
@@ -0,0 +1,178 @@
+"""
+Live voice sessions
+Splits a stream of PCM audio into utterances with the energy-based voice
+activity detector from audio_preprocessing, so each utterance can be
+transcribed as soon as the patient stops speaking
+"""
+
+import os
+import io
+import wave
+from collections import deque
+
+from audio_preprocessing import (
+    frame_levels,
+    speech_threshold,
+    AUDIO_TARGET_SAMPLE_RATE,
+    AUDIO_VAD_FRAME_MS,
+    AUDIO_VAD_PADDING_MS
+)
+
+# Silence after speech that ends an utterance; shorter values cut sentences at pauses
+VOICE_END_SILENCE_MS = int(os.environ.get("VOICE_END_SILENCE_MS", "500"))
+
+# Voiced audio needed before an utterance counts, so clicks and coughs are ignored
+VOICE_MIN_SPEECH_MS = int(os.environ.get("VOICE_MIN_SPEECH_MS", "200"))
+
+# Utterances are cut at this length even without a pause
+VOICE_MAX_UTTERANCE_MS = int(os.environ.get("VOICE_MAX_UTTERANCE_MS", "30000"))
+
+# Speech must also be this far above the background noise of the recent audio
+VOICE_NOISE_MARGIN_DB = float(os.environ.get("VOICE_NOISE_MARGIN_DB", "10"))
+
+# Recent audio the adaptive threshold is computed from
+VOICE_LEVEL_WINDOW_MS = int(os.environ.get("VOICE_LEVEL_WINDOW_MS", "10000"))
+
+# Longest session, in seconds, before the server closes it
+VOICE_MAX_SESSION_SECONDS = float(os.environ.get("VOICE_MAX_SESSION_SECONDS", "900"))
+
+# Sample rates accepted from clients
+VOICE_MIN_SAMPLE_RATE = 8000
+VOICE_MAX_SAMPLE_RATE = 48000
+
+# 16-bit little-endian mono PCM
+SAMPLE_WIDTH = 2
+
+
+def pcm_to_wav(pcm, sample_rate):
+    """Wrap raw PCM in a WAV header so the transcription path can decode it"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class UtteranceSegmenter:
+    """Find utterances in PCM audio as it arrives.
+
+    feed() takes chunks of any length and returns the events they complete:
+    ("speech_start", offset_ms) once an utterance has enough voiced audio,
+    then ("utterance", pcm, offset_ms) when it is followed by
+    VOICE_END_SILENCE_MS of silence. Utterances keep AUDIO_VAD_PADDING_MS of
+    audio on both sides, like trim_silence. The threshold follows the
+    recent audio: speech_threshold() of the last VOICE_LEVEL_WINDOW_MS, and
+    at least VOICE_NOISE_MARGIN_DB above its noise floor.
+    """
+
+    def __init__(
+        self,
+        sample_rate=AUDIO_TARGET_SAMPLE_RATE,
+        frame_ms=AUDIO_VAD_FRAME_MS,
+        padding_ms=AUDIO_VAD_PADDING_MS,
+        end_silence_ms=VOICE_END_SILENCE_MS,
+        min_speech_ms=VOICE_MIN_SPEECH_MS,
+        max_utterance_ms=VOICE_MAX_UTTERANCE_MS
+    ):
+        # Imported here: pydub probes for ffmpeg on import, which slows startup
+        from pydub import AudioSegment
+        self._audio_segment = AudioSegment
+
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_bytes = sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        self.padding_frames = max(1, padding_ms // frame_ms)
+        self.end_silence_frames = max(1, end_silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_frames = max(1, max_utterance_ms // frame_ms)
+
+        self._pending = bytearray()
+        self._levels = deque(maxlen=max(1, VOICE_LEVEL_WINDOW_MS // frame_ms))
+        self._preroll = deque(maxlen=self.padding_frames)
+        self._position = 0
+        self._start = None
+        self._frames = []
+        self._voiced = 0
+        self._silent = 0
+
+    def _offset_ms(self, frame_index):
+        return frame_index * self.frame_ms
+
+    def threshold(self):
+        levels = sorted(self._levels)
+        threshold = speech_threshold(levels)
+        if levels:
+            # Digital silence (-inf) is part of the floor too, and then adds no constraint
+            noise_floor = levels[len(levels) // 10]
+            threshold = max(threshold, noise_floor + VOICE_NOISE_MARGIN_DB)
+        return threshold
+
+    def feed(self, pcm):
+        self._pending += pcm
+        count = len(self._pending) // self.frame_bytes
+        if not count:
+            return []
+        data = bytes(self._pending[:count * self.frame_bytes])
+        del self._pending[:count * self.frame_bytes]
+
+        segment = self._audio_segment(data=data, sample_width=SAMPLE_WIDTH, frame_rate=self.sample_rate, channels=1)
+        levels = frame_levels(segment, self.frame_ms)
+        self._levels.extend(levels)
+        threshold = self.threshold()
+
+        events = []
+        for index, level in enumerate(levels):
+            frame = data[index * self.frame_bytes:(index + 1) * self.frame_bytes]
+            events.extend(self._frame(frame, level > threshold))
+        return events
+
+    def flush(self):
+        """End the current utterance now, e.g. when the client stops sending"""
+        if self._start is None:
+            return []
+        return self._finish()
+
+    def _frame(self, frame, voiced):
+        self._position += 1
+        if self._start is None:
+            if not voiced:
+                self._preroll.append(frame)
+                return []
+            self._start = self._position - 1 - len(self._preroll)
+            self._frames = list(self._preroll)
+            self._preroll.clear()
+            self._voiced = 0
+            self._silent = 0
+
+        self._frames.append(frame)
+        if voiced:
+            self._voiced += 1
+            self._silent = 0
+        else:
+            self._silent += 1
+
+        events = []
+        if voiced and self._voiced == self.min_speech_frames:
+            events.append(("speech_start", self._offset_ms(self._start)))
+        if self._silent >= self.end_silence_frames or len(self._frames) >= self.max_frames:
+            events.extend(self._finish())
+        return events
+
+    def _finish(self):
+        # Keep only the padding of the trailing silence
+        frames = self._frames
+        surplus = max(0, self._silent - self.padding_frames)
+        if surplus:
+            frames = frames[:-surplus]
+        events = []
+        if self._voiced >= self.min_speech_frames:
+            events.append(("utterance", b"".join(frames), self._offset_ms(self._start)))
+        # The silence just dropped is the pre-roll of the next utterance
+        self._preroll.extend(self._frames[len(self._frames) - self._silent:])
+        self._start = None
+        self._frames = []
+        self._voiced = 0
+        self._silent = 0
+        return events